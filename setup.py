@@ -12,8 +12,12 @@ setup(
 'llama_index',
 'yaml',
 'pandas',
-'pymysql'
+'pymysql',
+'sqlglot>=25.0.0'
     ],
+    extras_require={  # 可选依赖
+        'arrow': ['pyarrow>=14.0.0'],  # arrow 输出格式和 parquet/arrow 结果文件
+    },
     author='Bruce Luo',  # 作者
     author_email='godot.lzl@alibaba-inc.com',  # 作者邮箱
     description='A MCP server of natural language interface to Database',  # 简短描述
@@ -1,4 +1,7 @@
+from typing import List, Optional
+
 from utils.db_source import HITLSQLDatabase
+from utils.schema_linker import SchemaLinker
 
 class DataBaseEnv:
     def __init__(self, database: HITLSQLDatabase):
@@ -6,4 +9,39 @@ class DataBaseEnv:
         self.dialect = database.dialect
         self.mschema = database.mschema
         self.db_name = database.db_name
-        self.mschema_str = self.mschema.to_mschema()
\ No newline at end of file
+        self.mschema_str = self.mschema.to_canonical_mschema()
+        self._schema_linker = None
+
+    def refresh(self):
+        """M-Schema 增量更新后重新生成 prompt 中使用的 schema 字符串，未变化的表直接复用渲染缓存"""
+        self.mschema_str = self.mschema.to_canonical_mschema()
+
+    @property
+    def schema_linker(self) -> SchemaLinker:
+        """按 schema 版本缓存的表检索索引，schema 变化后重新构建"""
+        linker = self._schema_linker
+        if linker is None or linker.version != self.mschema.version:
+            linker = SchemaLinker(self.mschema)
+            self._schema_linker = linker
+        return linker
+
+    def question_mschema_str(self, question: str, top_k: int = 0, min_tables: int = 0,
+                             required_tables: Optional[List[str]] = None) -> str:
+        """
+        根据问题裁剪 M-Schema，只保留检索到的相关表及其外键关联表
+
+        Args:
+            question: 用户问题
+            top_k: 检索的表数量，<=0 表示不裁剪
+            min_tables: 表数量不超过该值时不裁剪
+            required_tables: 必须保留的表，例如问题中的取值所在的表
+        """
+        if top_k <= 0 or len(self.mschema.tables) <= max(min_tables, top_k):
+            return self.mschema_str
+        selected_tables = self.schema_linker.select_tables(question, top_k)
+        if len(selected_tables) == 0:
+            return self.mschema_str
+        for table_name in required_tables or []:
+            if table_name not in selected_tables and self.mschema.has_table(table_name):
+                selected_tables.append(table_name)
+        return self.mschema.to_canonical_mschema(selected_tables=selected_tables)
@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from database_env import DataBaseEnv
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger("xiyan_mcp_server")
+
+
+class SchemaRegistry:
+    """
+    进程级的 DataBaseEnv 注册表
+
+    每个配置的数据库只构建一次 HITLSQLDatabase / M-Schema，在所有请求（get_data、read_schema 等）之间共享，
+    超过 TTL 或被显式失效后才会重新构建。
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        """
+        Args:
+            ttl: DataBaseEnv 的有效期（秒），None 或 <=0 表示永不过期，只能显式失效
+        """
+        self._ttl = ttl if ttl and ttl > 0 else None
+        self._builders: Dict[str, Callable[[], DataBaseEnv]] = {}
+        self._entries: Dict[str, Tuple[DataBaseEnv, float]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        # 并发的构建请求合并为一次，所有等待者共享构建结果或异常
+        self._builds = SingleFlight()
+        self._listeners: List[Callable[[str, List[str]], None]] = []
+        self._poller: Optional[threading.Thread] = None
+
+    def register(self, name: str, builder: Callable[[], DataBaseEnv]):
+        """注册一个数据库及其 DataBaseEnv 构建函数"""
+        self._builders[name] = builder
+        self._locks.setdefault(name, threading.Lock())
+
+    def names(self) -> List[str]:
+        return list(self._builders.keys())
+
+    def _is_fresh(self, built_at: float) -> bool:
+        return self._ttl is None or time.time() - built_at < self._ttl
+
+    def get(self, name: str) -> DataBaseEnv:
+        """获取共享的 DataBaseEnv，不存在或已过期时构建"""
+        if name not in self._builders:
+            raise KeyError(f"Database {name} is not registered")
+
+        entry = self._entries.get(name)
+        if entry is not None and self._is_fresh(entry[1]):
+            return entry[0]
+        return self._builds.do(name, self._build, name)
+
+    def _build(self, name: str) -> DataBaseEnv:
+        # 与 refresh_tables 互斥
+        with self._locks[name]:
+            # 等待锁期间可能已经被其他请求构建好了
+            entry = self._entries.get(name)
+            if entry is not None and self._is_fresh(entry[1]):
+                return entry[0]
+
+            start = time.time()
+            try:
+                env = self._builders[name]()
+            except Exception as e:
+                if entry is not None:
+                    # 刷新失败时继续使用旧的 schema，避免数据库抖动导致服务不可用
+                    logger.error(f"Refreshing schema of {name} failed, serving stale schema: {e}")
+                    return entry[0]
+                raise
+            self._entries[name] = (env, time.time())
+            logger.info(f"Schema of {name} built in {time.time() - start:.2f}s")
+            return env
+
+    def invalidate(self, name: Optional[str] = None):
+        """显式失效，name 为 None 时失效所有数据库，下一次 get 时重新构建"""
+        if name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(name, None)
+
+    def add_listener(self, listener: Callable[[str, List[str]], None]):
+        """注册表结构变化的回调，参数为数据库名和发生变化(新增/修改/删除)的表"""
+        self._listeners.append(listener)
+
+    def refresh_tables(self, name: str, table_names: Optional[List[str]] = None) -> Dict[str, List[str]]:
+        """
+        增量刷新已构建的 DataBaseEnv，只重新读取变化的表，未构建时直接构建
+
+        Args:
+            name: 数据库名
+            table_names: 强制刷新的表，None 表示根据表结构指纹自动检测
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            env = self.get(name)
+            return {"added": list(env.mschema.tables.keys()), "changed": [], "removed": []}
+
+        env = entry[0]
+        with self._locks[name]:
+            diff = env.database.refresh_tables(table_names)
+            changed = diff["added"] + diff["changed"] + diff["removed"]
+            if len(changed) > 0:
+                env.refresh()
+                logger.info(f"Schema of {name} refreshed: {diff}")
+        if len(changed) > 0:
+            for listener in self._listeners:
+                listener(name, changed)
+        return diff
+
+    def start_poller(self, interval: float):
+        """启动后台线程，每隔 interval 秒检测一次已构建数据库的表结构变化并增量刷新"""
+        if interval is None or interval <= 0 or self._poller is not None:
+            return
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                for name in list(self._entries.keys()):
+                    try:
+                        self.refresh_tables(name)
+                    except Exception as e:
+                        logger.error(f"Polling schema changes of {name} failed: {e}")
+
+        self._poller = threading.Thread(target=poll, name="schema-poller", daemon=True)
+        self._poller.start()
+
+    def stats(self) -> Dict[str, Dict]:
+        info = {}
+        for name in self._builders:
+            entry = self._entries.get(name)
+            info[name] = {
+                "built": entry is not None,
+                "age_seconds": None if entry is None else round(time.time() - entry[1], 1),
+                "ttl_seconds": self._ttl,
+            }
+        return info
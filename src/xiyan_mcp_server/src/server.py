@@ -1,22 +1,46 @@
 import argparse
+import asyncio
+import base64
 import logging
 import os
-from typing import Literal
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import replace
+from typing import Any, Literal, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote
 import yaml  # 添加yaml库导入
 
-from mysql.connector import connect, Error
 from mcp.server import  FastMCP
-from mcp.types import TextContent
+from mcp.server.fastmcp import Context
+from mcp.server.lowlevel.helper_types import ReadResourceContents
+from mcp.types import BlobResourceContents, EmbeddedResource, TextContent
 from starlette.requests import Request
 from starlette.responses import Response, JSONResponse
-from sqlalchemy import text
+from sqlalchemy import create_engine, inspect, text
 
+from utils.continuation import ContinuationTokens
 from utils.db_config import DBConfig
 from database_env import DataBaseEnv
+from schema_registry import SchemaRegistry
+from utils.db_router import ReadRouter
 from utils.db_source import HITLSQLDatabase
-from utils.db_util import init_db_conn
+from utils.db_util import configure_db_executor, get_shared_engine, get_pool_status, paginate_sql, run_in_db_executor
 from utils.file_util import extract_sql_from_qwen
-from utils.llm_util import call_openai_sdk
+from utils.llm_util import acall_openai_sdk, configure_llm_client
+from utils.local_sync import LocalSync
+from utils.query_cost import CostGuard, is_timeout_error
+from utils.result_cache import ResultCache
+from utils.result_format import MIME_TYPES, check_format, format_rows, to_arrow
+from utils.result_store import ResultStore
+from utils.semantic_cache import SemanticCache, literal_signature
+from utils.single_flight import AsyncSingleFlight
+from utils.sql_cache import SQLCache, normalize_question
+from utils.sql_validator import canonical_sql, validate_sql
+from utils.sql_validator import is_available as sql_validator_available
+from utils.value_index import ValueIndex, text_columns, value_hints
 
 
 
@@ -47,62 +71,444 @@ def get_yml_config():
 
 def get_xiyan_config(db_config):
     dialect = db_config.get('dialect','mysql')
-    xiyan_db_config = DBConfig(dialect=dialect,db_name=db_config['database'], user_name=db_config['user'], db_pwd=db_config['password'], db_host=db_config['host'], port=db_config['port'])
+    if dialect == 'sqlite':
+        # SQLite 只需要 db_path，例如 --sync-local 生成的本地副本；相对路径与 local_sync.path 一样相对于 server.py 所在目录
+        db_path = db_config.get('db_path')
+        if db_path:
+            db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), db_path)
+        xiyan_db_config = DBConfig(dialect=dialect, db_name=db_config.get('database'), db_path=db_path)
+    else:
+        xiyan_db_config = DBConfig(dialect=dialect,db_name=db_config['database'], user_name=db_config['user'], db_pwd=db_config['password'], db_host=db_config['host'], port=db_config['port'])
+    # 连接池参数，未配置时使用 DBConfig 的默认值
+    for pool_option in ['pool_size', 'max_overflow', 'pool_recycle', 'pool_pre_ping']:
+        if pool_option in db_config:
+            setattr(xiyan_db_config, pool_option, db_config[pool_option])
     return xiyan_db_config
 
 
 global_config = get_yml_config()
 mcp_config = global_config.get('mcp', {})
 model_config = global_config['model']
+schema_linking_config = global_config.get('schema_linking', {})
+value_index_config = global_config.get('value_index', {})
+result_cache_config = global_config.get('result_cache', {})
+sql_cache_config = global_config.get('sql_cache', {})
+semantic_cache_config = global_config.get('semantic_cache', {})
+generation_config = global_config.get('generation', {})
+cost_guard_config = global_config.get('cost_guard', {})
+table_preview_config = global_config.get('table_preview', {})
+pagination_config = global_config.get('pagination', {})
+result_store_config = global_config.get('result_store', {})
+local_sync_config = global_config.get('local_sync', {})
+# LLM 客户端在进程内复用，连接池、超时和重试次数来自 model 配置
+configure_llm_client(**{option: model_config[option] for option in
+                        ['timeout', 'connect_timeout', 'max_connections', 'max_keepalive_connections',
+                         'keepalive_expiry', 'max_retries'] if option in model_config})
 global_db_config = global_config.get('database')
 global_xiyan_db_config = get_xiyan_config(global_db_config)
 dialect = global_db_config.get('dialect','mysql')
+global_db_name = global_db_config.get('database','')
+table_pattern = global_db_config.get('table_pattern', r"jn_cadre_info.*")
+# get_data 最多返回的行数，以及是否把行数限制以 LIMIT 的形式下推到数据库
+max_rows = global_db_config.get('max_rows', 100)
+limit_push_down = global_db_config.get('limit_push_down', True)
+# 执行前是否先在本地校验SQL的语法和表名、字段名(需要安装 sqlglot)
+sql_validation = global_db_config.get('sql_validation', True)
+if sql_validation and not sql_validator_available():
+    logger.warning("sql_validation is enabled but sqlglot is not installed, SQL is sent to the database unchecked")
+# stream_data 每批返回的行数，以及最多返回的行数(<=0 表示不限制)
+stream_batch_size = global_db_config.get('stream_batch_size', 500)
+stream_max_rows = global_db_config.get('stream_max_rows', 100000)
+# M-Schema 快照路径，相对路径相对于本文件所在目录，未配置时不使用快照
+schema_snapshot_path = global_db_config.get('schema_snapshot')
+if schema_snapshot_path:
+    schema_snapshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), schema_snapshot_path)
 
 
+# 阻塞的数据库调用在有界线程池中执行，默认与连接池容量一致
+configure_db_executor(global_db_config.get('executor_workers',
+                                          global_xiyan_db_config.pool_size + global_xiyan_db_config.max_overflow))
 
-mcp = FastMCP("xiyan", **mcp_config)
 
+# 按 EXPLAIN 的估计拦截代价过高的SQL，未配置上限时不估计代价
+cost_guard = CostGuard(
+    max_cost=cost_guard_config.get('max_cost'),
+    max_rows=cost_guard_config.get('max_rows'),
+    action=cost_guard_config.get('action', 'rewrite'),
+    unknown_plan=cost_guard_config.get('unknown_plan', 'block')
+)
+
+# 查询结果缓存，相同的SQL在有效期内不再访问数据库，未开启时为 None
+result_cache = None
+if result_cache_config.get('enabled', False):
+    result_cache = ResultCache(
+        max_bytes=int(result_cache_config.get('max_mb', 64) * 1024 * 1024),
+        default_ttl=result_cache_config.get('ttl', 300),
+        table_ttls=result_cache_config.get('table_ttls')
+    )
+
+# get_data 结果超过 max_rows 行时返回的续页令牌，get_more 凭令牌继续取数，不再调用模型
+continuation_tokens = ContinuationTokens(pagination_config.get('secret'), ttl=pagination_config.get('token_ttl', 3600))
+max_page_rows = pagination_config.get('max_page_rows', 1000)
+
+# 大结果的本地文件存储，get_data(spill=true) 把完整结果写入文件并返回资源 URI，未开启时为 None
+result_store = None
+if result_store_config.get('enabled', False):
+    result_store = ResultStore(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), result_store_config.get('directory', 'cache/results')),
+        file_format=result_store_config.get('format', 'parquet'),
+        compression=result_store_config.get('compression', 'zstd'),
+        ttl=result_store_config.get('ttl', 3600),
+        max_bytes=int(result_store_config.get('max_mb', 1024) * 1024 * 1024) if result_store_config.get('max_mb') else None
+    )
+
+# 表资源的预览缓存，按表失效，浏览同一张表的同一页时不再访问数据库，cache_mb <= 0 时为 None
+preview_cache = None
+if table_preview_config.get('cache_mb', 16) > 0:
+    preview_cache = ResultCache(
+        max_bytes=int(table_preview_config.get('cache_mb', 16) * 1024 * 1024),
+        default_ttl=table_preview_config.get('cache_ttl', 60),
+        table_ttls=result_cache_config.get('table_ttls')
+    )
+
+# 问题 -> SQL 缓存，重复的问题跳过模型直接执行缓存的SQL，未开启时为 None
+sql_cache = None
+if sql_cache_config.get('enabled', False):
+    sql_cache = SQLCache(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), sql_cache_config.get('path', 'cache/sql_cache.sqlite')),
+        max_entries=sql_cache_config.get('max_entries', 10000)
+    )
+
+# 语义问题缓存，措辞不同但意思相同的问题复用已验证的SQL，未开启时为 None
+semantic_cache = None
+if semantic_cache_config.get('enabled', False):
+    semantic_cache = SemanticCache(
+        threshold=semantic_cache_config.get('threshold', 0.85),
+        max_entries=semantic_cache_config.get('max_entries', 10000)
+    )
 
-@mcp.resource(dialect+'://'+global_db_config.get('database',''))
-async def read_schema() -> str:
 
-    db_engine = init_db_conn(global_xiyan_db_config)
+def build_read_router() -> Optional[ReadRouter]:
+    """
+    只读查询路由：配置了副本时把生成的查询分发到副本；没有副本但开启了 read_only 时在主库的只读连接上执行；
+    都没有配置时返回 None，查询在主库的普通连接上执行
+    """
+    read_only = global_db_config.get('read_only', True)
+    replica_configs = global_db_config.get('replicas') or []
+    if len(replica_configs) == 0 and not read_only:
+        return None
+    replicas = {}
+    for i, replica_config in enumerate(replica_configs):
+        # 副本只需要配置与主库不同的项，例如 host、port
+        config = {**global_db_config, **replica_config}
+        name = replica_config.get('name') or (f"{config['host']}:{config['port']}" if config.get('host')
+                                              else str(config.get('database', i)))
+        replicas[name] = get_shared_engine(get_xiyan_config(config), read_only=read_only)
+    fallback = None
+    if len(replicas) == 0 or global_db_config.get('replica_fallback', True):
+        fallback = get_shared_engine(global_xiyan_db_config, read_only=read_only)
+    return ReadRouter(
+        replicas,
+        fallback=fallback,
+        strategy=global_db_config.get('replica_strategy', 'round_robin'),
+        max_failures=global_db_config.get('replica_max_failures', 3),
+        eject_seconds=global_db_config.get('replica_eject_seconds', 30)
+    )
+
+
+read_router = build_read_router()
+
+
+def build_db_env() -> DataBaseEnv:
+    db_engine = get_shared_engine(global_xiyan_db_config)
     db_source = HITLSQLDatabase(
-        engine=db_engine, 
-        table_pattern=r"jn_cadre_info.*"  # 匹配所有以user_开头的表
+        engine=db_engine,
+        table_pattern=table_pattern,
+        introspect_workers=global_db_config.get('introspect_workers', 4),
+        snapshot_path=schema_snapshot_path
+    )
+    db_source.set_result_cache(result_cache)
+    db_source.set_statement_timeout(global_db_config.get('statement_timeout', 30))
+    db_source.set_read_router(read_router)
+    return DataBaseEnv(db_source)
+
+
+# 每个数据库的 M-Schema 只构建一次，所有请求共享，过期(schema_ttl 秒)或显式失效后重建
+schema_registry = SchemaRegistry(ttl=global_db_config.get('schema_ttl', 3600))
+schema_registry.register(global_db_name, build_db_env)
+if result_cache is not None:
+    # 表结构变化时释放引用了这些表的缓存结果
+    schema_registry.add_listener(lambda name, tables: result_cache.invalidate_tables(tables))
+if preview_cache is not None:
+    schema_registry.add_listener(lambda name, tables: preview_cache.invalidate_tables(tables))
+if semantic_cache is not None:
+    # 表结构变化后按新版本重新预热语义缓存
+    schema_registry.add_listener(lambda name, tables: seed_semantic_cache())
+# 字段取值索引，用于把问题中的字面量链接到所在的 table.column，未开启时为 None
+value_index = None
+if value_index_config.get('enabled', False):
+    value_index = ValueIndex(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), value_index_config.get('path', 'cache/value_index.sqlite')),
+        max_values_per_column=value_index_config.get('max_values_per_column', 100000),
+        max_value_length=value_index_config.get('max_value_length', 64),
+        chunk_size=value_index_config.get('chunk_size', 5000)
     )
-    return db_source.mschema.to_mschema()
+
+
+def build_value_index(force: bool = False, tables: Optional[list] = None):
+    """
+    构建字段取值索引，只在索引不存在、字段变化或过期时重建
+
+    Args:
+        force: 为 True 时总是重建
+        tables: 结构发生变化的表，其中有被索引的字段时重建
+    """
+    if value_index is None:
+        return
+    env = schema_registry.get(global_db_name)
+    columns = value_index_config.get('columns') or text_columns(env.mschema.tables)
+    if tables is not None and any(column.split('.', 1)[0] in tables for column in columns):
+        force = True
+    if force or value_index.needs_build(columns, value_index_config.get('max_age')):
+        logger.info(f"Building value index for {len(columns)} columns")
+        value_index.build(columns, env.database.iter_distinct_values)
+
+
+# 后台重建字段取值索引的状态：同时只有一个构建在运行，运行期间的新请求合并为结束后的一次重建
+_value_index_lock = threading.Lock()
+_value_index_request = {"running": False, "rerun": False, "force": False, "tables": set()}
+
+
+def _run_value_index_builds():
+    while True:
+        with _value_index_lock:
+            force, tables = _value_index_request["force"], _value_index_request["tables"]
+            _value_index_request.update(rerun=False, force=False, tables=set())
+        try:
+            build_value_index(force, tables)
+        except Exception as e:
+            logger.error(f"构建字段取值索引失败: {str(e)}")
+        with _value_index_lock:
+            if not _value_index_request["rerun"]:
+                _value_index_request["running"] = False
+                return
+
+
+def schedule_value_index_build(force: bool = False, tables: Optional[list] = None):
+    """在后台线程中检查并重建字段取值索引，不阻塞调用方"""
+    if value_index is None:
+        return
+    with _value_index_lock:
+        _value_index_request["force"] |= force
+        _value_index_request["tables"] |= set(tables or [])
+        if _value_index_request["running"]:
+            _value_index_request["rerun"] = True
+            return
+        _value_index_request["running"] = True
+    threading.Thread(target=_run_value_index_builds, name="value-index", daemon=True).start()
+
+
+def poll_value_index(interval: float):
+    """定期检查索引是否超过 max_age，服务长时间运行时取值也能跟上数据变化"""
+    while True:
+        time.sleep(interval)
+        schedule_value_index_build()
+
+
+if value_index is not None:
+    # 表结构变化(refresh_schema 或后台检测)后重建涉及的字段
+    schema_registry.add_listener(lambda name, tables: schedule_value_index_build(tables=tables))
+
+
+# 后台定期检测表结构变化并增量刷新，schema_poll_interval <= 0 时不启动
+schema_registry.start_poller(global_db_config.get('schema_poll_interval', 0))
+
+
+class PagedText(str):
+    """资源的一页文本内容，mime_type 为内容的格式，next_uri 为下一页的 URI"""
+    mime_type: Optional[str] = None
+    next_uri: Optional[str] = None
+
+
+class PagedBytes(bytes):
+    """资源的一页二进制内容(Arrow IPC)，mime_type 为内容的格式，next_uri 为下一页的 URI"""
+    mime_type: Optional[str] = None
+    next_uri: Optional[str] = None
+
+
+def paged(content: Any, output_format: str, next_uri: Optional[str]) -> Any:
+    """给资源内容附上格式对应的 MIME 类型和下一页的 URI"""
+    page = PagedBytes(content) if isinstance(content, bytes) else PagedText(content)
+    page.mime_type = MIME_TYPES[output_format]
+    page.next_uri = next_uri
+    return page
+
+
+class XiyanMCP(FastMCP):
+    """
+    资源返回 PagedText/PagedBytes 时，用内容自带的 MIME 类型代替资源模板的 text/plain，并把下一页的 URI
+    作为单独的一条 text/uri-list 内容返回，不写进 CSV/JSONL 等数据本身，客户端可以直接解析数据
+    """
+
+    async def read_resource(self, uri):
+        contents = []
+        for item in await super().read_resource(uri):
+            mime_type = getattr(item.content, 'mime_type', None)
+            contents.append(replace(item, mime_type=mime_type) if mime_type is not None else item)
+        for item in list(contents):
+            next_uri = getattr(item.content, 'next_uri', None)
+            if next_uri is not None:
+                contents.append(ReadResourceContents(content=next_uri + '\r\n', mime_type='text/uri-list'))
+        return contents
+
+
+mcp = XiyanMCP("xiyan", **mcp_config)
+
+
+@mcp.resource(dialect+'://'+global_db_config.get('database',''))
+async def read_schema() -> str:
+    env = await run_in_db_executor(schema_registry.get, global_db_name)
+    return env.mschema_str
+
+def page_content(env: DataBaseEnv, fields: list, rows: list, output_format: str, next_uri: Optional[str]) -> Any:
+    """把资源的一页行转换为指定格式，下一页的 URI 由 XiyanMCP 作为单独的内容返回"""
+    if output_format == 'arrow':
+        return paged(to_arrow(fields, rows, {'next': next_uri} if next_uri else None), output_format, next_uri)
+    if output_format == 'markdown':
+        result = env.database.rows_to_markdown(fields, rows)
+        if next_uri:
+            result += f"\n\n# next: {next_uri}"
+        return paged(result, output_format, next_uri)
+    return paged(format_rows(fields, rows, output_format), output_format, next_uri)
+
+
+def read_table(table_ref: str) -> Any:
+    """
+    读取表的一页内容，返回 CSV；与生成的查询一样在只读连接上执行
+
+    table_ref 为表名加可选的查询参数，例如 orders?columns=id,amount&limit=50&after=1200：
+        columns: 需要读取的字段，逗号分隔，默认所有字段
+        limit: 每页行数，不超过 table_preview.max_rows
+        offset: 跳过的行数
+        after: 上一页最后一行的主键值，按主键翻页，只适用于单字段主键的表
+        format: csv(默认)、jsonl、markdown 或 arrow，arrow 返回 Arrow IPC 流(bytes)
+    还有更多行时，下一页的 URI 作为单独的 text/uri-list 内容返回，不写进数据；markdown 另外在末尾附上
+    "# next: 下一页的 URI"，arrow 另外写在 schema 元数据 next 中
+    """
+    table_name, _, query_string = table_ref.partition('?')
+    table_name = unquote(table_name)
+    params = {k: v[-1] for k, v in parse_qs(query_string).items()}
+    env = schema_registry.get(global_db_name)
+    if not env.mschema.has_table(table_name):
+        raise ValueError(f"Table {table_name} does not exist")
+
+    max_preview_rows = table_preview_config.get('max_rows', 100)
+    columns = [c.strip() for c in params['columns'].split(',') if c.strip()] if params.get('columns') else None
+    limit = min(max(int(params.get('limit', max_preview_rows)), 1), max_preview_rows)
+    offset = max(int(params.get('offset', 0)), 0)
+    after = params.get('after')
+    output_format = check_format(params.get('format', 'csv'))
+
+    key = ResultCache.make_key(global_db_name, env.database.schema_version, 'preview', table_name, columns, limit,
+                               offset, after)
+    preview = preview_cache.get(key) if preview_cache is not None else None
+    if preview is None:
+        preview = env.database.preview_table(table_name, columns, limit, offset, after)
+        if preview_cache is not None:
+            preview_cache.put(key, preview, [table_name])
+    fields, rows, has_more, last_key = preview
+
+    next_uri = None
+    if has_more:
+        next_params = {'limit': limit}
+        if columns:
+            next_params['columns'] = ','.join(columns)
+        if output_format != 'csv':
+            next_params['format'] = output_format
+        # 有主键时下一页总是按主键翻页(第一页用了 offset 也一样)，没有主键时继续用 offset
+        if last_key is not None:
+            next_params['after'] = last_key
+        else:
+            next_params['offset'] = offset + limit
+        query = '&'.join(f"{k}={quote(str(v), safe=',')}" for k, v in next_params.items())
+        next_uri = f"{dialect}://{quote(table_name)}?{query}"
+
+    return page_content(env, fields, rows, output_format, next_uri)
+
 
 @mcp.resource(dialect+"://{table_name}")
-async def read_resource(table_name) -> str:
+async def read_resource(table_name) -> str | bytes:
     """Read table contents."""
-    config = global_db_config
     try:
-        with connect(**config) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(f"SELECT * FROM {table_name} LIMIT 100")
-                if cursor.description is None:
-                    return f"No data found or query error for table {table_name}"
-                columns = [desc[0] for desc in cursor.description]
-                rows = cursor.fetchall()
-                result = [",".join(map(str, row)) for row in rows]
-                return "\n".join([",".join(columns)] + result)
-                
-    except Error as e:
+        return await run_in_db_executor(read_table, table_name)
+    except Exception as e:
         raise RuntimeError(f"Database error: {str(e)}")
 
 
-def sql_gen_and_execute(db_env: DataBaseEnv, query: str):
+def read_result(result_ref: str) -> Any:
     """
-    Transfers the input natural language question to sql query (known as Text-to-sql) and executes it on the database.
-     Args:
-        query: natural language to query the database. e.g. 查询在2024年每个月，卡宴的各经销商销量分别是多少
+    分段读取 get_data(spill=true) 保存的结果
+
+    result_ref 为结果 ID 加可选的查询参数，例如 3f2a...?offset=1000&limit=500&format=jsonl：
+        offset: 起始行，默认 0
+        limit: 行数，不超过 pagination.max_page_rows
+        format: csv(默认)、jsonl、markdown 或 arrow
+    下一页的 URI 与表资源一样作为单独的 text/uri-list 内容返回
     """
+    result_id, _, query_string = result_ref.partition('?')
+    params = {k: v[-1] for k, v in parse_qs(query_string).items()}
+    offset = max(int(params.get('offset', 0)), 0)
+    limit = min(max(int(params.get('limit', max_page_rows)), 1), max_page_rows)
+    output_format = check_format(params.get('format', 'csv'))
+    try:
+        meta = result_store.info(result_id)
+    except KeyError:
+        raise ValueError(f"结果 {result_id} 不存在或已过期")
+    fields, rows = result_store.read(result_id, offset, limit)
+
+    next_uri = None
+    if offset + len(rows) < meta['rows']:
+        next_uri = f"xiyan://results/{result_id}?offset={offset + len(rows)}&limit={limit}"
+        if output_format != 'csv':
+            next_uri += f"&format={output_format}"
+    return page_content(schema_registry.get(global_db_name), fields, rows, output_format, next_uri)
 
-    #db_env = context_variables.get('db_env', None)
+
+@mcp.resource("xiyan://results/{result_ref}")
+async def read_result_resource(result_ref) -> str | bytes:
+    """Read a range of rows from a result saved by get_data(spill=true)."""
+    if result_store is None:
+        raise RuntimeError("result_store 未开启")
+    try:
+        return await run_in_db_executor(read_result, result_ref)
+    except Exception as e:
+        raise RuntimeError(f"Result error: {str(e)}")
+
+
+def lookup_values(query: str):
+    """问题中的字面量在哪些字段中出现过，未开启取值索引时为空"""
+    return value_index.lookup(query) if value_index is not None else []
+
+
+def question_schema(db_env: DataBaseEnv, query: str, value_matches=None) -> str:
+    """生成问题对应的 schema：检索相关表并附上问题中字面量所在的字段"""
+    if value_matches is None:
+        value_matches = lookup_values(query)
+    # 表较多时先检索与问题相关的表，只把这些表的 schema 放进 prompt
+    mschema_str = db_env.question_mschema_str(query, schema_linking_config.get('top_k', 0),
+                                              schema_linking_config.get('min_tables', 0),
+                                              required_tables=[m[1] for m in value_matches])
+    if len(value_matches) > 0:
+        mschema_str += f"\n【值匹配】\n{value_hints(value_matches)}"
+    return mschema_str
+
+
+async def generate_candidate(db_env: DataBaseEnv, mschema_str: str, query: str,
+                             temperature: Optional[float] = None) -> str:
+    """调用模型生成一条SQL"""
     prompt = f"""你现在是一名{db_env.dialect}数据分析专家，你的任务是根据参考的数据库schema和用户的问题，编写正确的SQL来回答用户的问题，生成的SQL用``sql 和```包围起来。
             【数据库schema】
-            {db_env.mschema_str}
+            {mschema_str}
             
             【问题】
             {query}
@@ -114,34 +520,284 @@ def sql_gen_and_execute(db_env: DataBaseEnv, query: str):
         {"role": "user", "content": f"用户的问题是: {query}"}
     ]
     param = {"model": model_config['name'], "messages": messages,"key":model_config['key'],"url":model_config['url']}
+    if temperature is not None:
+        param['temperature'] = temperature
 
-    try:
-        response = call_openai_sdk(**param)
-        content = response.choices[0].message.content
-        logger.info(f"SQL generation response: {content}")
-        sql_query = extract_sql_from_qwen(content)
-        logger.info(f"SQL query: {sql_query}")
-        status, res = db_env.database.fetch(sql_query)
+    response = await acall_openai_sdk(**param)
+    content = response.choices[0].message.content
+    logger.info(f"SQL generation response: {content}")
+    sql_query = extract_sql_from_qwen(content)
+    logger.info(f"SQL query: {sql_query}")
+    return sql_query
+
+
+async def precheck_sql(db_env: DataBaseEnv, sql_query: str, explain: bool = True,
+                       local_validation: bool = True) -> Tuple[bool, Optional[str], Optional[str]]:
+    """
+    不执行查询，只检查SQL：先在本地解析，开启代价限制时用 EXPLAIN 估计代价，否则按需让数据库生成执行计划
+
+    Args:
+        db_env: 数据库环境
+        sql_query: SQL
+        explain: 未开启代价限制时是否也用 EXPLAIN 校验
+        local_validation: 是否在本地解析校验
+
+    Returns:
+        (是否通过, 错误信息, 失败原因: local 本地校验未通过 / cost 代价过高 / db 数据库报错)
+    """
+    error_info = None
+    if sql_validation and local_validation:
+        error_info = validate_sql(sql_query, db_env.mschema, db_env.dialect)
+    if error_info is not None:
+        return False, error_info, 'local'
+    if cost_guard.enabled:
+        status, estimate = await db_env.database.aestimate_cost(sql_query)
         if not status:
-            for idx in range(3):
-                error_info = str(res)  # 将res转换为字符串
-                sql_query = sql_fix(db_env.dialect, db_env.mschema_str, query, sql_query, error_info)
-                logger.info(f"SQL query after fix: {sql_query}")
-                status, res = db_env.database.fetch(sql_query)
-                if status:
+            return False, str(estimate), 'db'
+        reason = cost_guard.check(estimate) if estimate is not None else None
+        if reason is not None:
+            return False, f"SQL执行代价过高: {reason}", 'cost'
+    elif explain:
+        status, plan = await db_env.database.aexplain(sql_query)
+        if not status:
+            return False, str(plan), 'db'
+    return True, None, None
+
+
+async def generate_candidates(db_env: DataBaseEnv, mschema_str: str,
+                              query: str) -> Tuple[str, bool, Optional[str], Optional[str]]:
+    """
+    用不同的 temperature 并发生成多条候选SQL并并行校验，总耗时约为一次模型调用
+
+    strategy 为 first_valid 时返回最先通过校验的候选，其余请求被取消；
+    为 majority 时等待所有候选，返回通过校验且规范形式相同的条数最多的SQL(相同时取 temperature 低的)
+
+    Returns:
+        (SQL, 是否通过校验, 错误信息, 失败原因)，都没有通过校验时返回最先得到的候选及其错误
+    """
+    count = generation_config.get('candidates', 1)
+    temperatures = generation_config.get('temperatures') or [None]
+    temperatures = [temperatures[i % len(temperatures)] for i in range(count)]
+
+    async def generate_and_check(temperature):
+        sql_query = await generate_candidate(db_env, mschema_str, query, temperature)
+        valid, error_info, reason = await precheck_sql(db_env, sql_query)
+        return sql_query, valid, error_info, reason
+
+    tasks = [asyncio.ensure_future(generate_and_check(t)) for t in temperatures]
+    results = []
+    try:
+        if generation_config.get('strategy', 'first_valid') == 'majority':
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            results = [r for r in results if not isinstance(r, BaseException)]
+            canonical = [canonical_sql(r[0], db_env.dialect) for r in results]
+            votes = Counter(c for c, r in zip(canonical, results) if r[1])
+            if len(votes) > 0:
+                best = max(votes.values())
+                # results 与 temperatures 同序，取票数最多的 SQL 中 temperature 最低的一个
+                for c, r in zip(canonical, results):
+                    if r[1] and votes[c] == best:
+                        logger.info(f"Candidate chosen by {best}/{count} votes: {r[0]}")
+                        return r
+        else:
+            for future in asyncio.as_completed(tasks):
+                try:
+                    r = await future
+                except Exception as e:
+                    logger.error(f"Generating candidate failed: {e}")
+                    continue
+                if r[1]:
+                    return r
+                results.append(r)
+    finally:
+        for task in tasks:
+            task.cancel()
+    if len(results) == 0:
+        raise RuntimeError("所有候选SQL生成失败")
+    return results[0]
+
+
+async def generate_sql(db_env: DataBaseEnv, query: str, execute) -> Tuple[str, bool, Any]:
+    """
+    生成问题对应的SQL并执行，执行失败时把数据库的错误信息交给模型修复，最多修复3次
+
+    Args:
+        db_env: 数据库环境
+        query: 用户问题
+        execute: 异步函数 sql -> (是否执行成功, 执行结果或错误信息)，执行一次即同时完成校验和取数
+
+    Returns:
+        (最终的SQL, 是否执行成功, 执行结果或错误信息)
+    """
+    # 相同的问题、表结构和模型之前生成过可执行的SQL时直接执行，执行失败(例如数据被迁移)时删除缓存重新生成
+    sql_cache_key = (query, db_env.database.schema_version, model_config['name'])
+    if sql_cache is not None:
+        cached_sql = await run_in_db_executor(sql_cache.get, *sql_cache_key)
+        if cached_sql is not None:
+            logger.info(f"SQL cache hit: {cached_sql}")
+            status, result = await execute(cached_sql)
+            if status:
+                return cached_sql, status, result
+            await run_in_db_executor(sql_cache.evict, *sql_cache_key)
+
+    # 检索索引和取值索引都是本地阻塞调用，放到线程池中执行
+    value_matches = await run_in_db_executor(lookup_values, query)
+
+    # 意思相同的问题之前生成过可执行的SQL时直接执行，命中的SQL仍然在数据库上执行
+    semantic_namespace = semantic_cache_namespace(db_env)
+    signature = literal_signature(query, [m[0] for m in value_matches])
+    if semantic_cache is not None:
+        # 向量计算和矩阵乘法不放在事件循环上
+        hit = await run_in_db_executor(semantic_cache.lookup, semantic_namespace, query, signature)
+        if hit is not None:
+            cached_sql, similarity, cached_question = hit
+            logger.info(f"Semantic cache hit ({similarity:.3f}, {cached_question}): {cached_sql}")
+            status, result = await execute(cached_sql)
+            if status:
+                if sql_cache is not None:
+                    await run_in_db_executor(sql_cache.put, *sql_cache_key, cached_sql)
+                return cached_sql, status, result
+            await run_in_db_executor(semantic_cache.remove, semantic_namespace, cached_question)
+
+    mschema_str = await run_in_db_executor(question_schema, db_env, query, value_matches)
+
+    async def validate_and_execute(sql_query: str, precheck: bool = True, local_validation: bool = True):
+        # 先检查SQL：本地校验发现错误时不访问数据库，直接把错误交给模型修复；代价过高时不执行
+        if precheck:
+            valid, error_info, reason = await precheck_sql(db_env, sql_query, explain=False,
+                                                           local_validation=local_validation)
+            if not valid:
+                logger.info(f"SQL precheck failed: {error_info}")
+                return False, error_info, reason
+        status, result = await execute(sql_query)
+        if status:
+            return True, result, None
+        if is_timeout_error(result):
+            return False, f"SQL执行超时: {result}", 'cost'
+        return False, result, 'db'
+
+    if generation_config.get('candidates', 1) > 1:
+        sql_query, valid, error_info, reason = await generate_candidates(db_env, mschema_str, query)
+        if valid:
+            # 候选已经检查过，直接执行
+            status, result, reason = await validate_and_execute(sql_query, precheck=False)
+        else:
+            status, result = False, error_info
+    else:
+        sql_query = await generate_candidate(db_env, mschema_str, query)
+        status, result, reason = await validate_and_execute(sql_query)
+    if not status:
+        for idx in range(3):
+            if reason == 'cost':
+                if cost_guard.action != 'rewrite':
                     break
+                sql_query = await sql_rewrite(db_env.dialect, mschema_str, query, sql_query, str(result))
+                logger.info(f"SQL query after rewrite: {sql_query}")
+            else:
+                sql_query = await sql_fix(db_env.dialect, mschema_str, query, sql_query, str(result))
+                logger.info(f"SQL query after fix: {sql_query}")
+            status, result, reason = await validate_and_execute(sql_query)
+            if status:
+                break
+        if not status and reason == 'local':
+            # 本地校验可能误判方言特有的写法，修复次数用完后仍以数据库的执行结果为准
+            status, result, reason = await validate_and_execute(sql_query, local_validation=False)
+    if status and sql_cache is not None:
+        await run_in_db_executor(sql_cache.put, *sql_cache_key, sql_query)
+    if status and semantic_cache is not None:
+        await run_in_db_executor(semantic_cache.add, semantic_namespace, query, signature, sql_query)
+    return sql_query, status, result
+
+
+async def sql_gen_and_execute(db_env: DataBaseEnv, query: str, output_format: str = 'markdown',
+                              spill: bool = False) -> list:
+    """
+    Transfers the input natural language question to sql query (known as Text-to-sql) and executes it on the database.
+     Args:
+        query: natural language to query the database. e.g. 查询在2024年每个月，卡宴的各经销商销量分别是多少
+        output_format: markdown, csv, jsonl or arrow
+        spill: save the full result to a local file when it has more than max_rows rows
+    """
+    # markdown 供模型阅读，截断过长的字符串；其他格式供程序使用，保留原始取值
+    max_str_len = 30 if output_format == 'markdown' else 0
+
+    async def execute(sql_query: str):
+        status, sql_res = await db_env.database.afetch_limited(sql_query, max_rows=max_rows, max_str_len=max_str_len,
+                                                               limit_push_down=limit_push_down)
+        # 失败时 truncated_results 为错误信息
+        return status, sql_res if status else sql_res['truncated_results']
+
+    try:
+        sql_query, status, sql_res = await generate_sql(db_env, query, execute)
+        if not status:
+            return [TextContent(type="text", text=str(sql_res))]
 
-        sql_res = db_env.database.fetch_truncated(sql_query,max_rows=100)
-        logger.info(f"SQL result: {sql_res}")
-        markdown_res = db_env.database.trunc_result_to_markdown(sql_res)
         logger.info(f"SQL query: {sql_query}\nSQL result: {sql_res}")
-        return markdown_res.strip()
+        if spill and result_store is not None and sql_res.get('has_more'):
+            return await spill_result(db_env, sql_query, sql_res, output_format)
+        return result_contents(db_env, sql_query, sql_res, 0, output_format)
 
     except Exception as e:
-        return str(e)
+        return [TextContent(type="text", text=str(e))]
+
+
+def result_contents(db_env: DataBaseEnv, sql_query: str, sql_res: dict, start: int, output_format: str) -> list:
+    """
+    把一页查询结果转换为返回给客户端的内容：markdown、csv、jsonl 为文本，arrow 为 base64 编码的 Arrow IPC 流；
+    还有更多行时，markdown 在结果后面附上续页令牌，其他格式把令牌放在单独的一条文本中，不混入数据
+    """
+    rows = sql_res['truncated_results']
+    footer = page_footer(sql_query, start, len(rows)) if sql_res.get('has_more') else ''
+    if output_format == 'markdown':
+        return [TextContent(type="text", text=(db_env.database.trunc_result_to_markdown(sql_res) + footer).strip())]
 
+    data = format_rows(sql_res['fields'], rows, output_format)
+    if output_format == 'arrow':
+        # 内联返回的结果没有可以读取的资源，URI 只用于标识；不能用 {dialect}:// 前缀，否则会被当作表资源
+        contents = [EmbeddedResource(type="resource", resource=BlobResourceContents(
+            uri=f"xiyan://inline/{uuid.uuid4().hex}", mimeType=MIME_TYPES['arrow'],
+            blob=base64.b64encode(data).decode('ascii')))]
+    else:
+        contents = [TextContent(type="text", text=data)]
+    if footer:
+        contents.append(TextContent(type="text", text=footer.strip()))
+    return contents
 
-def sql_fix(dialect: str, mschema: str, query: str, sql_query: str, error_info: str):
+
+async def spill_result(db_env: DataBaseEnv, sql_query: str, sql_res: dict, output_format: str) -> list:
+    """
+    把完整结果分批写入本地文件，返回已经取到的前 max_rows 行作为预览，以及可以分段读取的资源 URI；
+    重新执行一次SQL，通过服务端游标分批读取，内存占用只与 batch_size 有关
+    """
+    store_max_rows = result_store_config.get('max_rows', 0)
+    batches = db_env.database.iter_batches(sql_query, result_store_config.get('batch_size', 10000), max_str_len=0,
+                                           max_rows=store_max_rows if store_max_rows > 0 else None)
+    try:
+        meta = await run_in_db_executor(result_store.write, batches, sql_query)
+    except Exception as e:
+        logger.warning(f"Failed to spill result to file: {e}")
+        return result_contents(db_env, sql_query, sql_res, 0, output_format)
+
+    contents = result_contents(db_env, sql_query, {**sql_res, 'has_more': False}, 0, output_format)
+    note = (f"完整结果共 {meta['rows']} 行，已保存为 {meta['format']} 文件({meta['bytes']} 字节)，"
+            f"资源 URI: xiyan://results/{meta['id']}\n"
+            f"可通过 ?offset=起始行&limit=行数&format=csv|jsonl|markdown|arrow 分段读取")
+    if meta.get('expires_at') is not None:
+        note += f"，{int(meta['expires_at'] - meta['created_at'])} 秒后过期"
+    if store_max_rows > 0 and meta['rows'] >= store_max_rows:
+        note += f"\n(已达到保存上限 {store_max_rows} 行)"
+    contents.append(TextContent(type="text", text=note))
+    return contents
+
+
+def page_footer(sql_query: str, start: int, count: int) -> str:
+    """还有更多行时附在结果后面的提示和续页令牌，令牌中记录已验证的SQL和下一页的位置"""
+    token = continuation_tokens.encode({"db": global_db_name, "sql": sql_query, "offset": start + count})
+    return (f"\n\n(已展示第 {start + 1}-{start + count} 行，还有更多结果，"
+            f"可调用 get_more 并传入以下 token 继续获取)\ntoken: {token}")
+
+
+async def sql_fix(dialect: str, mschema: str, query: str, sql_query: str, error_info: str):
     system_prompt = '''现在你是一个{dialect}数据分析专家，需要阅读一个客户的问题，参考的数据库schema，该问题对应的待检查SQL，以及执行该SQL时数据库返回的语法错误，请你仅针对其中的语法错误进行修复，输出修复后的SQL。
         注意：
         1、仅修复语法错误，不允许改变SQL的逻辑。
@@ -164,45 +820,200 @@ def sql_fix(dialect: str, mschema: str, query: str, sql_query: str, error_info:
     ]
     param = {"model": model_config['name'], "messages": messages,"key":model_config['key'],'url':model_config['url']}
 
-    response = call_openai_sdk(**param)
+    response = await acall_openai_sdk(**param)
     content = response.choices[0].message.content
     sql_query = extract_sql_from_qwen(content)
 
     return sql_query
 
-def call_xiyan(query: str)-> str:
+async def sql_rewrite(dialect: str, mschema: str, query: str, sql_query: str, reason: str):
+    system_prompt = '''现在你是一个{dialect}数据分析专家，需要阅读一个客户的问题，参考的数据库schema，以及该问题对应的SQL。这条SQL的执行代价过高，请你在不改变查询结果的前提下改写SQL，降低执行代价，输出改写后的SQL。
+        注意：
+        1、不允许改变SQL的查询结果。
+        2、尽量使用有索引的字段过滤，先过滤再关联，避免笛卡尔积、对大表的全表扫描和不必要的排序。
+        3、生成的SQL用```sql 和```包围起来。
+        
+        【数据库schema】
+        {schema}
+        '''.format(dialect=dialect, schema=mschema)
+    user_prompt = '''【问题】
+                {question}
+                
+                【待改写SQL】
+                {sql}
+                
+                【执行代价】
+                {reason}'''.format(question=query, sql=sql_query, reason=reason)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    param = {"model": model_config['name'], "messages": messages,"key":model_config['key'],'url':model_config['url']}
+
+    response = await acall_openai_sdk(**param)
+    content = response.choices[0].message.content
+    sql_query = extract_sql_from_qwen(content)
+
+    return sql_query
+
+async def call_xiyan(query: str, output_format: str = 'markdown', spill: bool = False) -> list:
     """Fetch the data from database through a natural language query
 
     Args:
         query: The query in natual language
+        output_format: markdown, csv, jsonl or arrow
+        spill: save the full result to a local file when it is larger than max_rows
     """
 
     logger.info(f"Calling tool with arguments: {query}")
     try:
-        db_engine = init_db_conn(global_xiyan_db_config)
-        db_source = HITLSQLDatabase(
-            engine=db_engine, 
-            table_pattern=r"jn_cadre_info.*"  # 匹配所有以sys_或user_开头的表
-        )
+        env = await run_in_db_executor(schema_registry.get, global_db_name)
     except Exception as  e:
 
-        return "数据库连接失败"+str(e)
+        return [TextContent(type="text", text="数据库连接失败"+str(e))]
     logger.info(f"Calling xiyan")
-    env = DataBaseEnv(db_source)
-    res = sql_gen_and_execute(env,query)
+    return await sql_gen_and_execute(env, query, output_format, spill)
+
+question_flight = AsyncSingleFlight()
 
-    return str(res)
 
 @mcp.tool()
-def get_data(query: str)-> list[TextContent]:
+async def get_data(query: str, format: str = "markdown",
+                   spill: bool = False) -> list[TextContent | EmbeddedResource]:
     """Fetch the data from database through a natural language query
 
     Args:
         query: The query in natural language
+        format: Output format: markdown (default), csv, jsonl, or arrow (base64 Arrow IPC stream as a resource blob)
+        spill: When the result is larger than the preview, save the full result to a local file and return
+            a resource URI (xiyan://results/{id}) that can be read in ranges with ?offset=&limit=&format=
+    """
+    try:
+        output_format = check_format(format)
+    except ValueError as e:
+        return [TextContent(type="text", text=str(e))]
+
+    # 同时到达的相同问题只生成、执行一次，所有请求共享结果
+    return await question_flight.do((global_db_name, normalize_question(query), output_format, spill),
+                                    call_xiyan, query, output_format, spill)
+
+
+@mcp.tool()
+async def get_more(token: str, n: int = 0, format: str = "markdown") -> list[TextContent | EmbeddedResource]:
+    """Fetch the next rows of a previous get_data result, without generating the SQL again
+
+    Args:
+        token: The continuation token returned by get_data or get_more
+        n: Number of rows to fetch, 0 uses the server default
+        format: Output format: markdown (default), csv, jsonl, or arrow
+    """
+    try:
+        page = continuation_tokens.decode(token)
+        output_format = check_format(format)
+    except ValueError as e:
+        return [TextContent(type="text", text=str(e))]
+    if page.get('db') != global_db_name:
+        return [TextContent(type="text", text="令牌不属于当前数据库，请重新提问")]
+    n = min(n if n > 0 else max_rows, max_page_rows)
+    offset = int(page['offset'])
+    try:
+        env = await run_in_db_executor(schema_registry.get, global_db_name)
+        # 多取一行判断是否还有下一页，数据库只产生 n + 1 行
+        page_sql = paginate_sql(page['sql'], n + 1, offset, env.dialect)
+        status, sql_res = await env.database.afetch_limited(page_sql, max_rows=n,
+                                                            max_str_len=30 if output_format == 'markdown' else 0,
+                                                            limit_push_down=False)
+    except Exception as e:
+        return [TextContent(type="text", text=str(e))]
+    if not status:
+        return [TextContent(type="text", text=str(sql_res['truncated_results']))]
+
+    if len(sql_res['truncated_results']) == 0:
+        return [TextContent(type="text", text=f"第 {offset} 行之后没有更多结果")]
+    return result_contents(env, page['sql'], sql_res, offset, output_format)
+
+
+@mcp.tool()
+async def stream_data(query: str, ctx: Context, batch_size: int = 0) -> list[TextContent]:
+    """Fetch a large result from database through a natural language query, streaming rows in batches
+
+    Rows are read through a server-side cursor and every batch is sent to the client as soon as it is read,
+    as a log notification (logger "xiyan.stream", a markdown table chunk) together with a progress notification.
+    The tool result only contains the SQL, the row count and the first batch.
+
+    Args:
+        query: The query in natural language
+        batch_size: Rows per batch, 0 uses the server default
     """
+    logger.info(f"Calling stream tool with arguments: {query}")
+    try:
+        env = await run_in_db_executor(schema_registry.get, global_db_name)
+    except Exception as e:
+        return [TextContent(type="text", text="数据库连接失败"+str(e))]
 
-    res=call_xiyan(query)
-    return [TextContent(type="text", text=res)]
+    batch_size = batch_size if batch_size > 0 else stream_batch_size
+
+    def error_info(e: Exception) -> str:
+        # 只返回数据库的原始报错，不带追加了 LIMIT 的SQL
+        return str(getattr(e, 'orig', None) or e)
+
+    async def open_stream(sql_query: str):
+        # 读取第一批即完成SQL的校验，出错时交给模型修复，不会重复执行成功的SQL
+        batches = env.database.aiter_batches(sql_query, batch_size, max_str_len=0, max_rows=stream_max_rows)
+        try:
+            first_batch = await batches.__anext__()
+        except Exception as e:
+            await batches.aclose()
+            return False, error_info(e)
+        return True, (batches, first_batch)
+
+    try:
+        sql_query, status, result = await generate_sql(env, query, open_stream)
+    except Exception as e:
+        return [TextContent(type="text", text=str(e))]
+    if not status:
+        return [TextContent(type="text", text=str(result))]
+
+    batches, (fields, first_rows) = result
+    row_count, batch_count, error = 0, 0, None
+    try:
+        batch = (fields, first_rows)
+        while batch is not None:
+            rows = batch[1]
+            row_count += len(rows)
+            batch_count += 1
+            chunk = env.database.rows_to_markdown(fields, rows, with_header=batch_count == 1)
+            await ctx.session.send_log_message(level="info", data=chunk, logger="xiyan.stream",
+                                               related_request_id=ctx.request_id)
+            await ctx.report_progress(row_count, None, f"已返回 {row_count} 行")
+            batch = await anext(batches, None)
+    except Exception as e:
+        error = error_info(e)
+        logger.error(f"Streaming result of {sql_query} failed: {error}")
+    finally:
+        await batches.aclose()
+
+    summary = f"SQL: {sql_query}\n共返回 {row_count} 行，分 {batch_count} 批发送"
+    if stream_max_rows and stream_max_rows > 0 and row_count >= stream_max_rows:
+        summary += f"(已达到上限 {stream_max_rows} 行)"
+    if error is not None:
+        summary += f"\n读取第 {row_count + 1} 行时出错: {error}"
+    preview = env.database.rows_to_markdown(fields, first_rows)
+    return [TextContent(type="text", text=f"{summary}\n\n{preview}")]
+
+
+def check_db_status():
+    """检查数据库连接，返回 (数据库状态, 连接池统计)"""
+    db_status = "正常"
+    pool_status = {"status": "未初始化"}
+    try:
+        db_engine = get_shared_engine(global_xiyan_db_config)
+        with db_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        pool_status = get_pool_status(db_engine)
+    except Exception as e:
+        db_status = f"异常: {str(e)}"
+    return db_status, pool_status
 
 
 @mcp.custom_route("/health", methods=["GET"])
@@ -230,13 +1041,8 @@ async def health_check(request: Request) -> Response:
     uptime = str(timedelta(seconds=int(uptime_seconds)))
     
     # 检查数据库连接
-    db_status = "正常"
-    try:
-        db_engine = init_db_conn(global_xiyan_db_config)
-        with db_engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-    except Exception as e:
-        db_status = f"异常: {str(e)}"
+    db_status, pool_status = await run_in_db_executor(check_db_status)
+    sql_cache_stats = await run_in_db_executor(sql_cache.stats) if sql_cache is not None else {"status": "未开启"}
     
     # 收集系统信息
     system_info = {
@@ -254,6 +1060,11 @@ async def health_check(request: Request) -> Response:
         "启动时间": datetime.fromtimestamp(server_start_time).strftime("%Y-%m-%d %H:%M:%S"),
         "运行时长": uptime,
         "数据库状态": db_status,
+        "连接池": pool_status,
+        "结果缓存": result_cache.stats() if result_cache is not None else {"status": "未开启"},
+        "结果文件": await run_in_db_executor(result_store.stats) if result_store is not None else {"status": "未开启"},
+        "SQL缓存": sql_cache_stats,
+        "只读路由": read_router.stats() if read_router is not None else {"status": "未开启"},
         "系统信息": system_info,
         "传输模式": mcp_config.get("transport", "sse"),
         "API地址": f"http://{mcp_config.get('host', '0.0.0.0')}:{mcp_config.get('port', 8080)}"
@@ -263,7 +1074,7 @@ async def health_check(request: Request) -> Response:
 
 # 添加一个命令行工具来检查服务器状态
 @mcp.tool()
-def check_server_status() -> list[TextContent]:
+async def check_server_status() -> list[TextContent]:
     """
     检查服务器运行状态
     
@@ -284,13 +1095,18 @@ def check_server_status() -> list[TextContent]:
     uptime = str(timedelta(seconds=int(uptime_seconds)))
     
     # 检查数据库连接
-    db_status = "正常"
-    try:
-        db_engine = init_db_conn(global_xiyan_db_config)
-        with db_engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-    except Exception as e:
-        db_status = f"异常: {str(e)}"
+    db_status, pool_status = await run_in_db_executor(check_db_status)
+    if sql_cache is not None:
+        cache_stats = await run_in_db_executor(sql_cache.stats)
+        sql_cache_status = f"{cache_stats['entries']} 条，命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次"
+    else:
+        sql_cache_status = "未开启"
+    if read_router is not None:
+        router_stats = read_router.stats()
+        read_router_status = f"{sum(1 for t in router_stats if t['healthy'])}/{len(router_stats)} 可用(" + \
+                             ", ".join(f"{t['name']}: {t['queries']} 次查询" for t in router_stats) + ")"
+    else:
+        read_router_status = "未开启"
     
     # 构建状态信息
     status_info = f"""
@@ -302,6 +1118,9 @@ def check_server_status() -> list[TextContent]:
     启动时间: {datetime.fromtimestamp(server_start_time).strftime("%Y-%m-%d %H:%M:%S")}
     运行时长: {uptime}
     数据库状态: {db_status}
+    连接池: {pool_status['status']}
+    SQL缓存: {sql_cache_status}
+    只读路由: {read_router_status}
     操作系统: {platform.system()}
     Python版本: {platform.python_version()}
     传输模式: {mcp_config.get("transport", "sse")}
@@ -312,13 +1131,108 @@ def check_server_status() -> list[TextContent]:
     return [TextContent(type="text", text=status_info)]
 
 
+@mcp.tool()
+async def refresh_schema(tables: str = "", full: bool = False) -> list[TextContent]:
+    """
+    刷新缓存的数据库 M-Schema
+
+    数据库表结构发生变化后调用，之后的 get_data 会使用最新的表结构。
+
+    Args:
+        tables: 需要刷新的表名，多个用逗号分隔；为空时自动检测结构发生变化的表
+        full: 为 true 时丢弃缓存，完整重建 M-Schema
+    """
+    try:
+        if full:
+            schema_registry.invalidate(global_db_name)
+            env = await run_in_db_executor(schema_registry.get, global_db_name)
+            schedule_value_index_build(force=True)
+            return [TextContent(type="text", text=f"已重建 {global_db_name} 的 M-Schema，共 {len(env.mschema.tables)} 张表")]
+
+        table_names = [t.strip() for t in tables.split(',') if t.strip()] or None
+        diff = await run_in_db_executor(schema_registry.refresh_tables, global_db_name, table_names)
+    except Exception as e:
+        return [TextContent(type="text", text="数据库连接失败"+str(e))]
+    return [TextContent(type="text", text=f"已刷新 {global_db_name} 的 M-Schema，新增: {diff['added']}，更新: {diff['changed']}，删除: {diff['removed']}")]
+
+
+def semantic_cache_namespace(db_env: DataBaseEnv) -> str:
+    """语义缓存按表结构版本和模型区分，表结构或模型变化后旧的问题不会被命中"""
+    return f"{db_env.database.schema_version}:{model_config['name']}"
+
+
+def seed_semantic_cache():
+    """用问题 -> SQL 缓存中当前表结构版本的问题预热语义缓存，并丢弃旧版本的问题"""
+    if semantic_cache is None:
+        return
+    env = schema_registry.get(global_db_name)
+    namespace = semantic_cache_namespace(env)
+    semantic_cache.retain(namespace)
+    if sql_cache is None:
+        return
+    entries = sql_cache.entries(env.database.schema_version, model_config['name'])
+    for question, sql_query in entries:
+        signature = literal_signature(question, [m[0] for m in lookup_values(question)])
+        semantic_cache.add(namespace, question, signature, sql_query)
+    logger.info(f"Semantic cache seeded with {len(entries)} questions")
+
+
+def warm_up_schema():
+    try:
+        schema_registry.get(global_db_name)
+        build_value_index()
+        seed_semantic_cache()
+    except Exception as e:
+        logger.error(f"预热 M-Schema 失败: {str(e)}")
+
+
+def sync_local(full: bool = False):
+    """把 table_pattern 匹配的表同步到 local_sync.path 指定的本地 SQLite，再次运行时从检查点继续或增量同步"""
+    local_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              local_sync_config.get('path', 'cache/local_replica.sqlite'))
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    # 同步只需要表名，不构建 M-Schema(逐表读取结构、采样取值)，直接按 table_pattern 过滤表名
+    remote_engine = get_shared_engine(global_xiyan_db_config)
+    pattern = re.compile(table_pattern)
+    table_names = sorted(name for name in inspect(remote_engine).get_table_names() if pattern.match(name))
+    local_engine = create_engine(f"sqlite:///{local_path}")
+    try:
+        local_sync = LocalSync(
+            remote_engine,
+            local_engine,
+            chunk_size=local_sync_config.get('chunk_size', 5000),
+            workers=local_sync_config.get('workers', 4),
+            updated_at_columns=local_sync_config.get('updated_at_columns') or None
+        )
+        summary = local_sync.run(table_names, full=full)
+    finally:
+        local_engine.dispose()
+    for table_name, result in summary.items():
+        logger.info(f"{table_name}: {result['mode']}, {result['rows']} rows, {result['status']}")
+    logger.info(f"本地副本: {local_path}")
+
 
 def main():
     parser = argparse.ArgumentParser(description="Run MCP server.")
     parser.add_argument('transport', nargs='?', default=mcp_config.get('transport', 'sse'),
                         choices=['stdio', 'sse'],
                         help='Transport type (stdio or sse)')
+    parser.add_argument('--sync-local', action='store_true',
+                        help='Sync tables to the local SQLite replica configured in local_sync and exit')
+    parser.add_argument('--full', action='store_true',
+                        help='With --sync-local, ignore checkpoints and rebuild every table')
     args = parser.parse_args()
+
+    if args.sync_local:
+        sync_local(full=args.full)
+        return
+
+    # 后台预热 M-Schema，服务启动后无需等待第一次请求构建 schema
+    threading.Thread(target=warm_up_schema, daemon=True).start()
+    max_age = value_index_config.get('max_age')
+    if value_index is not None and max_age is not None and max_age > 0:
+        threading.Thread(target=poll_value_index, args=(min(max_age, 600),), name="value-index-poller",
+                         daemon=True).start()
     
     try:
         mcp.run(transport=args.transport)
@@ -0,0 +1,61 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class ContinuationTokens:
+    """
+    续页令牌：把已验证的SQL和翻页位置编码进令牌，客户端用令牌继续取数时不需要再调用模型
+
+    令牌带 HMAC-SHA256 签名，客户端无法篡改其中的SQL；服务端不保存任何状态。
+    """
+
+    def __init__(self, secret: Optional[str] = None, ttl: Optional[float] = 3600):
+        """
+        Args:
+            secret: 签名密钥，为空时每次启动随机生成，重启后旧令牌失效
+            ttl: 令牌有效期(秒)，None 或 <=0 表示不过期
+        """
+        self._key = secret.encode('utf-8') if secret else os.urandom(32)
+        self.ttl = ttl if ttl and ttl > 0 else None
+
+    def _sign(self, payload: bytes) -> str:
+        return _b64encode(hmac.new(self._key, payload, hashlib.sha256).digest())
+
+    def encode(self, data: Dict[str, Any]) -> str:
+        """生成令牌，data 需要能被 JSON 序列化"""
+        data = dict(data)
+        if self.ttl is not None:
+            data['exp'] = int(time.time() + self.ttl)
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return f"{_b64encode(payload)}.{self._sign(payload)}"
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """校验签名和有效期并还原令牌中的数据，无效时抛出 InvalidToken"""
+        try:
+            encoded, signature = token.strip().split('.')
+            payload = _b64decode(encoded)
+        except ValueError:
+            raise InvalidToken("令牌格式错误")
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise InvalidToken("令牌签名无效")
+        data = json.loads(payload)
+        if 'exp' in data and data['exp'] < time.time():
+            raise InvalidToken("令牌已过期，请重新提问")
+        return data
@@ -11,6 +11,10 @@ class DBConfig:
     db_pwd: Optional[str] = None  # MySQL/PostgreSQL 通用
     db_host: Optional[str] = None  # MySQL/PostgreSQL 通用
     port: Optional[int] = None  # MySQL/PostgreSQL 通用
+    pool_size: int = 5  # 连接池常驻连接数
+    max_overflow: int = 10  # 连接池允许的额外连接数
+    pool_recycle: int = 3600  # 连接最长复用时间(秒)，需小于 MySQL 的 wait_timeout
+    pool_pre_ping: bool = True  # 取出连接前先 ping，自动剔除失效连接
 
     def __post_init__(self):
         if self.dialect == 'sqlite':
@@ -0,0 +1,304 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+
+MYSQL_TABLES_SQL = """
+SELECT TABLE_NAME, TABLE_COMMENT
+FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = COALESCE(:schema, DATABASE())
+"""
+
+MYSQL_COLUMNS_SQL = """
+SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, COLUMN_COMMENT, COLUMN_KEY, EXTRA
+FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = COALESCE(:schema, DATABASE())
+ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+MYSQL_FOREIGN_KEYS_SQL = """
+SELECT TABLE_NAME, COLUMN_NAME, REFERENCED_TABLE_SCHEMA, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME,
+       TABLE_SCHEMA
+FROM information_schema.KEY_COLUMN_USAGE
+WHERE TABLE_SCHEMA = COALESCE(:schema, DATABASE()) AND REFERENCED_TABLE_NAME IS NOT NULL
+ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+"""
+
+PG_TABLES_SQL = """
+SELECT c.relname, obj_description(c.oid, 'pg_class')
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = COALESCE(:schema, current_schema()) AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+"""
+
+PG_COLUMNS_SQL = """
+SELECT c.relname, a.attname, pg_catalog.format_type(a.atttypid, a.atttypmod), NOT a.attnotnull,
+       pg_catalog.pg_get_expr(d.adbin, d.adrelid), pg_catalog.col_description(c.oid, a.attnum), a.attidentity
+FROM pg_catalog.pg_attribute a
+JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_catalog.pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+WHERE n.nspname = COALESCE(:schema, current_schema()) AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+  AND a.attnum > 0 AND NOT a.attisdropped
+ORDER BY c.relname, a.attnum
+"""
+
+PG_CONSTRAINTS_SQL = """
+SELECT c.relname, con.contype, a.attname, rn.nspname, rc.relname, ra.attname, n.nspname
+FROM pg_catalog.pg_constraint con
+JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, refnum, ord)
+JOIN pg_catalog.pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+LEFT JOIN pg_catalog.pg_class rc ON rc.oid = con.confrelid
+LEFT JOIN pg_catalog.pg_namespace rn ON rn.oid = rc.relnamespace
+LEFT JOIN pg_catalog.pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.refnum
+WHERE n.nspname = COALESCE(:schema, current_schema()) AND con.contype IN ('p', 'f')
+ORDER BY c.relname, con.conname, k.ord
+"""
+
+# 表值 PRAGMA 函数(SQLite 3.16+)，一次查询取回所有表的字段和外键
+SQLITE_COLUMNS_SQL = """
+SELECT m.name, p.name, p.type, p."notnull", p.dflt_value, p.pk
+FROM {schema}.sqlite_master m
+JOIN pragma_table_info(m.name, :schema) p
+WHERE m.type IN ('table', 'view')
+ORDER BY m.name, p.cid
+"""
+
+SQLITE_FOREIGN_KEYS_SQL = """
+SELECT m.name, f."from", f."table", f."to"
+FROM {schema}.sqlite_master m
+JOIN pragma_foreign_key_list(m.name, :schema) f
+WHERE m.type = 'table'
+ORDER BY m.name, f.id, f.seq
+"""
+
+
+class SchemaIntrospector:
+    """
+    批量读取表结构元数据
+
+    MySQL / PostgreSQL 通过 information_schema / pg_catalog、SQLite 通过表值 PRAGMA 函数一次查询取回所有表的
+    注释、字段、主键和外键，其它方言退化为逐表调用 inspector。示例值通过有界线程池并行采样。
+    """
+
+    def __init__(self, engine: Engine, schema: Optional[str] = None, max_workers: int = 4):
+        """
+        Args:
+            engine: SQLAlchemy引擎
+            schema: 数据库schema，None 表示连接的默认schema
+            max_workers: 示例值采样的最大并发数，不应超过连接池大小
+        """
+        self._engine = engine
+        self._schema = schema
+        self._max_workers = max(1, max_workers)
+        self._dialect = engine.dialect.name
+
+    def fetch_tables(self, table_names: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        读取指定表的元数据
+
+        Returns:
+            {table_name: {"comment": str, "columns": [dict], "foreign_keys": [(column, ref_schema, ref_table, ref_column)]}}
+            columns 中的 dict 包含 name/type/nullable/default/autoincrement/comment/primary_key
+        """
+        table_names = list(table_names)
+        if len(table_names) == 0:
+            return {}
+        if self._dialect == 'mysql':
+            tables = self._fetch_mysql(set(table_names))
+        elif self._dialect == 'postgresql':
+            tables = self._fetch_pg(set(table_names))
+        elif self._dialect == 'sqlite':
+            tables = self._fetch_sqlite(set(table_names))
+        else:
+            tables = self._fetch_with_inspector(table_names)
+        # 按调用方给定的顺序返回
+        return {name: tables[name] for name in table_names if name in tables}
+
+    @staticmethod
+    def _new_table(comment) -> Dict[str, Any]:
+        comment = '' if comment is None else comment.strip()
+        return {"comment": comment, "columns": [], "foreign_keys": []}
+
+    def _fetch_mysql(self, table_names: set) -> Dict[str, Dict[str, Any]]:
+        tables = {}
+        params = {"schema": self._schema}
+        with self._engine.connect() as connection:
+            for name, comment in connection.execute(text(MYSQL_TABLES_SQL), params):
+                if name in table_names:
+                    tables[name] = self._new_table(comment)
+
+            for row in connection.execute(text(MYSQL_COLUMNS_SQL), params):
+                name, column, column_type, nullable, default, comment, key, extra = row
+                if name not in tables:
+                    continue
+                tables[name]["columns"].append({
+                    "name": column,
+                    "type": column_type.upper(),
+                    "nullable": nullable == 'YES',
+                    "default": default,
+                    "autoincrement": 'auto_increment' in (extra or '').lower(),
+                    "comment": '' if comment is None else comment.strip(),
+                    "primary_key": key == 'PRI',
+                })
+
+            for name, column, ref_schema, ref_table, ref_column, table_schema in \
+                    connection.execute(text(MYSQL_FOREIGN_KEYS_SQL), params):
+                if name not in tables:
+                    continue
+                # 与 inspector 保持一致：同一个schema内的外键 referred_schema 为 None
+                if ref_schema == table_schema:
+                    ref_schema = self._schema
+                tables[name]["foreign_keys"].append((column, ref_schema, ref_table, ref_column))
+        return tables
+
+    def _fetch_pg(self, table_names: set) -> Dict[str, Dict[str, Any]]:
+        tables = {}
+        params = {"schema": self._schema}
+        with self._engine.connect() as connection:
+            for name, comment in connection.execute(text(PG_TABLES_SQL), params):
+                if name in table_names:
+                    tables[name] = self._new_table(comment)
+
+            primary_keys = set()
+            foreign_keys = []
+            for name, con_type, column, ref_schema, ref_table, ref_column, table_schema in \
+                    connection.execute(text(PG_CONSTRAINTS_SQL), params):
+                if name not in tables:
+                    continue
+                if con_type == 'p':
+                    primary_keys.add((name, column))
+                else:
+                    if ref_schema == table_schema:
+                        ref_schema = self._schema
+                    foreign_keys.append((name, (column, ref_schema, ref_table, ref_column)))
+
+            for row in connection.execute(text(PG_COLUMNS_SQL), params):
+                name, column, column_type, nullable, default, comment, identity = row
+                if name not in tables:
+                    continue
+                default = default or None
+                tables[name]["columns"].append({
+                    "name": column,
+                    "type": column_type.upper(),
+                    "nullable": bool(nullable),
+                    "default": default,
+                    "autoincrement": bool(identity) or (default is not None and default.startswith('nextval(')),
+                    "comment": '' if comment is None else comment.strip(),
+                    "primary_key": (name, column) in primary_keys,
+                })
+
+            for name, fk in foreign_keys:
+                tables[name]["foreign_keys"].append(fk)
+        return tables
+
+    def _fetch_sqlite(self, table_names: set) -> Dict[str, Dict[str, Any]]:
+        tables = {}
+        # 外键没有写明引用字段时引用的是对方的主键
+        primary_keys: Dict[str, List[str]] = {}
+        schema = self._engine.dialect.identifier_preparer.quote_schema(self._schema or 'main')
+        params = {"schema": self._schema or 'main'}
+        with self._engine.connect() as connection:
+            for name, column, column_type, not_null, default, pk in \
+                    connection.execute(text(SQLITE_COLUMNS_SQL.format(schema=schema)), params):
+                if pk:
+                    primary_keys.setdefault(name, []).append(column)
+                if name not in table_names:
+                    continue
+                # sqlite不支持添加注释
+                table = tables.setdefault(name, self._new_table(''))
+                table["columns"].append({
+                    "name": column,
+                    "type": (column_type or '').upper(),
+                    "nullable": not not_null,
+                    "default": default,
+                    "autoincrement": False,
+                    "comment": '',
+                    "primary_key": bool(pk),
+                })
+
+            foreign_keys: Dict[tuple, int] = {}
+            for name, column, ref_table, ref_column in \
+                    connection.execute(text(SQLITE_FOREIGN_KEYS_SQL.format(schema=schema)), params):
+                if name not in tables:
+                    continue
+                if ref_column is None:
+                    index = foreign_keys.get((name, ref_table), 0)
+                    foreign_keys[(name, ref_table)] = index + 1
+                    ref_pks = primary_keys.get(ref_table, [])
+                    ref_column = ref_pks[index] if index < len(ref_pks) else None
+                tables[name]["foreign_keys"].append((column, self._schema, ref_table, ref_column))
+        return tables
+
+    def _fetch_with_inspector(self, table_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        inspector = inspect(self._engine)
+        tables = {}
+        for name in table_names:
+            try:
+                comment = inspector.get_table_comment(name, self._schema)['text']
+            except:    # sqlite不支持添加注释
+                comment = ''
+            table = self._new_table(comment)
+            pks = inspector.get_pk_constraint(name, self._schema)['constrained_columns']
+            for fk in inspector.get_foreign_keys(name, self._schema):
+                for c, r in zip(fk['constrained_columns'], fk['referred_columns']):
+                    table["foreign_keys"].append((c, fk['referred_schema'], fk['referred_table'], r))
+            for field in inspector.get_columns(name, schema=self._schema):
+                comment = field.get("comment", None)
+                default = field.get('default', None)
+                table["columns"].append({
+                    "name": field['name'],
+                    "type": f"{field['type']!s}",
+                    "nullable": field['nullable'],
+                    "default": default if default is None else f'{default}',
+                    "autoincrement": field.get('autoincrement', False),
+                    "comment": '' if comment is None else comment.strip(),
+                    "primary_key": field['name'] in pks,
+                })
+            tables[name] = table
+        return tables
+
+    def _qualified_name(self, table_name: str) -> str:
+        preparer = self._engine.dialect.identifier_preparer
+        if self._schema:
+            return f"{preparer.quote_schema(self._schema)}.{preparer.quote(table_name)}"
+        return preparer.quote(table_name)
+
+    def _sample_table(self, table_name: str, column_names: List[str], max_num: int) -> Dict[str, list]:
+        preparer = self._engine.dialect.identifier_preparer
+        qualified_name = self._qualified_name(table_name)
+        samples = {}
+        with self._engine.connect() as connection:
+            for column_name in column_names:
+                column = preparer.quote(column_name)
+                query = text(f"SELECT DISTINCT {column} FROM {qualified_name} LIMIT {int(max_num)}")
+                try:
+                    rows = connection.execute(query).fetchall()
+                    samples[column_name] = [row[0] for row in rows if row[0] is not None and row[0] != '']
+                except Exception:
+                    # 采样失败不影响 schema 构建，同时回滚以便连接继续使用
+                    connection.rollback()
+                    samples[column_name] = []
+        return samples
+
+    def sample_values(self, columns: Dict[str, List[str]], max_num: int = 5) -> Dict[str, Dict[str, list]]:
+        """
+        并行采样每个字段的不同取值，每张表一个任务，在同一个连接上依次查询该表的字段
+
+        Args:
+            columns: {table_name: [column_name]}
+            max_num: 每个字段最多采样的取值个数
+
+        Returns:
+            {table_name: {column_name: [value]}}
+        """
+        if len(columns) == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(columns))) as executor:
+            futures = {table_name: executor.submit(self._sample_table, table_name, column_names, max_num)
+                       for table_name, column_names in columns.items()}
+        return {table_name: future.result() for table_name, future in futures.items()}
@@ -1,4 +1,8 @@
+import hashlib
+import json
 import random
+import threading
+from collections import OrderedDict
 from .file_util import read_json_file, write_json_to_file, save_raw_text
 from .db_util import examples_to_str
 from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
@@ -10,9 +14,38 @@ class MSchema:
         self.schema = schema
         self.tables = {}
         self.foreign_keys = []
+        # 单表渲染结果缓存，key 的第一个元素为表名，表结构变化时按表失效
+        self._fragment_cache = {}
+        # schema 版本号（内容哈希），任何修改后置空，下次访问时重新计算
+        self._version = None
+        # 确定性渲染结果的 LRU 缓存，只保存当前版本的结果
+        self._render_cache = OrderedDict()
+        self._render_cache_lock = threading.Lock()
+        self.render_cache_size = 256
 
     def add_table(self, name, fields={}, comment=None):
         self.tables[name] = {"fields": fields.copy(), 'examples': [], 'comment': comment}
+        self.invalidate_tables([name])
+
+    def remove_table(self, name):
+        self.tables.pop(name, None)
+        self.foreign_keys = [fk for fk in self.foreign_keys if fk[0] != name]
+        self.invalidate_tables([name])
+
+    def replace_tables(self, tables: Dict, foreign_keys: List, changed_tables: Iterable[str]):
+        """
+        整体替换表和外键（引用赋值，正在渲染的线程仍然使用旧的字典），并只失效发生变化的表的渲染缓存
+        """
+        self.tables = tables
+        self.foreign_keys = foreign_keys
+        self.invalidate_tables(changed_tables)
+
+    def invalidate_tables(self, table_names: Iterable[str]):
+        self._version = None
+        table_names = set(table_names)
+        for key in list(self._fragment_cache.keys()):
+            if key[0] in table_names:
+                self._fragment_cache.pop(key, None)
 
     def add_field(self, table_name: str, field_name: str, field_type: str = "",
             primary_key: bool = False, nullable: bool = True, default: Any = None,
@@ -26,9 +59,21 @@ class MSchema:
             "comment": comment,
             "examples": examples.copy(),
             **kwargs}
+        self.invalidate_tables([table_name])
 
     def add_foreign_key(self, table_name, field_name, ref_schema, ref_table_name, ref_field_name):
         self.foreign_keys.append([table_name, field_name, ref_schema, ref_table_name, ref_field_name])
+        self._version = None
+
+    @property
+    def version(self) -> str:
+        """schema 版本号：对表、字段、示例值和外键的内容哈希，内容相同则版本号相同"""
+        version = self._version
+        if version is None:
+            content = json.dumps(self.dump(), sort_keys=True, ensure_ascii=False, default=str)
+            version = hashlib.md5(content.encode('utf-8')).hexdigest()
+            self._version = version
+        return version
 
     def get_field_type(self, field_type, simple_mode=True)->str:
         if not simple_mode:
@@ -58,7 +103,30 @@ class MSchema:
             return {}
 
     def single_table_mschema(self, table_name: str, selected_columns: Optional[List] = None,
-                             example_num=3, show_type_detail=False, shuffle=True) -> str:
+                             example_num=3, show_type_detail=False, shuffle=True, seed: Optional[str] = None) -> str:
+        cache_key = (table_name, None if selected_columns is None else tuple(selected_columns),
+                     example_num, show_type_detail)
+        lines = self._fragment_cache.get(cache_key)
+        if lines is None:
+            lines = self._table_mschema_lines(table_name, selected_columns, example_num, show_type_detail)
+            self._fragment_cache[cache_key] = lines
+        header, field_lines = lines
+        field_lines = list(field_lines)
+
+        if shuffle:
+            if seed is None:
+                random.shuffle(field_lines)
+            else:
+                random.Random(f"{seed}:{table_name}").shuffle(field_lines)
+
+        output = [header, '[']
+        output.append(',\n'.join(field_lines))
+        output.append(']')
+
+        return '\n'.join(output)
+
+    def _table_mschema_lines(self, table_name: str, selected_columns: Optional[List] = None,
+                             example_num=3, show_type_detail=False) -> Tuple[str, List[str]]:
         table_info = self.tables.get(table_name, {})
         output = []
         table_comment = table_info.get('comment', '')
@@ -119,21 +187,15 @@ class MSchema:
 
             field_lines.append(field_line)
 
-        if shuffle:
-            random.shuffle(field_lines)
-
-        output.append('[')
-        output.append(',\n'.join(field_lines))
-        output.append(']')
-
-        return '\n'.join(output)
+        return output[0], field_lines
 
     def to_mschema(self, selected_tables: Optional[List] = None, selected_columns: Optional[List] = None,
-                   example_num=3, show_type_detail=False, shuffle=True) -> str:
+                   example_num=3, show_type_detail=False, shuffle=True, seed: Optional[str] = None) -> str:
         """
         convert to a MSchema string.
         selected_tables: 默认为None，表示选择所有的表
         selected_columns: 默认为None，表示所有列全选，格式['table_name.column_name']
+        seed: 随机种子，提供时表和外键先按名称排序，再用种子打乱，输出是确定的
         """
         output = []
 
@@ -143,8 +205,12 @@ class MSchema:
             selected_columns = [s.lower() for s in selected_columns]
             selected_tables = [s.split('.')[0].lower() for s in selected_columns]
 
+        tables = self.tables
+        if seed is not None:
+            tables = {table_name: tables[table_name] for table_name in sorted(tables.keys())}
+
         # 依次处理每一个表
-        for table_name, table_info in self.tables.items():
+        for table_name, table_info in tables.items():
             if selected_tables is None or table_name.lower() in selected_tables:
                 cur_table_type = table_info.get('type', 'table')
                 column_names = list(table_info['fields'].keys())
@@ -152,10 +218,14 @@ class MSchema:
                     cur_selected_columns = [c for c in column_names if f"{table_name}.{c}".lower() in selected_columns]
                 else:
                     cur_selected_columns = selected_columns
-                output.append(self.single_table_mschema(table_name, cur_selected_columns, example_num, show_type_detail, shuffle))
+                output.append(self.single_table_mschema(table_name, cur_selected_columns, example_num,
+                                                        show_type_detail, shuffle, seed))
 
         if shuffle:
-            random.shuffle(output)
+            if seed is None:
+                random.shuffle(output)
+            else:
+                random.Random(seed).shuffle(output)
 
         output.insert(0, f"【DB_ID】 {self.db_id}")
         output.insert(1, f"【Schema】")
@@ -163,7 +233,8 @@ class MSchema:
         # 添加外键信息，选择table_type为view时不展示外键
         if self.foreign_keys:
             output.append("【Foreign keys】")
-            for fk in self.foreign_keys:
+            foreign_keys = self.foreign_keys if seed is None else sorted(self.foreign_keys, key=str)
+            for fk in foreign_keys:
                 ref_schema = fk[2]
                 table1, column1, _, table2, column2 = fk
                 if selected_tables is None or \
@@ -173,6 +244,36 @@ class MSchema:
 
         return '\n'.join(output)
 
+    def to_canonical_mschema(self, selected_tables: Optional[List] = None, selected_columns: Optional[List] = None,
+                             example_num=3, show_type_detail=False, shuffle=True) -> str:
+        """
+        确定性的 M-Schema 字符串，同一版本的 schema 和相同参数得到逐字节相同的结果，
+        便于模型服务端做前缀/KV 缓存，结果按参数缓存
+        shuffle: True 时以 schema 版本号为种子打乱顺序，False 时按表名和字段定义顺序输出
+        """
+        version = self.version
+        key = (version,
+               None if selected_tables is None else tuple(sorted(s.lower() for s in selected_tables)),
+               None if selected_columns is None else tuple(sorted(s.lower() for s in selected_columns)),
+               example_num, show_type_detail, shuffle)
+        with self._render_cache_lock:
+            if key in self._render_cache:
+                self._render_cache.move_to_end(key)
+                return self._render_cache[key]
+
+        # 提供 seed 后即使不打乱也按表名排序，保证顺序与构建/刷新的先后无关
+        mschema_str = self.to_mschema(selected_tables, selected_columns, example_num, show_type_detail,
+                                      shuffle=shuffle, seed=version)
+
+        with self._render_cache_lock:
+            # 版本变化后旧版本的结果不会再被命中，直接清掉
+            for old_key in [k for k in self._render_cache if k[0] != version]:
+                del self._render_cache[old_key]
+            self._render_cache[key] = mschema_str
+            while len(self._render_cache) > self.render_cache_size:
+                self._render_cache.popitem(last=False)
+        return mschema_str
+
     def dump(self):
         schema_dict = {
             "db_id": self.db_id,
@@ -197,8 +298,14 @@ class MSchema:
         
         if not isinstance(data, dict):
             raise TypeError(f"Expected dict from read_json_file, got {type(data)}")
-        
+
+        self.load_dict(data)
+
+    def load_dict(self, data: Dict):
+        """从 dump() 得到的字典恢复"""
         self.db_id = data.get("db_id", "Anonymous")
         self.schema = data.get("schema", None)
         self.tables = data.get("tables", {})
         self.foreign_keys = data.get("foreign_keys", [])
+        self._fragment_cache = {}
+        self._version = None
@@ -0,0 +1,134 @@
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger("xiyan_mcp_server")
+
+ROUTING_STRATEGIES = ['round_robin', 'least_connections']
+
+
+class _Target:
+    """一个可供读取的数据库(副本或主库)及其健康状态"""
+
+    def __init__(self, name: str, engine: Engine):
+        self.name = name
+        self.engine = engine
+        self.in_flight = 0
+        self.queries = 0
+        # 连续失败次数，成功一次后清零
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class ReadRouter:
+    """
+    只读查询路由：把生成的查询分发到只读副本，副本不可用时暂时摘除
+
+    按 round_robin(轮询)或 least_connections(当前执行中的查询最少)选择副本；取连接失败或连接在查询中断开
+    都记为一次失败，连续失败 max_failures 次后摘除 eject_seconds 秒，到期后重新尝试，再失败一次就再次摘除。
+    所有副本都不可用时回退到 fallback(一般是主库的只读连接)，没有 fallback 时仍尝试被摘除的副本。
+    """
+
+    def __init__(self, replicas: Dict[str, Engine], fallback: Optional[Engine] = None,
+                 strategy: str = 'round_robin', max_failures: int = 3, eject_seconds: float = 30):
+        """
+        Args:
+            replicas: {副本名: Engine}
+            fallback: 所有副本都不可用时使用的 Engine，没有副本时所有查询都在它上面执行
+            strategy: round_robin 或 least_connections
+            max_failures: 连续失败多少次后摘除副本
+            eject_seconds: 摘除的时长(秒)
+        """
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"Unsupported routing strategy: {strategy}, expected one of {ROUTING_STRATEGIES}")
+        self.strategy = strategy
+        self.max_failures = max(1, max_failures)
+        self.eject_seconds = eject_seconds
+        self._replicas = [_Target(name, engine) for name, engine in replicas.items()]
+        self._fallback = _Target('primary', fallback) if fallback is not None else None
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _candidates(self) -> List[_Target]:
+        """按尝试顺序排列的目标：健康的副本、fallback、被摘除的副本"""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [t for t in self._replicas if t.healthy(now)]
+            ejected = [t for t in self._replicas if not t.healthy(now)]
+            if len(healthy) > 0:
+                # 从轮询位置开始旋转，least_connections 在执行中的查询数相同时也按轮询分散
+                start = next(self._counter) % len(healthy)
+                healthy = healthy[start:] + healthy[:start]
+                if self.strategy == 'least_connections':
+                    healthy.sort(key=lambda t: t.in_flight)
+        candidates = healthy
+        if self._fallback is not None:
+            candidates.append(self._fallback)
+        return candidates + ejected
+
+    def _record(self, target: _Target, failed: bool):
+        with self._lock:
+            if not failed:
+                target.failures = 0
+                return
+            target.failures += 1
+            if target is not self._fallback and target.failures >= self.max_failures:
+                target.ejected_until = time.monotonic() + self.eject_seconds
+                logger.warning(f"Replica {target.name} ejected for {self.eject_seconds}s "
+                               f"after {target.failures} consecutive failures")
+
+    @contextmanager
+    def begin(self) -> Iterator[Connection]:
+        """
+        取一个只读连接并开启事务，用法与 Engine.begin() 相同；取连接失败时依次尝试下一个目标
+
+        查询本身的报错(例如SQL错误)不会切换目标，也不计为失败，只有连接被判定失效时才计入
+        """
+        last_error: Optional[Exception] = None
+        for target in self._candidates():
+            try:
+                connection = target.engine.connect()
+            except Exception as e:
+                last_error = e
+                logger.warning(f"Failed to connect to {target.name}: {e}")
+                self._record(target, failed=True)
+                continue
+
+            with self._lock:
+                target.in_flight += 1
+                target.queries += 1
+            invalidated = False
+            try:
+                with connection, connection.begin():
+                    try:
+                        yield connection
+                    finally:
+                        invalidated = connection.invalidated
+            finally:
+                with self._lock:
+                    target.in_flight -= 1
+                self._record(target, failed=invalidated)
+            return
+        if last_error is None:
+            raise RuntimeError("No database available for read queries")
+        raise last_error
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        targets = self._replicas + ([self._fallback] if self._fallback is not None else [])
+        with self._lock:
+            return [{
+                "name": t.name,
+                "healthy": t.healthy(now),
+                "in_flight": t.in_flight,
+                "queries": t.queries,
+                "failures": t.failures,
+            } for t in targets]
@@ -1,12 +1,29 @@
-from typing import Any, Dict, List, Optional, Tuple, Pattern
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Pattern
+import hashlib
+import json
+import logging
 import re
+import threading
+import time
 
 from llama_index.core import SQLDatabase
 from sqlalchemy import MetaData, Table, select, text, inspect
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
 
+from .db_introspect import SchemaIntrospector
 from .db_mschema import MSchema
-from .db_util import examples_to_str, preprocess_sql_query
+from .db_router import ReadRouter
+from .local_sync import LocalSync
+from .query_cost import COST_EXPLAIN_PREFIXES, parse_plan
+from .db_util import examples_to_str, is_select_query, preprocess_sql_query, push_down_limit, run_in_db_executor
+from .result_cache import ResultCache, referenced_tables
+from .schema_snapshot import load_snapshot, save_snapshot, table_fingerprint
+
+logger = logging.getLogger("xiyan_mcp_server")
+
+# 各方言只生成执行计划、不执行查询的写法
+EXPLAIN_PREFIXES = {'mysql': 'EXPLAIN ', 'postgresql': 'EXPLAIN ', 'sqlite': 'EXPLAIN QUERY PLAN '}
 
 
 class HITLSQLDatabase(SQLDatabase):
@@ -15,7 +32,8 @@ class HITLSQLDatabase(SQLDatabase):
                  table_pattern: Optional[str] = None, sample_rows_in_table_info: int = 3, 
                  indexes_in_table_info: bool = False, custom_table_info: Optional[dict] = None, 
                  view_support: bool = False, max_string_length: int = 300,
-                 mschema: Optional[MSchema] = None, db_name: str = ''):
+                 mschema: Optional[MSchema] = None, db_name: str = '', introspect_workers: int = 4,
+                 snapshot_path: Optional[str] = None):
         """
         初始化HITLSQLDatabase
         
@@ -33,41 +51,105 @@ class HITLSQLDatabase(SQLDatabase):
             max_string_length: 最大字符串长度
             mschema: MSchema对象
             db_name: 数据库名称
+            introspect_workers: 构建M-Schema时并行采样示例值的线程数
+            snapshot_path: M-Schema快照文件路径，提供时从快照热启动，只重新读取结构发生变化的表
         """
+        self._engine = engine
+        self._schema = schema
+        self._inspector = inspect(engine)
+        self._all_tables = set(
+            self._inspector.get_table_names(schema=schema)
+            + (self._inspector.get_view_names(schema=schema) if view_support else [])
+        )
         # 如果提供了正则表达式模式，使用它来过滤表名
         if table_pattern is not None:
-            # 创建临时inspector获取所有表名
-            temp_inspector = inspect(engine)
-            all_tables = temp_inspector.get_table_names(schema=schema)
-            
             # 编译正则表达式
             pattern = re.compile(table_pattern)
             
-            # 过滤符合正则表达式的表名
-            filtered_tables = [table for table in all_tables if pattern.match(table)]
-            
-            # 使用过滤后的表名作为include_tables
-            include_tables = filtered_tables
-        
-        # 调用父类初始化方法
-        super().__init__(engine, schema, metadata, ignore_tables, include_tables, sample_rows_in_table_info,
-                         indexes_in_table_info, custom_table_info, view_support, max_string_length)
+            # 过滤符合正则表达式的表名，作为include_tables
+            include_tables = [table for table in self._all_tables if pattern.match(table)]
+
+        # 不调用父类初始化方法：SQLDatabase.__init__ 会对所有可用的表逐表 MetaData.reflect，
+        # 而 M-Schema 已经通过 SchemaIntrospector 批量读取，这里只设置父类方法用到的属性，metadata 在首次使用时再反射
+        if include_tables and ignore_tables:
+            raise ValueError("Cannot specify both include_tables and ignore_tables")
+        self._include_tables = set(include_tables) if include_tables else set()
+        self._ignore_tables = set(ignore_tables) if ignore_tables else set()
+        for name, tables in [('include_tables', self._include_tables), ('ignore_tables', self._ignore_tables)]:
+            missing_tables = tables - self._all_tables
+            if missing_tables:
+                raise ValueError(f"{name} {missing_tables} not found in database")
+        usable_tables = self.get_usable_table_names()
+        self._usable_tables = set(usable_tables) if usable_tables else self._all_tables
+        self._sample_rows_in_table_info = sample_rows_in_table_info
+        self._indexes_in_table_info = indexes_in_table_info
+        self._custom_table_info = {table: info for table, info in (custom_table_info or {}).items()
+                                   if table in self._all_tables}
+        self._max_string_length = max_string_length
+        self._view_support = view_support
+        self._metadata = metadata or MetaData()
+        self._metadata_reflected = False
+        self._metadata_lock = threading.Lock()
 
         self._db_name = db_name
         # self._usable_tables = [table_name for table_name in self._usable_tables if self._inspector.has_table(table_name, schema)]
         self._dialect = engine.dialect.name
+        self._introspect_workers = introspect_workers
+        self._snapshot_path = snapshot_path
+        self._table_pattern = table_pattern
+        # 每张表的结构指纹，用于判断快照中的表是否需要重新读取
+        self._fingerprints: Dict[str, str] = {}
+        self._schema_version: Optional[str] = None
+        self._result_cache: Optional[ResultCache] = None
+        self._statement_timeout: Optional[float] = None
+        self._read_router: Optional[ReadRouter] = None
+        self._cache_db_id = engine.url.render_as_string(hide_password=True)
         if mschema is not None:
             self._mschema = mschema
         else:
             self._mschema = MSchema(db_id=db_name or "Anonymous", schema=schema)
             self._mschema = MSchema(db_id=db_name, schema=schema)
-            self.init_mschema()
+            if snapshot_path is not None:
+                self.init_mschema_from_snapshot(snapshot_path)
+            else:
+                self.init_mschema()
+
+    @property
+    def metadata_obj(self) -> MetaData:
+        """第一次使用时才反射可用的表"""
+        with self._metadata_lock:
+            if not self._metadata_reflected:
+                self._metadata.reflect(views=self._view_support, bind=self._engine,
+                                       only=list(self._usable_tables), schema=self._schema)
+                self._metadata_reflected = True
+        return self._metadata
+
+    def insert_into_table(self, table_name: str, data: dict) -> None:
+        # 父类直接读取 self._metadata.tables，先确保已经反射
+        self.metadata_obj
+        super().insert_into_table(table_name, data)
 
     @property
     def mschema(self) -> MSchema:
         """Return M-Schema"""
         return self._mschema
 
+    @property
+    def schema_version(self) -> str:
+        """
+        表结构版本号：对每张表的结构指纹做哈希，不包含示例值，数据变化或重新采样示例值不会改变版本号，
+        用作结果缓存、SQL缓存和语义缓存的键
+        """
+        version = self._schema_version
+        if version is None:
+            if len(self._fingerprints) == 0:
+                # 直接传入 M-Schema 时没有结构指纹
+                return self._mschema.version
+            content = json.dumps(sorted(self._fingerprints.items()))
+            version = hashlib.md5(content.encode('utf-8')).hexdigest()
+            self._schema_version = version
+        return version
+
     @property
     def db_name(self) -> Optional[str]:
         """Return db_name"""
@@ -95,7 +177,8 @@ class HITLSQLDatabase(SQLDatabase):
         return self._inspector.get_unique_constraints(table_name, self._schema)
     
     def fectch_distinct_values(self, table_name: str, column_name: str, max_num: int = 5):
-        table = Table(table_name, self.metadata_obj, autoload_with=self._engine)
+        # 只反射这一张表
+        table = Table(table_name, MetaData(), autoload_with=self._engine, schema=self._schema)
         # 构建 SELECT DISTINCT 查询
         query = select(table.c[column_name]).distinct().limit(max_num)
         values = []
@@ -107,13 +190,132 @@ class HITLSQLDatabase(SQLDatabase):
                     values.append(value[0])
         return values
     
+    def iter_distinct_values(self, table_name: str, column_name: str, chunk_size: int = 5000,
+                             max_values: Optional[int] = None) -> Iterator[List[Any]]:
+        """
+        流式读取字段的不同取值，每次产出一批，服务端游标保证内存占用只与 chunk_size 有关
+        """
+        preparer = self._engine.dialect.identifier_preparer
+        table = preparer.quote(table_name)
+        if self._schema:
+            table = f"{preparer.quote_schema(self._schema)}.{table}"
+        column = preparer.quote(column_name)
+        query = f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL"
+        if max_values:
+            query += f" LIMIT {int(max_values)}"
+
+        with self._engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(text(query))
+            for rows in result.partitions(chunk_size):
+                yield [row[0] for row in rows]
+
+    def primary_key(self, table_name: str) -> Optional[str]:
+        """表的单字段主键，没有主键或者是联合主键时返回 None"""
+        fields = self._mschema.tables[table_name]['fields']
+        keys = [name for name, info in fields.items() if info.get('primary_key')]
+        return keys[0] if len(keys) == 1 else None
+
+    def preview_table(self, table_name: str, columns: Optional[List[str]] = None, limit: int = 100,
+                      offset: int = 0, after: Any = None) -> Tuple[List[str], List[tuple], bool, Any]:
+        """
+        分页读取表的内容，表名和字段名必须存在于 M-Schema 中，标识符按方言加引号，取值通过参数绑定
+
+        有单字段主键时按主键排序，after 不为空时按主键翻页(WHERE 主键 > after)，
+        不需要像 OFFSET 那样扫描并丢弃前面的行；没有主键时只能使用 offset
+
+        Args:
+            table_name: 表名
+            columns: 需要读取的字段，None 表示所有字段
+            limit: 最多读取的行数
+            offset: 跳过的行数
+            after: 上一页最后一行的主键值
+
+        Returns:
+            (字段名, 行, 是否还有更多行, 最后一行的主键值)；返回的字段与 columns 完全一致，
+            columns 中没有主键时主键只在内部读取，用于下一页的 after，没有主键时最后一项为 None
+        """
+        if not self._mschema.has_table(table_name):
+            raise ValueError(f"Table {table_name} does not exist")
+        fields = self._mschema.tables[table_name]['fields']
+        columns = list(columns) if columns else list(fields.keys())
+        for column in columns:
+            if column not in fields:
+                raise ValueError(f"Column {column} does not exist in table {table_name}")
+        primary_key = self.primary_key(table_name)
+        if after is not None:
+            if primary_key is None:
+                raise ValueError(f"Table {table_name} has no single-column primary key, use offset instead")
+            if 'int' in str(fields[primary_key].get('type', '')).lower():
+                after = int(after)
+        # 主键不在请求的字段中时追加在最后读取，返回前去掉
+        select_columns = columns
+        if primary_key is not None and primary_key not in columns:
+            select_columns = columns + [primary_key]
+
+        preparer = self._engine.dialect.identifier_preparer
+        table = preparer.quote(table_name)
+        if self._schema:
+            table = f"{preparer.quote_schema(self._schema)}.{table}"
+        query = f"SELECT {', '.join(preparer.quote(c) for c in select_columns)} FROM {table}"
+        params = {}
+        if after is not None:
+            query += f" WHERE {preparer.quote(primary_key)} > :after"
+            params['after'] = after
+        if primary_key is not None:
+            query += f" ORDER BY {preparer.quote(primary_key)}"
+        query += f" LIMIT {int(limit) + 1}"
+        if offset:
+            query += f" OFFSET {int(offset)}"
+
+        with self.read_connection() as connection:
+            with self.statement_timeout(connection):
+                rows = [tuple(row) for row in connection.execute(text(query), params).fetchmany(int(limit) + 1)]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        last_key = rows[-1][select_columns.index(primary_key)] if primary_key is not None and rows else None
+        if len(select_columns) > len(columns):
+            rows = [row[:len(columns)] for row in rows]
+        return columns, rows, has_more, last_key
+
+    def set_result_cache(self, result_cache: Optional[ResultCache], db_id: Optional[str] = None):
+        """
+        设置查询结果缓存，fetch/fetch_truncated/fetch_limited 成功的只读查询结果会被缓存
+
+        Args:
+            result_cache: 结果缓存，None 表示不使用缓存
+            db_id: 数据库标识，默认为不含密码的连接串
+        """
+        self._result_cache = result_cache
+        if db_id is not None:
+            self._cache_db_id = db_id
+
+    def _cached_fetch(self, method: str, sql_query: str, params: tuple, fetch, succeeded):
+        """
+        先查结果缓存，未命中时执行 fetch，succeeded(结果) 为真时写入缓存；
+        键包含表结构版本，表结构变化后旧结果不会再被命中
+        """
+        if self._result_cache is None or not is_select_query(sql_query):
+            return fetch(sql_query, *params)
+        key = self._result_cache.make_key(self._cache_db_id, self.schema_version, sql_query, method, *params)
+        result = self._result_cache.get(key)
+        if result is not None:
+            return result
+        result = fetch(sql_query, *params)
+        if succeeded(result):
+            self._result_cache.put(key, result, referenced_tables(sql_query, self._mschema.tables.keys()))
+        return result
+
     def fetch(self, sql_query: str):
+        return self._cached_fetch('fetch', sql_query, (), self._fetch, lambda res: res[0])
+
+    def _fetch(self, sql_query: str):
         sql_query = preprocess_sql_query(sql_query)
 
-        with self._engine.begin() as connection:
+        with self.read_connection() as connection:
             try:
-                cursor = connection.execute(text(sql_query))
-                records = cursor.fetchall()
+                with self.statement_timeout(connection):
+                    cursor = connection.execute(text(sql_query))
+                    records = cursor.fetchall()
                 records = [tuple(row) for row in records]
                 return True, records
             except Exception as e:
@@ -124,7 +326,7 @@ class HITLSQLDatabase(SQLDatabase):
     def fetch_with_column_name(self, sql_query: str):
         sql_query = preprocess_sql_query(sql_query)
 
-        with self._engine.begin() as connection:
+        with self.read_connection() as connection:
             try:
                 cursor = connection.execute(text(sql_query))
                 columns = cursor.keys()
@@ -138,7 +340,7 @@ class HITLSQLDatabase(SQLDatabase):
     def fetch_with_error_info(self, sql_query: str) -> Tuple[Optional[Any], str]:
         info = ''
         sql_query = preprocess_sql_query(sql_query)
-        with self._engine.begin() as connection:
+        with self.read_connection() as connection:
             try:
                 cursor = connection.execute(text(sql_query))
                 records = cursor.fetchall()
@@ -148,14 +350,17 @@ class HITLSQLDatabase(SQLDatabase):
         return records, info
 
     def fetch_truncated(self, sql_query: str, max_rows: Optional[int] = None, max_str_len: int = 30) -> Dict:
+        return self._cached_fetch('fetch_truncated', sql_query, (max_rows, max_str_len), self._fetch_truncated,
+                                  lambda res: isinstance(res['truncated_results'], list))
+
+    def _fetch_truncated(self, sql_query: str, max_rows: Optional[int] = None, max_str_len: int = 30) -> Dict:
         sql_query = preprocess_sql_query(sql_query)
-        with self._engine.begin() as connection:
+        with self.read_connection() as connection:
             try:
-                cursor = connection.execute(text(sql_query))
-                result = cursor.fetchall()
+                with self.statement_timeout(connection):
+                    cursor = connection.execute(text(sql_query))
+                    result = cursor.fetchmany(max_rows) if max_rows else cursor.fetchall()
                 truncated_results = []
-                if max_rows:
-                    result = result[:max_rows]
                 for row in result:
                     truncated_row = tuple(
                         self.truncate_word(column, length=max_str_len)
@@ -169,6 +374,254 @@ class HITLSQLDatabase(SQLDatabase):
                 records = str(e)
                 return {"truncated_results": records, "fields": []}
 
+    def fetch_limited(self, sql_query: str, max_rows: Optional[int] = None, max_str_len: int = 30,
+                      limit_push_down: bool = True) -> Tuple[bool, Dict]:
+        """
+        只执行一次SQL，同时完成校验和取数，成功的结果会写入结果缓存，见 _fetch_limited
+        """
+        return self._cached_fetch('fetch_limited', sql_query, (max_rows, max_str_len, limit_push_down),
+                                  self._fetch_limited, lambda res: res[0])
+
+    def _fetch_limited(self, sql_query: str, max_rows: Optional[int] = None, max_str_len: int = 30,
+                       limit_push_down: bool = True) -> Tuple[bool, Dict]:
+        """
+        只执行一次SQL，同时完成校验和取数
+
+        使用服务端游标(stream_results)并且只 fetchmany(max_rows + 1) 行，可选地把查询的行数限制收紧到 max_rows + 1
+        (原有 LIMIT 更小时保留原来的)，数据库最多只产生 max_rows + 1 行，多出的一行用来判断是否还有更多结果
+
+        Returns:
+            (是否执行成功, {"truncated_results": 截断后的结果或错误信息, "fields": 字段名, "has_more": 是否还有更多行})
+        """
+        sql_query = preprocess_sql_query(sql_query)
+        if max_rows and limit_push_down:
+            sql_query = push_down_limit(sql_query, max_rows + 1, self._dialect)
+
+        with self.read_connection() as connection:
+            try:
+                with self.statement_timeout(connection):
+                    cursor = connection.execution_options(stream_results=True).execute(text(sql_query))
+                    if not cursor.returns_rows:
+                        return True, {"truncated_results": [], "fields": [], "has_more": False}
+                    fields = list(cursor.keys())
+                    result = cursor.fetchmany(max_rows + 1) if max_rows else cursor.fetchall()
+                    # 关闭服务端游标时驱动会读完并丢弃剩余的行(例如 pymysql 的 SSCursor)，
+                    # 查询已经限制为 max_rows + 1 行时不会再传输多余的数据；关闭 limit_push_down 时剩余的行仍会被传输
+                    cursor.close()
+                has_more = bool(max_rows) and len(result) > max_rows
+                if has_more:
+                    result = result[:max_rows]
+                truncated_results = [
+                    tuple(self.truncate_word(column, length=max_str_len) for column in row)
+                    for row in result
+                ]
+                return True, {"truncated_results": truncated_results, "fields": fields, "has_more": has_more}
+            except Exception as e:
+                # 只返回数据库的原始报错，不带追加了 LIMIT 的SQL，避免修复时把 LIMIT 带进新的SQL
+                return False, {"truncated_results": str(getattr(e, 'orig', None) or e), "fields": []}
+
+    async def afetch_limited(self, sql_query: str, max_rows: Optional[int] = None, max_str_len: int = 30,
+                             limit_push_down: bool = True) -> Tuple[bool, Dict]:
+        """fetch_limited 的异步版本，在数据库线程池中执行"""
+        return await run_in_db_executor(self.fetch_limited, sql_query, max_rows, max_str_len, limit_push_down)
+
+    async def afetch(self, sql_query: str):
+        """fetch 的异步版本，在数据库线程池中执行"""
+        return await run_in_db_executor(self.fetch, sql_query)
+
+    async def afetch_truncated(self, sql_query: str, max_rows: Optional[int] = None, max_str_len: int = 30) -> Dict:
+        """fetch_truncated 的异步版本，在数据库线程池中执行"""
+        return await run_in_db_executor(self.fetch_truncated, sql_query, max_rows, max_str_len)
+
+    def set_read_router(self, read_router: Optional[ReadRouter]):
+        """
+        设置只读查询路由，执行生成的查询(fetch、fetch_limited、explain、iter_batches 等)时使用副本的只读连接；
+        读取表结构、采样示例值仍然使用主库
+
+        Args:
+            read_router: 只读查询路由，None 表示在主库上执行
+        """
+        self._read_router = read_router
+
+    @contextmanager
+    def read_connection(self) -> Iterator[Connection]:
+        """执行只读查询的连接(已开启事务)，设置了只读查询路由时由路由选择副本"""
+        if self._read_router is None:
+            with self._engine.begin() as connection:
+                yield connection
+        else:
+            with self._read_router.begin() as connection:
+                yield connection
+
+    def set_statement_timeout(self, timeout: Optional[float]):
+        """设置单条语句的执行超时(秒)，None 或 <=0 表示不限制"""
+        self._statement_timeout = timeout if timeout and timeout > 0 else None
+
+    @contextmanager
+    def statement_timeout(self, connection: Connection, timeout: Optional[float] = None):
+        """
+        在 connection 上限制语句的执行时间，超时后由数据库中断查询并报错
+
+        MySQL 使用会话变量 max_execution_time(只对 SELECT 生效)，退出时恢复默认值；
+        PostgreSQL 使用 SET LOCAL statement_timeout，事务结束后自动失效；
+        SQLite 使用 progress handler，超过截止时间后中断正在执行的语句
+
+        Args:
+            connection: 数据库连接
+            timeout: 超时时间(秒)，None 时使用 set_statement_timeout 设置的值
+        """
+        timeout = timeout if timeout is not None else self._statement_timeout
+        if not timeout or timeout <= 0:
+            yield
+            return
+        timeout_ms = int(timeout * 1000)
+        if self._dialect == 'mysql':
+            connection.exec_driver_sql(f"SET SESSION max_execution_time = {timeout_ms}")
+            try:
+                yield
+            finally:
+                try:
+                    connection.exec_driver_sql("SET SESSION max_execution_time = DEFAULT")
+                except Exception:
+                    # 连接已断开时无需恢复，连接池会丢弃它
+                    pass
+        elif self._dialect == 'postgresql':
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+            yield
+        elif self._dialect == 'sqlite':
+            dbapi_connection = connection.connection.dbapi_connection
+            deadline = time.monotonic() + timeout
+            # 返回非 0 时 SQLite 中断当前语句，报 interrupted
+            dbapi_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+            try:
+                yield
+            finally:
+                dbapi_connection.set_progress_handler(None, 0)
+        else:
+            yield
+
+    def estimate_cost(self, sql_query: str) -> Tuple[bool, Any]:
+        """
+        通过 EXPLAIN 估计查询的代价，不执行查询
+
+        Returns:
+            (是否成功, {"cost": 估计代价, "rows": 估计扫描行数, "full_scans": 全表扫描的表} 或错误信息)，
+            SQLite 没有代价和行数估计，cost 和 rows 为 None；执行计划无法解析时带有 "error"；不支持的方言返回 (True, None)
+        """
+        prefix = COST_EXPLAIN_PREFIXES.get(self._dialect)
+        if prefix is None:
+            return True, None
+        sql_query = preprocess_sql_query(sql_query)
+        with self.read_connection() as connection:
+            try:
+                with self.statement_timeout(connection):
+                    plan_rows = [tuple(row) for row in connection.execute(text(prefix + sql_query)).fetchall()]
+            except Exception as e:
+                return False, str(getattr(e, 'orig', None) or e)
+        try:
+            return True, parse_plan(self._dialect, plan_rows)
+        except Exception as e:
+            # 执行计划格式与预期不符(例如数据库版本不同)，由 CostGuard 按 unknown_plan 配置处理
+            logger.warning(f"Failed to parse {self._dialect} plan ({e}): {str(plan_rows)[:500]}")
+            return True, {"cost": None, "rows": None, "full_scans": [], "error": f"{type(e).__name__}: {e}"}
+
+    async def aestimate_cost(self, sql_query: str) -> Tuple[bool, Any]:
+        """estimate_cost 的异步版本，在数据库线程池中执行"""
+        return await run_in_db_executor(self.estimate_cost, sql_query)
+
+    def explain(self, sql_query: str) -> Tuple[bool, Any]:
+        """
+        只让数据库生成执行计划而不执行查询，用于执行前校验SQL；不支持的方言视为通过
+
+        Returns:
+            (是否成功, 执行计划的行或错误信息)
+        """
+        prefix = EXPLAIN_PREFIXES.get(self._dialect)
+        if prefix is None:
+            return True, None
+        sql_query = preprocess_sql_query(sql_query)
+        with self.read_connection() as connection:
+            try:
+                return True, [tuple(row) for row in connection.execute(text(prefix + sql_query)).fetchall()]
+            except Exception as e:
+                return False, str(getattr(e, 'orig', None) or e)
+
+    async def aexplain(self, sql_query: str) -> Tuple[bool, Any]:
+        """explain 的异步版本，在数据库线程池中执行"""
+        return await run_in_db_executor(self.explain, sql_query)
+
+    def iter_batches(self, sql_query: str, batch_size: int = 500, max_str_len: int = 30,
+                     max_rows: Optional[int] = None) -> Iterator[Tuple[List[str], List[tuple]]]:
+        """
+        通过服务端游标(stream_results)分批读取查询结果，内存占用只与 batch_size 有关，
+        第一批结果的返回时间与结果总行数无关
+
+        第一批总会产出（结果为空时是空列表），调用方可以从中拿到字段名；生成器被关闭时释放游标和连接。
+        执行失败时直接抛出数据库异常。
+
+        Args:
+            sql_query: SQL
+            batch_size: 每批的行数
+            max_str_len: 字符串取值的最大长度，<=0 时不截断
+            max_rows: 最多读取的行数，None 或 <=0 表示读取全部结果，限制会以 LIMIT 的形式下推到数据库
+
+        Returns:
+            迭代器，每次产出 (字段名, 一批行)
+        """
+        sql_query = preprocess_sql_query(sql_query)
+        if max_rows and max_rows > 0:
+            sql_query = push_down_limit(sql_query, max_rows, self._dialect)
+        else:
+            max_rows = None
+
+        with self.read_connection() as connection:
+            cursor = connection.execution_options(stream_results=True).execute(text(sql_query))
+            try:
+                if not cursor.returns_rows:
+                    yield [], []
+                    return
+                fields = list(cursor.keys())
+                row_count = 0
+                while True:
+                    size = batch_size if max_rows is None else min(batch_size, max_rows - row_count)
+                    rows = cursor.fetchmany(size) if size > 0 else []
+                    if len(rows) > 0 or row_count == 0:
+                        yield fields, [
+                            tuple(self.truncate_word(column, length=max_str_len) for column in row)
+                            for row in rows
+                        ]
+                    row_count += len(rows)
+                    if len(rows) < size or size <= 0:
+                        break
+            finally:
+                cursor.close()
+
+    async def aiter_batches(self, sql_query: str, batch_size: int = 500, max_str_len: int = 30,
+                            max_rows: Optional[int] = None):
+        """iter_batches 的异步版本，每一批都在数据库线程池中读取，不阻塞事件循环"""
+        batches = self.iter_batches(sql_query, batch_size, max_str_len, max_rows)
+        try:
+            while True:
+                batch = await run_in_db_executor(next, batches, None)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            # 提前结束(出错、客户端断开)时也要关闭游标、归还连接
+            await run_in_db_executor(batches.close)
+
+    def rows_to_markdown(self, fields: List[str], rows: List[tuple], with_header: bool = True) -> str:
+        """
+        行转换成markdown表格，流式输出时后续批次不带表头
+        """
+        lines = []
+        if with_header:
+            lines.append("| " + " | ".join(fields) + " |")
+            lines.append("| " + " | ".join(["---"] * len(fields)) + " |")
+        for row in rows:
+            lines.append("| " + " | ".join(str(value) for value in row) + " |")
+        return "\n".join(lines)
+
     def trunc_result_to_markdown(self, sql_res: Dict) -> str:
         """
         数据库查询结果转换成markdown格式
@@ -179,22 +632,16 @@ class HITLSQLDatabase(SQLDatabase):
         if not isinstance(truncated_results, list):
             return str(truncated_results)
 
-        header = "| " + " | ".join(fields) + " |"
-        separator = "| " + " | ".join(["---"] * len(fields)) + " |"
-        rows = []
-        for row in truncated_results:
-            rows.append("| " + " | ".join(str(value) for value in row) + " |")
-        markdown_table = "\n".join([header, separator] + rows)
-        return markdown_table
+        return self.rows_to_markdown(fields, truncated_results)
     
 
     def execute(self, sql_query: str, timeout=5) -> Any:
-        # import concurrent.futures
         sql_query = preprocess_sql_query(sql_query)
 
         with self._engine.begin() as connection:
             try:
-                cursor = connection.execute(text(sql_query))
+                with self.statement_timeout(connection, timeout):
+                    cursor = connection.execute(text(sql_query))
                 return True
             except Exception as e:
                 info = str(e)
@@ -202,76 +649,178 @@ class HITLSQLDatabase(SQLDatabase):
                 return None
 
     def init_mschema(self):
-        for table_name in self._usable_tables:
-            table_comment = self.get_table_comment(table_name)
-            table_comment = '' if table_comment is None else table_comment.strip()
-            self._mschema.add_table(table_name, fields={}, comment=table_comment)
-            pks = self.get_pk_constraint(table_name)
-
-            fks = self.get_foreign_keys(table_name)
-            for fk in fks:
-                referred_schema = fk['referred_schema']
-                for c, r in zip(fk['constrained_columns'], fk['referred_columns']):
-                    self._mschema.add_foreign_key(table_name, c, referred_schema, fk['referred_table'], r)
-
-            fields = self._inspector.get_columns(table_name, schema=self._schema)
-            for field in fields:
-                field_type = f"{field['type']!s}"
+        # 按表名排序，保证每次构建出的 M-Schema 顺序一致
+        self._add_tables_to_mschema(sorted(self._usable_tables))
+
+    def _introspector(self) -> SchemaIntrospector:
+        return SchemaIntrospector(self._engine, self._schema, max_workers=self._introspect_workers)
+
+    def init_mschema_from_snapshot(self, snapshot_path: str):
+        """
+        从快照热启动：只读取一遍表结构元数据计算指纹，与快照中的指纹一致的表直接复用，
+        新增或结构变化的表才重新读取并采样示例值，最后把新的 M-Schema 写回快照
+        """
+        snapshot, fingerprints = load_snapshot(snapshot_path)
+        table_names = sorted(self._usable_tables)
+        tables = self._introspector().fetch_tables(table_names)
+        current = {table_name: table_fingerprint(table) for table_name, table in tables.items()}
+
+        if snapshot is None or snapshot.schema != self._schema:
+            changed = list(tables.keys())
+        else:
+            changed = [table_name for table_name in tables
+                       if not snapshot.has_table(table_name) or fingerprints.get(table_name) != current[table_name]]
+            for table_name in tables:
+                if table_name not in changed:
+                    self._mschema.tables[table_name] = snapshot.tables[table_name]
+            self._mschema.foreign_keys = [fk for fk in snapshot.foreign_keys
+                                          if fk[0] in tables and fk[0] not in changed]
+
+        self._add_tables_to_mschema(changed, {table_name: tables[table_name] for table_name in changed})
+        self._mschema.tables = {table_name: self._mschema.tables[table_name] for table_name in table_names
+                                if table_name in self._mschema.tables}
+        self._fingerprints = current
+        self._schema_version = None
+
+        if len(changed) > 0 or len(fingerprints) != len(current):
+            save_snapshot(snapshot_path, self._mschema, current)
+
+    def _current_table_names(self) -> List[str]:
+        """数据库中当前参与 M-Schema 的表，配置了 table_pattern 时能发现新增的表"""
+        if self._table_pattern is None:
+            return sorted(self._usable_tables)
+        pattern = re.compile(self._table_pattern)
+        all_tables = inspect(self._engine).get_table_names(schema=self._schema)
+        return sorted(table for table in all_tables if pattern.match(table))
+
+    def detect_changed_tables(self) -> Dict[str, List[str]]:
+        """
+        对比数据库当前的表结构指纹和 M-Schema 构建时的指纹
+
+        Returns:
+            {"added": [...], "changed": [...], "removed": [...]}
+        """
+        table_names = self._current_table_names()
+        tables = self._introspector().fetch_tables(table_names)
+        return self._diff_tables(tables)
+
+    def _diff_tables(self, tables: Dict[str, Dict]) -> Dict[str, List[str]]:
+        current = {table_name: table_fingerprint(table) for table_name, table in tables.items()}
+        return {
+            "added": [t for t in current if t not in self._mschema.tables],
+            "changed": [t for t in current if t in self._mschema.tables and self._fingerprints.get(t) != current[t]],
+            "removed": [t for t in self._mschema.tables if t not in current],
+        }
+
+    def refresh_tables(self, table_names: Optional[List[str]] = None) -> Dict[str, List[str]]:
+        """
+        增量刷新 M-Schema：只重新读取新增或结构变化的表，删除已不存在的表，其余表保持不变
+
+        Args:
+            table_names: 强制刷新的表，None 表示根据指纹自动检测变化的表
+
+        Returns:
+            {"added": [...], "changed": [...], "removed": [...]}
+        """
+        current_names = self._current_table_names()
+        introspector = self._introspector()
+        if table_names is None:
+            tables = introspector.fetch_tables(current_names)
+            diff = self._diff_tables(tables)
+        else:
+            table_names = [t for t in table_names if t in current_names or t in self._mschema.tables]
+            tables = introspector.fetch_tables([t for t in table_names if t in current_names])
+            diff = {
+                "added": [t for t in tables if t not in self._mschema.tables],
+                "changed": [t for t in tables if t in self._mschema.tables],
+                "removed": [t for t in table_names if t not in tables],
+            }
+        refreshed = diff["added"] + diff["changed"]
+        if len(refreshed) + len(diff["removed"]) == 0:
+            return diff
+
+        # 先在临时 M-Schema 中构建变化的表，再一次性替换，避免其它线程看到构建了一半的表
+        staging = MSchema(db_id=self._mschema.db_id, schema=self._mschema.schema)
+        self._add_tables_to_mschema(refreshed, {t: tables[t] for t in refreshed}, staging)
+
+        dropped = set(refreshed + diff["removed"])
+        old_tables = self._mschema.tables
+        new_tables = {}
+        for table_name in sorted(set(old_tables.keys()) | set(refreshed)):
+            if table_name in staging.tables:
+                new_tables[table_name] = staging.tables[table_name]
+            elif table_name not in dropped:
+                new_tables[table_name] = old_tables[table_name]
+        foreign_keys = [fk for fk in self._mschema.foreign_keys if fk[0] not in dropped] + staging.foreign_keys
+        self._mschema.replace_tables(new_tables, foreign_keys, dropped)
+
+        for table_name in refreshed:
+            self._fingerprints[table_name] = table_fingerprint(tables[table_name])
+        for table_name in diff["removed"]:
+            self._fingerprints.pop(table_name, None)
+        self._schema_version = None
+        self._usable_tables = set(new_tables.keys())
+        if self._snapshot_path is not None:
+            save_snapshot(self._snapshot_path, self._mschema, self._fingerprints)
+        return diff
+
+    def _add_tables_to_mschema(self, table_names: List[str], tables: Optional[Dict[str, Dict]] = None,
+                               mschema: Optional[MSchema] = None):
+        """
+        批量读取表结构并并行采样示例值，写入 M-Schema
+
+        Args:
+            table_names: 要写入的表
+            tables: 已经读取好的表结构元数据，None 时重新读取
+            mschema: 写入的目标，默认为当前的 M-Schema
+        """
+        if mschema is None:
+            mschema = self._mschema
+        introspector = self._introspector()
+        if tables is None:
+            tables = introspector.fetch_tables(table_names)
+            self._fingerprints.update({table_name: table_fingerprint(table) for table_name, table in tables.items()})
+            self._schema_version = None
+        samples = introspector.sample_values(
+            {table_name: [c['name'] for c in table['columns']] for table_name, table in tables.items()}, 5)
+
+        for table_name, table in tables.items():
+            mschema.add_table(table_name, fields={}, comment=table['comment'])
+            for c, referred_schema, referred_table, r in table['foreign_keys']:
+                mschema.add_foreign_key(table_name, c, referred_schema, referred_table, r)
+
+            for field in table['columns']:
                 field_name = field['name']
-                if field_name in pks:
-                    primary_key = True
-                else:
-                    primary_key = False
-
-                field_comment = field.get("comment", None)
-                field_comment = "" if field_comment is None else field_comment.strip()
-                autoincrement = field.get('autoincrement', False)
-                default = field.get('default', None)
+                default = field['default']
                 if default is not None:
                     default = f'{default}'
+                examples = examples_to_str(samples.get(table_name, {}).get(field_name, []))
 
-                try:
-                    examples = self.fectch_distinct_values(table_name, field_name, 5)
-                except:
-                    examples = []
-                examples = examples_to_str(examples)
-
-                self._mschema.add_field(table_name, field_name, field_type=field_type, primary_key=primary_key,
-                    nullable=field['nullable'], default=default, autoincrement=autoincrement,
-                    comment=field_comment, examples=examples)
-
-    def sync_to_local(self, local_engine: Engine):
-        """同步数据到本地数据库"""
-        from sqlalchemy.orm import sessionmaker
-
-        local_metadata = MetaData()
-
-        # # 连接到远程数据库
-        remote_metadata = MetaData()
-        remote_metadata.reflect(bind=self._engine)
-
-        remote_metadata.create_all(bind=self._engine)
-
-        print(remote_metadata.tables.keys())
-        # 同步表结构和数据
-        for table_name in remote_metadata.tables:
-            remote_table = Table(table_name, remote_metadata, autoload_with=self._engine)
-            print(f"Syncing table {table_name}...")
-
-            # 创建本地表
-            remote_table.metadata = local_metadata
-            local_metadata.drop_all(local_engine)
-            local_metadata.create_all(local_engine, tables=[remote_table])
-
-            # 将数据同步到本地
-            Session = sessionmaker(bind=self._engine)
-            session = Session()
-            with local_engine.begin() as local_connection:
-                data = session.query(remote_table).all()
-                columns = remote_table.columns.keys()
-                insert_data = [dict(zip(columns, d)) for d in data]
-                local_connection.execute(remote_table.insert(), insert_data)
-
-        print("Sync complete.")
+                mschema.add_field(table_name, field_name, field_type=field['type'],
+                    primary_key=field['primary_key'], nullable=field['nullable'], default=default,
+                    autoincrement=field['autoincrement'], comment=field['comment'], examples=examples)
+
+    def sync_to_local(self, local_engine: Engine, table_names: Optional[List[str]] = None, chunk_size: int = 5000,
+                      workers: int = 4, full: bool = False,
+                      updated_at_columns: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        把表同步到本地 SQLite，分批流式读取、批量写入，支持断点续传和增量同步，详见 LocalSync
+
+        Args:
+            local_engine: 本地 SQLite 数据库
+            table_names: 需要同步的表，默认为所有可用的表
+            chunk_size: 每批读取和写入的行数
+            workers: 并行读取的表数
+            full: 为 True 时忽略检查点，全部重建
+            updated_at_columns: {表名: 最后修改时间字段}，用于增量同步
+
+        Returns:
+            {表名: {"mode": 同步方式, "rows": 本次写入的行数, "status": done 或错误信息}}
+        """
+        if table_names is None:
+            table_names = sorted(self._usable_tables)
+        local_sync = LocalSync(self._engine, local_engine, schema=self._schema, chunk_size=chunk_size,
+                               workers=workers, updated_at_columns=updated_at_columns)
+        return local_sync.run(table_names, full=full)
 
 
@@ -1,37 +1,149 @@
 import re
 import os
+import asyncio
+import functools
+import threading
 import datetime, decimal
-from sqlalchemy import create_engine, MetaData, Table, Column, String, Integer, select, text
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import astuple
+from typing import Any, Callable, Dict, Optional, Tuple
+from sqlalchemy import create_engine, event, MetaData, Table, Column, String, Integer, select, text
 from sqlalchemy.engine import Engine
 from .db_config import DBConfig
 
 
 def init_db_conn(db_config: DBConfig) -> Engine:
+    pool_args = pool_kwargs(db_config)
     if db_config.dialect.lower() == 'sqlite':
         if db_config.db_path is None:
             raise ValueError("db_path cannot be None for SQLite connection")
-        return connect_to_sqlite(db_config.db_path)
+        return connect_to_sqlite(db_config.db_path, **pool_args)
     elif db_config.dialect.lower() == 'mysql':
-        return connect_to_mysql(db_config.db_name, db_config.user_name, db_config.db_pwd, db_config.db_host, db_config.port)
+        return connect_to_mysql(db_config.db_name, db_config.user_name, db_config.db_pwd, db_config.db_host, db_config.port, **pool_args)
     elif db_config.dialect.lower() == 'postgresql':
-        return connect_to_pg(db_config.db_name, db_config.user_name, db_config.db_pwd, db_config.db_host, db_config.port)
+        return connect_to_pg(db_config.db_name, db_config.user_name, db_config.db_pwd, db_config.db_host, db_config.port, **pool_args)
     else:
         raise NotImplementedError
 
 
-def connect_to_sqlite(db_path: str) -> Engine:
+def pool_kwargs(db_config: DBConfig) -> Dict:
+    return {
+        "pool_size": db_config.pool_size,
+        "max_overflow": db_config.max_overflow,
+        "pool_recycle": db_config.pool_recycle,
+        "pool_pre_ping": db_config.pool_pre_ping,
+    }
+
+
+_engine_cache: Dict[tuple, Engine] = {}
+_engine_cache_lock = threading.Lock()
+
+
+def get_shared_engine(db_config: DBConfig, read_only: bool = False) -> Engine:
+    """
+    按 DBConfig 缓存 Engine，同一个数据库在整个进程内共享一个连接池，
+    避免每次请求都重新建立 TCP 连接和认证
+
+    Args:
+        db_config: 数据库配置
+        read_only: 是否使用只读连接，同一个数据库的只读连接和普通连接是两个连接池
+    """
+    key = astuple(db_config) + (read_only,)
+    engine = _engine_cache.get(key)
+    if engine is None:
+        with _engine_cache_lock:
+            engine = _engine_cache.get(key)
+            if engine is None:
+                engine = init_db_conn(db_config)
+                if read_only:
+                    set_read_only(engine)
+                _engine_cache[key] = engine
+    return engine
+
+
+def set_read_only(engine: Engine):
+    """
+    把 engine 新建的连接都设为只读，误生成的写语句会被数据库拒绝
+
+    MySQL: SET SESSION TRANSACTION READ ONLY；PostgreSQL: set_session(readonly=True)；SQLite: PRAGMA query_only
+    """
+    dialect = engine.dialect.name
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        if dialect == 'postgresql':
+            dbapi_connection.set_session(readonly=True)
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            if dialect == 'mysql':
+                cursor.execute("SET SESSION TRANSACTION READ ONLY")
+            elif dialect == 'sqlite':
+                cursor.execute("PRAGMA query_only = ON")
+        finally:
+            cursor.close()
+
+
+def get_pool_status(engine: Engine) -> Dict:
+    """连接池统计信息"""
+    pool = engine.pool
+    status = {"pool_class": type(pool).__name__, "status": pool.status()}
+    # 只有 QueuePool 一类的连接池才有以下统计
+    for name in ["size", "checkedin", "checkedout", "overflow"]:
+        func = getattr(pool, name, None)
+        if callable(func):
+            status[name] = func()
+    return status
+
+
+def dispose_shared_engines():
+    with _engine_cache_lock:
+        for engine in _engine_cache.values():
+            engine.dispose()
+        _engine_cache.clear()
+
+
+_db_executor: Optional[ThreadPoolExecutor] = None
+_db_executor_workers = 16
+
+
+def configure_db_executor(max_workers: int):
+    """设置执行数据库阻塞调用的线程池大小，一般与连接池的 pool_size + max_overflow 一致"""
+    global _db_executor, _db_executor_workers
+    _db_executor_workers = max(1, max_workers)
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=False)
+        _db_executor = None
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    if _db_executor is None:
+        with _engine_cache_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(max_workers=_db_executor_workers, thread_name_prefix="db")
+    return _db_executor
+
+
+async def run_in_db_executor(func: Callable, *args, **kwargs) -> Any:
+    """在有界线程池中执行阻塞的数据库调用，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(func, *args, **kwargs))
+
+
+def connect_to_sqlite(db_path: str, **pool_args) -> Engine:
     assert os.path.exists(db_path)
-    db_engine = create_engine(f'sqlite:///{os.path.abspath(db_path)}')
+    db_engine = create_engine(f'sqlite:///{os.path.abspath(db_path)}', **pool_args)
     return db_engine
 
 
-def connect_to_mysql(db_name, user_name, db_pwd, db_host, port) -> Engine:
-    db_engine = create_engine(f"mysql+pymysql://{user_name}:{db_pwd}@{db_host}:{port}/{db_name}")
+def connect_to_mysql(db_name, user_name, db_pwd, db_host, port, **pool_args) -> Engine:
+    db_engine = create_engine(f"mysql+pymysql://{user_name}:{db_pwd}@{db_host}:{port}/{db_name}", **pool_args)
     return db_engine
 
 
-def connect_to_pg(db_name, user_name, db_pwd, db_host, port) -> Engine:
-    db_engine = create_engine(f"postgresql+psycopg2://{user_name}:{db_pwd}@{db_host}:{port}/{db_name}")
+def connect_to_pg(db_name, user_name, db_pwd, db_host, port, **pool_args) -> Engine:
+    db_engine = create_engine(f"postgresql+psycopg2://{user_name}:{db_pwd}@{db_host}:{port}/{db_name}", **pool_args)
     return db_engine
 
 
@@ -57,6 +169,116 @@ def preprocess_sql_query(sql_query: str) -> str:
     return sql_query
 
 
+# 单引号字符串、双引号/反引号标识符，规范化SQL时保持原样
+_QUOTED_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)")
+
+
+# 规范化SQL时转为小写的关键字；表名、字段名等标识符保持原样，MySQL 在 Linux 上表名区分大小写
+_KEYWORD_PATTERN = re.compile(
+    r'\b(select|distinct|from|where|and|or|not|in|is|null|like|between|exists|as|on|using|join|inner|left|right'
+    r'|full|outer|cross|natural|group|by|having|order|asc|desc|limit|offset|fetch|first|next|rows?|only|union|all'
+    r'|intersect|except|with|recursive|case|when|then|else|end|cast|over|partition|window|for|update|share'
+    r'|true|false|interval)\b',
+    re.IGNORECASE)
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    规范化SQL，用作缓存的键：删除注释和末尾分号，引号外的空白合并为一个空格，关键字转为小写
+    """
+    sql_query = remove_sql_comments(sql_query).rstrip().rstrip(';').rstrip()
+    parts = _QUOTED_PATTERN.split(sql_query)
+    # split 的结果中奇数位置是引号内的内容
+    for i in range(0, len(parts), 2):
+        parts[i] = _KEYWORD_PATTERN.sub(lambda m: m.group(0).lower(), re.sub(r'\s+', ' ', parts[i]))
+    return ''.join(parts).strip()
+
+
+def is_select_query(sql_query: str) -> bool:
+    """是否是只读的 SELECT/WITH 查询"""
+    return bool(_SELECT_PATTERN.match(remove_sql_comments(sql_query)))
+
+
+_SELECT_PATTERN = re.compile(r'^[\s(]*(select|with)\b', re.IGNORECASE)
+# 语句末尾的行锁子句，LIMIT 需要放在它前面
+_LOCK_CLAUSE_PATTERN = re.compile(r'\s+for\s+(update|share)(\s+\w+)*\s*$', re.IGNORECASE)
+# 语句末尾的行数限制：LIMIT n、LIMIT n OFFSET m、LIMIT m, n(MySQL)、OFFSET m LIMIT n、[OFFSET m ROWS] FETCH FIRST n ROWS ONLY，
+# 以及 PostgreSQL 的 LIMIT ALL(不限制行数)
+_ROW_LIMIT_PATTERN = re.compile(
+    r'\s+(limit\s+(?P<limit>\d+)(\s*,\s*(?P<count>\d+)|\s+offset\s+(?P<offset>\d+))?'
+    r'|(?P<limit_all>limit\s+all)(\s+offset\s+(?P<offset4>\d+))?'
+    r'|offset\s+(?P<offset2>\d+)\s+limit\s+(?P<limit2>\d+|all)'
+    r'|(offset\s+(?P<offset3>\d+)\s+rows?\s+)?fetch\s+(first|next)\s+(?P<fetch>\d*)\s*rows?\s+only)\s*$',
+    re.IGNORECASE)
+LIMIT_DIALECTS = ['mysql', 'postgresql', 'sqlite']
+
+
+def split_row_limit(sql_query: str) -> Tuple[str, Optional[int], int, str]:
+    """
+    拆出语句末尾的行数限制和行锁子句
+
+    Returns:
+        (去掉行数限制和行锁子句的语句, 行数限制(没有时为 None), 跳过的行数, 行锁子句)
+    """
+    lock = ''
+    match = _LOCK_CLAUSE_PATTERN.search(sql_query)
+    if match:
+        lock = match.group(0)
+        sql_query = sql_query[:match.start()]
+    match = _ROW_LIMIT_PATTERN.search(sql_query)
+    if not match:
+        return sql_query, None, 0, lock
+    groups = match.groupdict()
+    if groups['count'] is not None:
+        limit, offset = int(groups['count']), int(groups['limit'])
+    elif groups['limit'] is not None:
+        limit, offset = int(groups['limit']), int(groups['offset'] or 0)
+    elif groups['limit2'] is not None:
+        limit = None if groups['limit2'].lower() == 'all' else int(groups['limit2'])
+        offset = int(groups['offset2'])
+    elif groups['limit_all'] is not None:
+        # LIMIT ALL 等同于没有行数限制，只保留 OFFSET
+        limit, offset = None, int(groups['offset4'] or 0)
+    else:
+        # FETCH FIRST ROWS ONLY 省略行数时为 1 行
+        limit, offset = int(groups['fetch'] or 1), int(groups['offset3'] or 0)
+    return sql_query[:match.start()], limit, offset, lock
+
+
+def _with_row_limit(sql_query: str, limit: int, offset: int, lock: str) -> str:
+    offset_clause = f" OFFSET {int(offset)}" if offset > 0 else ''
+    return f"{sql_query} LIMIT {int(limit)}{offset_clause}{lock};"
+
+
+def push_down_limit(sql_query: str, limit: int, dialect: str) -> str:
+    """
+    给查询语句加上行数限制，让数据库只产生需要展示的行数
+
+    只处理 SELECT/WITH 语句；语句已经带有行数限制时取两者中较小的一个，方言不支持 LIMIT 时原样返回
+    """
+    sql_query = remove_sql_comments(sql_query).rstrip().rstrip(';').rstrip()
+    if dialect.lower() not in LIMIT_DIALECTS or not _SELECT_PATTERN.match(sql_query):
+        return sql_query + ';'
+    sql_query, row_limit, offset, lock = split_row_limit(sql_query)
+    if row_limit is not None:
+        limit = min(limit, row_limit)
+    return _with_row_limit(sql_query, limit, offset, lock)
+
+
+def paginate_sql(sql_query: str, limit: int, offset: int, dialect: str) -> str:
+    """
+    取查询结果中的一页，保留原有的 ORDER BY；语句末尾已有行数限制时把翻页范围合并进原来的 LIMIT/OFFSET，
+    不超出原来的限制，也不需要包一层子查询(连接查询中的重名字段在子查询中会报错)
+    """
+    sql_query = remove_sql_comments(sql_query).rstrip().rstrip(';').rstrip()
+    if dialect.lower() not in LIMIT_DIALECTS or not _SELECT_PATTERN.match(sql_query):
+        raise ValueError(f"Pagination is not supported for this query or dialect {dialect}")
+    sql_query, row_limit, row_offset, lock = split_row_limit(sql_query)
+    if row_limit is not None:
+        limit = max(min(limit, row_limit - offset), 0)
+    return _with_row_limit(sql_query, limit, row_offset + offset, lock)
+
+
 def is_email(string):
     pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
     match = re.match(pattern, string)
@@ -1,18 +1,129 @@
-from openai import OpenAI
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, OpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+
+# OpenAI 客户端的连接池、超时和重试配置，可通过 configure_llm_client 修改
+_client_options = {
+    "timeout": 120.0,  # 单次请求的读超时(秒)
+    "connect_timeout": 10.0,  # 建立连接的超时(秒)
+    "max_connections": 20,  # 连接池最大连接数
+    "max_keepalive_connections": 10,  # 保持长连接的最大个数
+    "keepalive_expiry": 60.0,  # 空闲长连接的保留时间(秒)
+    "max_retries": 2,  # 连接错误、429、5xx 时的重试次数
+}
+
+_clients: Dict[Tuple[str, str], OpenAI] = {}
+_http_client: Optional[httpx.Client] = None
+_async_clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+_async_http_client: Optional[httpx.AsyncClient] = None
+_clients_lock = threading.Lock()
+
+
+def configure_llm_client(**options):
+    """
+    修改 OpenAI 客户端配置，未知的配置项会被忽略；已创建的客户端会被关闭，之后按新配置重新创建
+    """
+    global _http_client, _async_http_client
+    with _clients_lock:
+        for name, value in options.items():
+            if name in _client_options and value is not None:
+                _client_options[name] = value
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        _clients.clear()
+        # 异步连接池只能在事件循环中关闭，这里只丢弃引用
+        _async_http_client = None
+        _async_clients.clear()
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(_client_options["timeout"], connect=_client_options["connect_timeout"])
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_client_options["max_connections"],
+        max_keepalive_connections=_client_options["max_keepalive_connections"],
+        keepalive_expiry=_client_options["keepalive_expiry"],
+    )
+
+
+def _shared_http_client() -> httpx.Client:
+    """所有 OpenAI 客户端共享的 httpx 连接池，复用 TCP/TLS 连接"""
+    global _http_client
+    if _http_client is None:
+        _http_client = DefaultHttpxClient(timeout=_timeout(), limits=_limits())
+    return _http_client
+
+
+def _shared_async_http_client() -> httpx.AsyncClient:
+    """所有 AsyncOpenAI 客户端共享的异步 httpx 连接池"""
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = DefaultAsyncHttpxClient(timeout=_timeout(), limits=_limits())
+    return _async_http_client
+
+
+def get_openai_client(base_url: str, key: str) -> OpenAI:
+    """按 (url, key) 缓存的 OpenAI 客户端"""
+    client = _clients.get((base_url, key))
+    if client is None:
+        with _clients_lock:
+            client = _clients.get((base_url, key))
+            if client is None:
+                client = OpenAI(
+                    api_key=key,
+                    base_url=base_url,
+                    timeout=_timeout(),
+                    max_retries=_client_options["max_retries"],
+                    http_client=_shared_http_client(),
+                )
+                _clients[(base_url, key)] = client
+    return client
+
+
+def get_async_openai_client(base_url: str, key: str) -> AsyncOpenAI:
+    """按 (url, key) 缓存的 AsyncOpenAI 客户端"""
+    client = _async_clients.get((base_url, key))
+    if client is None:
+        with _clients_lock:
+            client = _async_clients.get((base_url, key))
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=key,
+                    base_url=base_url,
+                    timeout=_timeout(),
+                    max_retries=_client_options["max_retries"],
+                    http_client=_shared_async_http_client(),
+                )
+                _async_clients[(base_url, key)] = client
+    return client
 
 
 def call_openai_sdk(**args):
     key = args.pop('key')      # 使用pop移除并获取key
     base_url = args.pop('url') # 使用pop移除并获取url
-    
-    client = OpenAI(
-        api_key=key,
-        base_url=base_url,
-    )
-    
+
+    client = get_openai_client(base_url, key)
+
     # 现在args中已经没有key和url参数了
     completion = client.chat.completions.create(
         **args
     )
     return completion
 
+
+async def acall_openai_sdk(**args):
+    """call_openai_sdk 的异步版本，等待模型返回期间不阻塞事件循环"""
+    key = args.pop('key')
+    base_url = args.pop('url')
+
+    client = get_async_openai_client(base_url, key)
+    completion = await client.chat.completions.create(
+        **args
+    )
+    return completion
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, and_, or_, select
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger("xiyan_mcp_server")
+
+SYNC_STATE_TABLE = '_xiyan_sync_state'
+# 没有配置时按这些字段名识别“最后修改时间”字段，用于增量同步
+UPDATED_AT_COLUMNS = ['updated_at', 'update_time', 'gmt_modified', 'modified_at', 'last_modified']
+
+_state_metadata = MetaData()
+_state_table = Table(
+    SYNC_STATE_TABLE, _state_metadata,
+    Column('table_name', String, primary_key=True),
+    Column('mode', String),
+    Column('status', String),
+    Column('schema_hash', String),
+    Column('last_key', Text),
+    Column('last_updated', Text),
+    Column('rows', Integer),
+    Column('synced_at', Float),
+)
+
+
+def _encode(value: Any) -> Optional[str]:
+    """检查点中的主键、时间取值用 JSON 保存，整数和字符串在恢复后保持原来的类型"""
+    return None if value is None else json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _decode(value: Optional[str]) -> Any:
+    return None if value is None else json.loads(value)
+
+
+class _TablePlan:
+    """一张表的同步计划：同步方式、远程查询和写入本地的语句"""
+
+    def __init__(self, name: str, mode: str, query, local_table: Table, primary_key: Optional[str],
+                 updated_column: Optional[str], state: Dict[str, Any]):
+        self.name = name
+        self.mode = mode
+        self.query = query
+        self.local_table = local_table
+        self.columns = [c.name for c in local_table.columns]
+        self.primary_key = primary_key
+        self.updated_column = updated_column
+        self.state = state
+        # 有主键时用 INSERT OR REPLACE，增量同步和断点续传重复读到的行会覆盖旧行
+        insert = local_table.insert()
+        self.insert = insert.prefix_with('OR REPLACE') if primary_key is not None else insert
+        self.rows = 0
+        # 本次同步读到的最大 (修改时间, 主键)，保持数据库返回的原始类型以便比较
+        self.watermark: Optional[tuple] = None
+        self.error: Optional[Exception] = None
+
+
+class LocalSync:
+    """
+    把远程数据库的表同步到本地 SQLite
+
+    每张表一个读线程，通过服务端游标分批读取，放入有界队列；调用线程是唯一的写入者，每批一个事务，
+    用 executemany 批量写入，并在同一个事务中更新 _xiyan_sync_state 中的检查点。内存占用只与
+    chunk_size 和队列长度有关，中断后重新运行会从检查点继续。
+
+    同步方式：
+        full: 首次同步、表结构变化或没有单字段主键时重建本地表并全量读取(有主键时按主键顺序读取，可以断点续传)
+        updated_at: 有“最后修改时间”字段时，按 (修改时间, 主键) 水位只读取上次同步之后修改的行并覆盖本地的旧行
+        append: 只有主键时，只读取主键大于上次同步的新行
+    """
+
+    def __init__(self, remote_engine: Engine, local_engine: Engine, schema: Optional[str] = None,
+                 chunk_size: int = 5000, workers: int = 4, updated_at_columns: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            remote_engine: 远程数据库
+            local_engine: 本地 SQLite 数据库
+            schema: 远程数据库的 schema
+            chunk_size: 每批读取和写入的行数
+            workers: 并行读取的表数
+            updated_at_columns: {表名: 最后修改时间字段}，没有配置的表按 UPDATED_AT_COLUMNS 识别
+        """
+        if local_engine.dialect.name != 'sqlite':
+            raise ValueError("Local replica must be a SQLite database")
+        self.remote_engine = remote_engine
+        self.local_engine = local_engine
+        self.schema = schema
+        self.chunk_size = max(1, chunk_size)
+        self.workers = max(1, workers)
+        self.updated_at_columns = updated_at_columns or {}
+
+    def _local_table(self, remote_table: Table, metadata: MetaData) -> Table:
+        """按远程表的字段建本地表，类型转换为通用类型(as_generic)，只保留主键，不复制索引和外键"""
+        columns = []
+        for column in remote_table.columns:
+            try:
+                column_type = column.type.as_generic()
+                column_type.compile(dialect=self.local_engine.dialect)
+            except Exception:
+                # 没有对应通用类型的方言专有类型(例如数组)，按文本保存
+                column_type = Text()
+            columns.append(Column(column.name, column_type, primary_key=column.primary_key,
+                                  nullable=column.nullable, autoincrement=False))
+        return Table(remote_table.name, metadata, *columns)
+
+    def _updated_column(self, table: Table) -> Optional[str]:
+        configured = self.updated_at_columns.get(table.name)
+        if configured is not None:
+            return configured if configured in table.c else None
+        names = {c.name.lower(): c.name for c in table.columns}
+        return next((names[n] for n in UPDATED_AT_COLUMNS if n in names), None)
+
+    def _plan(self, connection: Connection, table_name: str, states: Dict[str, Dict], full: bool) -> _TablePlan:
+        remote_table = Table(table_name, MetaData(), autoload_with=self.remote_engine, schema=self.schema)
+        local_table = self._local_table(remote_table, MetaData())
+        schema_hash = hashlib.md5(json.dumps(
+            [(c.name, str(c.type.compile(dialect=self.local_engine.dialect))) for c in local_table.columns]
+        ).encode('utf-8')).hexdigest()
+        primary_keys = [c.name for c in remote_table.primary_key.columns]
+        primary_key = primary_keys[0] if len(primary_keys) == 1 else None
+        updated_column = self._updated_column(remote_table) if primary_key is not None else None
+
+        state = states.get(table_name)
+        query = select(remote_table)
+        if full or state is None or state['schema_hash'] != schema_hash or primary_key is None:
+            mode = 'full'
+            local_table.drop(connection, checkfirst=True)
+            local_table.create(connection)
+            state = {"table_name": table_name, "schema_hash": schema_hash, "last_key": None,
+                     "last_updated": None, "rows": 0}
+        elif state['status'] != 'done' and state['mode'] == 'full':
+            # 上次全量同步中断，从最后写入的主键继续
+            mode = 'full'
+        elif updated_column is not None and state['last_updated'] is not None:
+            mode = 'updated_at'
+        else:
+            mode = 'append'
+
+        if mode == 'updated_at':
+            # 水位是 (修改时间, 主键)：修改时间相同的行按主键区分，既不会漏读也不会重复读取
+            updated, key = remote_table.c[updated_column], remote_table.c[primary_key]
+            last_updated, last_key = self._watermark(state)
+            if last_key is None:
+                condition = updated >= last_updated
+            else:
+                condition = or_(updated > last_updated, and_(updated == last_updated, key > last_key))
+            query = query.where(condition).order_by(updated, key)
+        elif primary_key is not None:
+            if state['last_key'] is not None:
+                query = query.where(remote_table.c[primary_key] > _decode(state['last_key']))
+            query = query.order_by(remote_table.c[primary_key])
+
+        state = {**state, "mode": mode, "status": "running", "rows": 0}
+        self._save_state(connection, state)
+        return _TablePlan(table_name, mode, query, local_table, primary_key, updated_column, state)
+
+    @staticmethod
+    def _watermark(state: Dict[str, Any]) -> tuple:
+        """检查点中的 (修改时间, 主键) 水位，早期只保存了修改时间的检查点主键为 None"""
+        value = _decode(state['last_updated'])
+        return tuple(value) if isinstance(value, list) else (value, None)
+
+    @staticmethod
+    def _save_state(connection: Connection, state: Dict[str, Any]):
+        state = {**state, "synced_at": time.time()}
+        connection.execute(_state_table.insert().prefix_with('OR REPLACE'),
+                           [{c.name: state.get(c.name) for c in _state_table.columns}])
+
+    @staticmethod
+    def _put(out: queue.Queue, item: tuple, stop: threading.Event):
+        """队列满时等待写入者，写入者退出(stop)后放弃，避免读线程永远阻塞在 put 上"""
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _read(self, plan: _TablePlan, out: queue.Queue, stop: threading.Event):
+        """读线程：通过服务端游标分批读取，每批放入队列，队列满时等待写入者"""
+        try:
+            with self.remote_engine.connect() as connection:
+                result = connection.execution_options(stream_results=True).execute(plan.query)
+                for rows in result.partitions(self.chunk_size):
+                    if plan.error is not None or stop.is_set():
+                        break
+                    self._put(out, (plan, [tuple(row) for row in rows]), stop)
+        except Exception as e:
+            plan.error = e
+        finally:
+            self._put(out, (plan, None), stop)
+
+    def _write(self, connection: Connection, plan: _TablePlan, rows: List[tuple]):
+        """写入一批行并在同一个事务中更新检查点"""
+        state = plan.state
+        with connection.begin():
+            connection.execute(plan.insert, [dict(zip(plan.columns, row)) for row in rows])
+            key_index = plan.columns.index(plan.primary_key) if plan.primary_key is not None else None
+            if key_index is not None and plan.mode != 'updated_at':
+                state['last_key'] = _encode(rows[-1][key_index])
+            if plan.updated_column is not None:
+                index = plan.columns.index(plan.updated_column)
+                marks = [(row[index], row[key_index]) for row in rows if row[index] is not None]
+                if len(marks) > 0 and (plan.watermark is None or max(marks) > plan.watermark):
+                    plan.watermark = max(marks)
+                    state['last_updated'] = _encode(list(plan.watermark))
+            # rows 记录本次同步写入的行数，不跨次累加
+            state['rows'] = plan.rows + len(rows)
+            self._save_state(connection, state)
+        plan.rows += len(rows)
+
+    def run(self, table_names: Iterable[str], full: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        同步表
+
+        Args:
+            table_names: 需要同步的表
+            full: 为 True 时忽略检查点，全部重建
+
+        Returns:
+            {表名: {"mode": 同步方式, "rows": 本次写入的行数, "status": done 或错误信息}}
+        """
+        table_names = list(table_names)
+        with self.local_engine.connect() as connection:
+            # WAL 允许同步期间读取本地库；同步期间关闭 fsync，检查点保证中断后可以重新同步
+            connection.exec_driver_sql("PRAGMA journal_mode = WAL")
+            connection.exec_driver_sql("PRAGMA synchronous = OFF")
+            connection.commit()
+            try:
+                with connection.begin():
+                    _state_metadata.create_all(connection)
+                    states = {row.table_name: row._asdict()
+                              for row in connection.execute(select(_state_table)).fetchall()}
+                    plans = [self._plan(connection, name, states, full) for name in table_names]
+
+                out: queue.Queue = queue.Queue(maxsize=self.workers * 2)
+                stop = threading.Event()
+                pending = len(plans)
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sync") as executor:
+                    for plan in plans:
+                        executor.submit(self._read, plan, out, stop)
+                    try:
+                        while pending > 0:
+                            plan, rows = out.get()
+                            if rows is None:
+                                pending -= 1
+                                self._finish(connection, plan)
+                            elif plan.error is None and len(rows) > 0:
+                                try:
+                                    self._write(connection, plan, rows)
+                                except Exception as e:
+                                    # 读线程看到 error 后停止读取，剩余的批次直接丢弃
+                                    plan.error = e
+                    finally:
+                        # 写入者异常退出(包括 KeyboardInterrupt)时通知读线程停止，并清空队列唤醒阻塞在 put 上的
+                        # 读线程，否则退出 with 时 executor 会一直等待它们
+                        stop.set()
+                        while True:
+                            try:
+                                out.get_nowait()
+                            except queue.Empty:
+                                break
+            finally:
+                connection.exec_driver_sql("PRAGMA synchronous = NORMAL")
+                connection.commit()
+
+        return {plan.name: {"mode": plan.mode, "rows": plan.rows,
+                            "status": "done" if plan.error is None else str(plan.error)} for plan in plans}
+
+    def _finish(self, connection: Connection, plan: _TablePlan):
+        if plan.error is not None:
+            logger.warning(f"Failed to sync table {plan.name}: {plan.error}")
+            return
+        with connection.begin():
+            self._save_state(connection, {**plan.state, "status": "done"})
+        logger.info(f"Synced table {plan.name} ({plan.mode}): {plan.rows} rows")
@@ -0,0 +1,191 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+# 各方言输出可解析执行计划的 EXPLAIN 写法
+COST_EXPLAIN_PREFIXES = {
+    'mysql': 'EXPLAIN FORMAT=JSON ',
+    'postgresql': 'EXPLAIN (FORMAT JSON) ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+# 数据库因语句超时而中断查询时的报错
+_TIMEOUT_PATTERN = re.compile(r'maximum statement execution time exceeded|statement timeout|\binterrupted\b',
+                              re.IGNORECASE)
+
+
+def is_timeout_error(error_info: str) -> bool:
+    return bool(_TIMEOUT_PATTERN.search(str(error_info)))
+
+
+def _walk(node: Any):
+    """深度优先遍历 JSON 执行计划中的所有 dict"""
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def _parse_mysql_json_v1(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    FORMAT=JSON 1.0(explain_json_format_version=1，MySQL 8.2 及以前只有这一种)
+
+    cost 为 query_block.cost_info.query_cost，rows 为各表 rows_examined_per_scan 之和
+    """
+    cost = plan['query_block'].get('cost_info', {}).get('query_cost')
+    if cost is None and 'message' in plan['query_block']:
+        # 优化器已经确定没有结果(例如 Impossible WHERE)，不访问任何表
+        cost = 0
+    rows, full_scans = 0, []
+    for node in _walk(plan):
+        if 'table_name' in node and 'rows_examined_per_scan' in node:
+            rows += int(node['rows_examined_per_scan'])
+            if node.get('access_type') == 'ALL':
+                full_scans.append(node['table_name'])
+    return {"cost": float(cost) if cost is not None else None, "rows": rows, "full_scans": full_scans}
+
+
+def _parse_mysql_json_v2(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    FORMAT=JSON 2.0(MySQL 8.3+ explain_json_format_version=2)，与 TREE 格式结构相同的迭代器树
+
+    cost 为根节点的 estimated_total_cost，rows 为读取表的叶子节点 estimated_rows 之和
+    """
+    root = plan.get('query_plan', plan)
+    cost = root.get('estimated_total_cost')
+    if cost is None and str(root.get('operation', '')).startswith('Zero rows'):
+        cost = 0
+    rows, full_scans = 0, []
+    for node in _walk(root):
+        if 'table_name' in node and 'estimated_rows' in node and not node.get('inputs'):
+            rows += int(float(node['estimated_rows']))
+            if node.get('access_type') == 'table':
+                full_scans.append(node['table_name'])
+    return {"cost": float(cost) if cost is not None else None, "rows": rows, "full_scans": full_scans}
+
+
+_TREE_COST_PATTERN = re.compile(r'\(cost=([\d.e+]+)(?:\.\.[\d.e+]+)? rows=([\d.e+]+)\)')
+_TREE_SCAN_PATTERN = re.compile(r'->\s*(Table scan|Index scan|Index range scan|Index lookup|Single-row index lookup|'
+                                r'Covering index \w+(?: \w+)*) on (\S+)')
+
+
+def _parse_mysql_tree(plan_text: str) -> Dict[str, Any]:
+    """
+    FORMAT=TREE(explain_format=TREE 时 EXPLAIN 也会输出这种格式)
+
+    cost 为第一行(根节点)的 cost，rows 为读取表的行 rows 之和
+    """
+    lines = plan_text.splitlines()
+    root = _TREE_COST_PATTERN.search(lines[0]) if lines else None
+    if root is None:
+        raise ValueError("no cost in plan")
+    rows, full_scans = 0, []
+    for line in lines:
+        scan = _TREE_SCAN_PATTERN.search(line)
+        estimate = _TREE_COST_PATTERN.search(line)
+        if scan is None or estimate is None:
+            continue
+        rows += int(float(estimate.group(2)))
+        if scan.group(1) == 'Table scan':
+            full_scans.append(scan.group(2))
+    return {"cost": float(root.group(1)), "rows": rows, "full_scans": full_scans}
+
+
+def parse_mysql_plan(plan_text: str) -> Dict[str, Any]:
+    """
+    解析 MySQL 的执行计划，支持 FORMAT=JSON 的 1.0、2.0 两个版本和 TREE 格式；
+    无法识别时抛出 ValueError，不把解析不了的计划当作代价为 0
+    """
+    try:
+        plan = json.loads(plan_text)
+    except ValueError:
+        return _parse_mysql_tree(plan_text)
+    if 'query_block' in plan:
+        estimate = _parse_mysql_json_v1(plan)
+    else:
+        estimate = _parse_mysql_json_v2(plan)
+    if estimate['cost'] is None:
+        raise ValueError("no cost in plan")
+    return estimate
+
+
+def parse_pg_plan(plan_json: Any) -> Dict[str, Any]:
+    """
+    解析 PostgreSQL 的 EXPLAIN (FORMAT JSON)
+
+    cost 为根节点的 Total Cost，rows 为所有节点中最大的 Plan Rows(连接结果膨胀时能反映出来)
+    """
+    plan = json.loads(plan_json) if isinstance(plan_json, str) else plan_json
+    root = plan[0]['Plan']
+    rows, full_scans = 0, []
+    for node in _walk(root):
+        if 'Node Type' not in node:
+            continue
+        rows = max(rows, int(node.get('Plan Rows', 0)))
+        if node['Node Type'] == 'Seq Scan':
+            full_scans.append(node.get('Relation Name'))
+    return {"cost": float(root.get('Total Cost', 0)), "rows": rows, "full_scans": full_scans}
+
+
+def parse_sqlite_plan(plan_rows: List[tuple]) -> Dict[str, Any]:
+    """
+    解析 SQLite 的 EXPLAIN QUERY PLAN，SQLite 不提供代价和行数估计，只能得到全表扫描的表
+    """
+    full_scans = []
+    for row in plan_rows:
+        match = re.match(r'SCAN (?:TABLE )?(\S+)', str(row[-1]))
+        if match and 'USING' not in str(row[-1]):
+            full_scans.append(match.group(1))
+    return {"cost": None, "rows": None, "full_scans": full_scans}
+
+
+def parse_plan(dialect: str, plan_rows: List[tuple]) -> Dict[str, Any]:
+    if dialect == 'mysql':
+        return parse_mysql_plan(plan_rows[0][0])
+    if dialect == 'postgresql':
+        return parse_pg_plan(plan_rows[0][0])
+    return parse_sqlite_plan(plan_rows)
+
+
+class CostGuard:
+    """
+    按 EXPLAIN 的估计拦截代价过高的SQL
+
+    MySQL 和 PostgreSQL 按估计代价和扫描行数判断；SQLite 没有估计值，只能依靠语句超时。
+    """
+
+    def __init__(self, max_cost: Optional[float] = None, max_rows: Optional[int] = None, action: str = 'rewrite',
+                 unknown_plan: str = 'block'):
+        """
+        Args:
+            max_cost: 估计代价的上限，None 或 <=0 表示不限制
+            max_rows: 估计扫描行数的上限，None 或 <=0 表示不限制
+            action: 超过上限时的处理，reject: 直接拒绝；rewrite: 让模型改写为代价更低的SQL
+            unknown_plan: 执行计划无法解析时的处理，block: 视为超过上限，按 action 处理；allow: 放行
+        """
+        self.max_cost = max_cost if max_cost and max_cost > 0 else None
+        self.max_rows = max_rows if max_rows and max_rows > 0 else None
+        self.action = action
+        self.unknown_plan = unknown_plan
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_cost is not None or self.max_rows is not None
+
+    def check(self, estimate: Dict[str, Any]) -> Optional[str]:
+        """超过上限时返回原因，否则返回 None"""
+        if estimate.get('error') is not None:
+            return f"无法解析执行计划，不能估计代价({estimate['error']})" if self.unknown_plan == 'block' else None
+        reasons = []
+        if self.max_cost is not None and estimate.get('cost') is not None and estimate['cost'] > self.max_cost:
+            reasons.append(f"估计代价 {estimate['cost']:.0f} 超过上限 {self.max_cost:.0f}")
+        if self.max_rows is not None and estimate.get('rows') is not None and estimate['rows'] > self.max_rows:
+            reasons.append(f"估计扫描 {estimate['rows']} 行，超过上限 {self.max_rows} 行")
+        if len(reasons) == 0:
+            return None
+        if estimate.get('full_scans'):
+            reasons.append(f"全表扫描的表: {', '.join(str(t) for t in estimate['full_scans'])}")
+        return "，".join(reasons)
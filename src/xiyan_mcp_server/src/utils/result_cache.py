@@ -0,0 +1,131 @@
+import hashlib
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .db_util import normalize_sql
+
+
+def estimate_size(value: Any) -> int:
+    """粗略估计查询结果占用的内存字节数，只展开结果中常见的 list/tuple/dict"""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return size
+
+
+class ResultCache:
+    """
+    查询结果缓存
+
+    以 (数据库标识, schema 版本, 规范化后的SQL, 取数参数) 为键，按结果占用的字节数做 LRU 淘汰；
+    每条结果的有效期取它引用的表中最短的 TTL，表结构变化时可以按表失效。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, default_ttl: Optional[float] = 300,
+                 table_ttls: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            max_bytes: 缓存结果的总大小上限(字节)
+            default_ttl: 默认有效期(秒)，None 或 <=0 表示不过期
+            table_ttls: 单独设置有效期的表，{表名: 秒}，<=0 表示引用该表的查询不缓存
+        """
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl if default_ttl and default_ttl > 0 else None
+        self.table_ttls = {name.lower(): ttl for name, ttl in (table_ttls or {}).items()}
+        # key -> (结果, 大小, 过期时间, 引用的表)
+        self._entries: OrderedDict[str, Tuple[Any, int, Optional[float], Tuple[str, ...]]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_key(db_id: str, schema_version: str, sql_query: str, *params) -> str:
+        raw = '\x1f'.join([db_id, schema_version, normalize_sql(sql_query)] + [repr(p) for p in params])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _ttl(self, tables: Iterable[str]) -> Optional[float]:
+        ttls = [self.table_ttls[t] for t in tables if t in self.table_ttls]
+        if self.default_ttl is not None:
+            ttls.append(self.default_ttl)
+        return min(ttls) if len(ttls) > 0 else None
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry[2] is not None and entry[2] <= time.time():
+                self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: Any, tables: Iterable[str] = ()):
+        """
+        缓存查询结果
+
+        Args:
+            key: make_key 生成的键
+            value: 查询结果
+            tables: 查询引用的表，用于确定有效期和按表失效
+        """
+        tables = tuple(sorted(set(t.lower() for t in tables)))
+        ttl = self._ttl(tables)
+        if ttl is not None and ttl <= 0:
+            return
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        expires_at = None if ttl is None else time.time() + ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at, tables)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[1]
+
+    def invalidate_tables(self, tables: Iterable[str]):
+        """失效所有引用了这些表的结果"""
+        tables = set(t.lower() for t in tables)
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if tables.intersection(entry[3])]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total > 0 else None,
+            }
+
+
+def referenced_tables(sql_query: str, table_names: Iterable[str]) -> List[str]:
+    """SQL 中出现的已知表名，用于确定缓存的有效期和失效范围"""
+    sql_query = normalize_sql(sql_query)
+    return [name for name in table_names
+            if re.search(r'(?<![\w$])' + re.escape(name) + r'(?![\w$])', sql_query, re.IGNORECASE)]
@@ -0,0 +1,122 @@
+import base64
+import csv
+import datetime
+import decimal
+import io
+import json
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+try:
+    import pyarrow as pa
+except ImportError:  # 未安装 pyarrow 时不支持 arrow 格式
+    pa = None
+
+FORMATS = ['markdown', 'csv', 'jsonl', 'arrow']
+MIME_TYPES = {
+    'markdown': 'text/markdown',
+    'csv': 'text/csv',
+    'jsonl': 'application/jsonl',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+def check_format(output_format: str) -> str:
+    """校验输出格式，返回小写的格式名，不支持时抛出 ValueError"""
+    output_format = (output_format or 'markdown').lower()
+    if output_format not in FORMATS:
+        raise ValueError(f"不支持的输出格式 {output_format}，可选: {', '.join(FORMATS)}")
+    if output_format == 'arrow' and pa is None:
+        raise ValueError("arrow 格式需要安装 pyarrow")
+    return output_format
+
+
+def _json_converter(column: Sequence[Any]) -> Optional[Callable[[Any], Any]]:
+    """按字段中第一个非空值的类型选择转换函数，整列只判断一次类型；JSON 原生类型返回 None"""
+    sample = next((v for v in column if v is not None), None)
+    if isinstance(sample, decimal.Decimal):
+        return float
+    if isinstance(sample, (datetime.date, datetime.time)):
+        return lambda v: v.isoformat()
+    if isinstance(sample, datetime.timedelta):
+        return lambda v: v.total_seconds()
+    if isinstance(sample, (bytes, bytearray, memoryview)):
+        return lambda v: base64.b64encode(bytes(v)).decode('ascii')
+    return None
+
+
+def _columns(fields: List[str], rows: List[tuple]) -> List[Sequence[Any]]:
+    """行转列，没有行时每列为空"""
+    return list(zip(*rows)) if len(rows) > 0 else [()] * len(fields)
+
+
+def to_csv(fields: List[str], rows: List[tuple]) -> str:
+    """CSV，包含逗号、引号或换行的取值按 CSV 规则加引号，NULL 输出为空"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(fields)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def to_jsonl(fields: List[str], rows: List[tuple]) -> str:
+    """JSON Lines，每行一个对象；Decimal 转为数字，日期时间转为 ISO 格式字符串"""
+    columns = _columns(fields, rows)
+    for i, column in enumerate(columns):
+        converter = _json_converter(column)
+        if converter is not None:
+            columns[i] = [None if v is None else converter(v) for v in column]
+    return ''.join(json.dumps(dict(zip(fields, row)), ensure_ascii=False, default=str) + '\n'
+                   for row in zip(*columns))
+
+
+def _arrow_array(column: Sequence[Any]) -> 'pa.Array':
+    try:
+        return pa.array(column)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # 同一列中混合了多种类型(例如 SQLite 的动态类型)，转为字符串
+        return pa.array([None if v is None else str(v) for v in column], type=pa.string())
+
+
+def arrow_table(fields: List[str], rows: List[tuple], metadata: Optional[Dict[str, str]] = None) -> 'pa.Table':
+    """逐列构造 Arrow 表，类型由 pyarrow 从取值推断"""
+    if pa is None:
+        raise ValueError("arrow 格式需要安装 pyarrow")
+    # 重名字段(例如连接查询中的 id)在 Arrow 中也是允许的，按位置构造
+    return pa.Table.from_arrays([_arrow_array(column) for column in _columns(fields, rows)], names=fields,
+                                metadata=metadata)
+
+
+def to_arrow(fields: List[str], rows: List[tuple], metadata: Optional[Dict[str, str]] = None) -> bytes:
+    """
+    Arrow IPC 流格式
+
+    Args:
+        fields: 字段名
+        rows: 行
+        metadata: 写入 schema 的元数据，例如下一页的位置
+    """
+    table = arrow_table(fields, rows, metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def format_rows(fields: List[str], rows: List[tuple], output_format: str,
+                metadata: Optional[Dict[str, str]] = None) -> Any:
+    """
+    把查询结果转换为 csv、jsonl(返回 str)或 arrow(返回 bytes)，markdown 由 HITLSQLDatabase 生成
+
+    Args:
+        fields: 字段名
+        rows: 行
+        output_format: csv、jsonl 或 arrow
+        metadata: 只用于 arrow 格式的 schema 元数据
+    """
+    if output_format == 'csv':
+        return to_csv(fields, rows)
+    if output_format == 'jsonl':
+        return to_jsonl(fields, rows)
+    if output_format == 'arrow':
+        return to_arrow(fields, rows, metadata)
+    raise ValueError(f"不支持的输出格式 {output_format}")
@@ -0,0 +1,343 @@
+import csv
+import datetime
+import decimal
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .result_format import arrow_table
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 未安装 pyarrow 时只能保存为 CSV
+    pa = None
+    pq = None
+
+logger = logging.getLogger("xiyan_mcp_server")
+
+STORE_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv'}
+_RESULT_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _unique_names(fields: List[str]) -> List[str]:
+    """重名字段(例如连接查询中的 id)加序号，Parquet 不允许重名字段"""
+    seen: Dict[str, int] = {}
+    names = []
+    for field in fields:
+        count = seen.get(field, 0)
+        seen[field] = count + 1
+        names.append(field if count == 0 else f"{field}_{count}")
+    return names
+
+
+# CSV 中记录的取值类型 -> 读取时的转换函数，没有记录的类型按字符串返回
+_CSV_TYPES = [
+    ('bool', bool, lambda v: v == 'True'),
+    ('int', int, int),
+    ('float', float, float),
+    ('decimal', decimal.Decimal, decimal.Decimal),
+    ('datetime', datetime.datetime, datetime.datetime.fromisoformat),
+    ('date', datetime.date, datetime.date.fromisoformat),
+    ('time', datetime.time, datetime.time.fromisoformat),
+]
+_CSV_CONVERTERS: Dict[str, Callable[[str], Any]] = {name: convert for name, _, convert in _CSV_TYPES}
+# 同一字段中混合了两种数值类型时按较宽的类型读取
+_CSV_WIDEN = {frozenset(['int', 'float']): 'float', frozenset(['int', 'decimal']): 'decimal',
+              frozenset(['float', 'decimal']): 'float'}
+
+
+def _csv_type(value: Any) -> str:
+    # bool 是 int 的子类，datetime 是 date 的子类，按 _CSV_TYPES 的顺序判断
+    return next((name for name, python_type, _ in _CSV_TYPES if isinstance(value, python_type)), 'str')
+
+
+class _CsvWriter:
+    """CSV 文件，同时记录每个字段的取值类型(写入元数据)，读取时据此恢复数字、日期等类型"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._header = False
+        # 每个字段的取值类型，None 表示目前只出现过 NULL
+        self.types: List[Optional[str]] = []
+
+    def write(self, fields: List[str], rows: List[tuple]):
+        if not self._header:
+            self._writer.writerow(fields)
+            self._header = True
+            self.types = [None] * len(fields)
+        for i, column in enumerate(zip(*rows)):
+            for value in column:
+                if value is None or self.types[i] == 'str':
+                    continue
+                value_type = _csv_type(value)
+                if self.types[i] is None:
+                    self.types[i] = value_type
+                elif self.types[i] != value_type:
+                    self.types[i] = _CSV_WIDEN.get(frozenset([self.types[i], value_type]), 'str')
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class _ArrowWriter:
+    """Parquet 或 Arrow IPC 文件，第一批的类型决定整个文件的 schema，每批写成一个 row group/record batch"""
+
+    def __init__(self, path: str, file_format: str, compression: Optional[str]):
+        self._path = path
+        self._format = file_format
+        self._compression = compression
+        self._schema = None
+        self._writer = None
+        # 每个 record batch 的行数，读取时不需要解压前面的 batch 就能定位
+        self.chunks: List[int] = []
+
+    def _table(self, fields: List[str], rows: List[tuple]) -> 'pa.Table':
+        if self._schema is None:
+            table = arrow_table(fields, rows)
+            # 第一批中全为 NULL 的字段无法推断类型，按字符串处理
+            self._schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                                      for f in table.schema])
+            return table.cast(self._schema)
+        arrays = []
+        columns = list(zip(*rows)) if len(rows) > 0 else [()] * len(fields)
+        for field, column in zip(self._schema, columns):
+            try:
+                arrays.append(pa.array(column, type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                if not pa.types.is_string(field.type):
+                    raise ValueError(f"字段 {field.name} 的取值类型与前面的行不一致")
+                arrays.append(pa.array([None if v is None else str(v) for v in column], type=pa.string()))
+        return pa.Table.from_arrays(arrays, schema=self._schema)
+
+    def write(self, fields: List[str], rows: List[tuple]):
+        table = self._table(fields, rows)
+        if self._writer is None:
+            if self._format == 'parquet':
+                self._writer = pq.ParquetWriter(self._path, self._schema, compression=self._compression or 'none')
+            else:
+                options = pa.ipc.IpcWriteOptions(compression=self._compression)
+                self._writer = pa.ipc.new_file(self._path, self._schema, options=options)
+        if table.num_rows > 0:
+            self._writer.write_table(table)
+            self.chunks.append(table.num_rows)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class ResultStore:
+    """
+    大结果的本地文件存储：把查询结果分批写入 Parquet/Arrow/CSV 文件，内存占用只与批大小有关，
+    之后可以按行范围读取，不需要把整个结果读进内存
+
+    每个结果一个数据文件和一个 JSON 元数据文件，文件名为随机 ID；超过有效期或总大小超过上限时删除最早的结果。
+    """
+
+    def __init__(self, directory: str, file_format: str = 'parquet', compression: Optional[str] = 'zstd',
+                 ttl: Optional[float] = 3600, max_bytes: Optional[int] = None):
+        """
+        Args:
+            directory: 保存结果的目录
+            file_format: parquet、arrow 或 csv，parquet 和 arrow 需要安装 pyarrow
+            compression: Parquet/Arrow 的压缩算法，例如 zstd、lz4，None 表示不压缩；CSV 不压缩
+            ttl: 结果的有效期(秒)，None 或 <=0 表示不过期
+            max_bytes: 所有结果文件的总大小上限(字节)，None 表示不限制
+        """
+        if file_format not in STORE_FORMATS:
+            raise ValueError(f"Unsupported result store format: {file_format}, expected one of {list(STORE_FORMATS)}")
+        if file_format != 'csv' and pa is None:
+            logger.warning(f"pyarrow is not installed, large results are stored as csv instead of {file_format}")
+            file_format = 'csv'
+        self.directory = directory
+        self.file_format = file_format
+        self.compression = compression or None
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _meta_path(self, result_id: str) -> str:
+        return os.path.join(self.directory, f"{result_id}.json")
+
+    def _data_path(self, result_id: str, file_format: str) -> str:
+        return os.path.join(self.directory, result_id + STORE_FORMATS[file_format])
+
+    def write(self, batches: Iterator[Tuple[List[str], List[tuple]]], sql_query: str = '') -> Dict[str, Any]:
+        """
+        分批写入一个查询结果
+
+        Args:
+            batches: 产出 (字段名, 一批行) 的迭代器，例如 HITLSQLDatabase.iter_batches
+            sql_query: 产生结果的SQL，记录在元数据中
+
+        Returns:
+            结果的元数据，包括 id、fields、rows、bytes 等
+        """
+        self.cleanup()
+        result_id = uuid.uuid4().hex
+        path = self._data_path(result_id, self.file_format)
+        tmp_path = path + '.tmp'
+        if self.file_format == 'csv':
+            writer = _CsvWriter(tmp_path)
+        else:
+            writer = _ArrowWriter(tmp_path, self.file_format, self.compression)
+        fields, row_count = [], 0
+        try:
+            for fields, rows in batches:
+                fields = _unique_names(fields)
+                writer.write(fields, rows)
+                row_count += len(rows)
+            writer.close()
+            os.replace(tmp_path, path)
+        except BaseException:
+            writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        now = time.time()
+        meta = {
+            "id": result_id,
+            "format": self.file_format,
+            "fields": fields,
+            "rows": row_count,
+            "bytes": os.path.getsize(path),
+            "chunks": getattr(writer, 'chunks', None),
+            "types": getattr(writer, 'types', None),
+            "sql": sql_query,
+            "created_at": now,
+            "expires_at": now + self.ttl if self.ttl is not None else None,
+        }
+        with open(self._meta_path(result_id), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return meta
+
+    def info(self, result_id: str) -> Dict[str, Any]:
+        """结果的元数据，不存在或已过期时抛出 KeyError"""
+        if not _RESULT_ID_PATTERN.match(result_id):
+            raise KeyError(result_id)
+        try:
+            with open(self._meta_path(result_id), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise KeyError(result_id)
+        if meta.get('expires_at') is not None and meta['expires_at'] < time.time():
+            raise KeyError(result_id)
+        return meta
+
+    def read(self, result_id: str, offset: int = 0, limit: int = 100) -> Tuple[List[str], List[tuple]]:
+        """
+        读取结果中 [offset, offset + limit) 范围的行
+
+        Parquet 和 Arrow 文件只读取与范围重叠的 row group/record batch；CSV 需要从头逐行跳过，按写入时记录的
+        字段类型恢复数字、日期等取值，非字符串字段的空值读为 NULL(字符串字段的 NULL 与空字符串无法区分)
+        """
+        meta = self.info(result_id)
+        path = self._data_path(result_id, meta['format'])
+        offset, limit = max(offset, 0), max(limit, 0)
+        end = min(offset + limit, meta['rows'])
+        if offset >= end:
+            return meta['fields'], []
+
+        if meta['format'] == 'csv':
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                rows = [tuple(row) for row in itertools.islice(reader, offset, end)]
+            return meta['fields'], self._convert_csv_rows(rows, meta.get('types'))
+
+        if meta['format'] == 'parquet':
+            parquet_file = pq.ParquetFile(path)
+            chunks = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+            read_chunk = parquet_file.read_row_group
+        else:
+            ipc_file = pa.ipc.open_file(pa.memory_map(path, 'r'))
+            chunks = meta['chunks']
+            read_chunk = ipc_file.get_batch
+
+        rows = []
+        start = 0
+        for i, num_rows in enumerate(chunks):
+            if start + num_rows > offset and start < end:
+                chunk = read_chunk(i).slice(max(offset - start, 0), end - max(offset, start))
+                rows.extend(zip(*[column.to_pylist() for column in chunk.columns]))
+            start += num_rows
+            if start >= end:
+                break
+        return meta['fields'], rows
+
+    @staticmethod
+    def _convert_csv_rows(rows: List[tuple], types: Optional[List[Optional[str]]]) -> List[tuple]:
+        """按写入时记录的字段类型转换 CSV 读出的字符串，早期没有记录类型的结果原样返回"""
+        if not types or len(rows) == 0 or all(t == 'str' for t in types):
+            return rows
+        converters = []
+        for column_type in types:
+            if column_type == 'str':
+                converters.append(None)
+            elif column_type is None:
+                # 写入时只出现过 NULL
+                converters.append(lambda v: None)
+            else:
+                convert = _CSV_CONVERTERS[column_type]
+                converters.append(lambda v, convert=convert: None if v == '' else convert(v))
+        return [tuple(value if converter is None else converter(value) for converter, value in zip(converters, row))
+                for row in rows]
+
+    def delete(self, result_id: str):
+        for name in os.listdir(self.directory):
+            if name.startswith(result_id + '.'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def cleanup(self):
+        """删除过期的结果；总大小超过上限时从最早的结果开始删除"""
+        now = time.time()
+        with self._lock:
+            results = []
+            for name in os.listdir(self.directory):
+                result_id, ext = os.path.splitext(name)
+                path = os.path.join(self.directory, name)
+                if ext == '.tmp':
+                    # 写入中断留下的临时文件
+                    if self.ttl is not None and os.path.getmtime(path) + self.ttl < now:
+                        os.remove(path)
+                    continue
+                if ext != '.json':
+                    continue
+                try:
+                    meta = self.info(result_id)
+                except KeyError:
+                    self.delete(result_id)
+                    continue
+                results.append(meta)
+            if self.max_bytes is None:
+                return
+            results.sort(key=lambda m: m['created_at'])
+            total = sum(m['bytes'] for m in results)
+            for meta in results:
+                if total <= self.max_bytes:
+                    break
+                self.delete(meta['id'])
+                total -= meta['bytes']
+
+    def stats(self) -> Dict[str, Any]:
+        count, total = 0, 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                count += 1
+            else:
+                total += os.path.getsize(os.path.join(self.directory, name))
+        return {"results": count, "bytes": total, "format": self.file_format}
@@ -0,0 +1,102 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+from .db_mschema import MSchema
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]+|[\u4e00-\u9fff]+')
+_CAMEL_PATTERN = re.compile(r'([a-z0-9])([A-Z])')
+
+
+def text_to_terms(text) -> List[str]:
+    """
+    把表名、字段名、注释、示例值或问题切分为检索词：
+    英文/数字按单词切分并补充字符 3-gram，中文按字符 2-gram 和 3-gram 切分，不依赖分词器
+    """
+    text = _CAMEL_PATTERN.sub(r'\1 \2', str(text)).replace('_', ' ').lower()
+    terms = []
+    for word in _WORD_PATTERN.findall(text):
+        if word.isascii():
+            terms.append(word)
+            if len(word) > 3:
+                terms.extend(word[i:i + 3] for i in range(len(word) - 2))
+        elif len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+            terms.extend(word[i:i + 3] for i in range(len(word) - 2))
+    return terms
+
+
+class SchemaLinker:
+    """
+    Schema linking：基于 BM25 为问题检索最相关的表
+
+    每张表的表名、注释、字段名、字段注释和示例值构成一篇文档，索引只在构建时计算一次，
+    检索时只对问题中出现的检索词打分。
+    """
+
+    def __init__(self, mschema: MSchema, k1: float = 1.5, b: float = 0.75):
+        self.version = mschema.version
+        self._k1 = k1
+        self._b = b
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._doc_len: Dict[str, int] = {}
+        self._neighbours: Dict[str, set] = defaultdict(set)
+
+        for table_name, table_info in mschema.tables.items():
+            terms = text_to_terms(table_name) + text_to_terms(table_info.get('comment') or '')
+            for field_name, field_info in table_info['fields'].items():
+                terms += text_to_terms(field_name) + text_to_terms(field_info.get('comment') or '')
+                for example in field_info.get('examples', []):
+                    terms += text_to_terms(example)
+            for term, tf in Counter(terms).items():
+                self._postings[term][table_name] = tf
+            self._doc_len[table_name] = len(terms)
+
+        for fk in mschema.foreign_keys:
+            if fk[0] in self._doc_len and fk[3] in self._doc_len:
+                self._neighbours[fk[0]].add(fk[3])
+                self._neighbours[fk[3]].add(fk[0])
+
+        self._avg_len = sum(self._doc_len.values()) / max(len(self._doc_len), 1)
+
+    def score(self, question: str) -> Dict[str, float]:
+        """问题与每张表的 BM25 得分，只包含得分大于 0 的表"""
+        scores = defaultdict(float)
+        n = len(self._doc_len)
+        for term in set(text_to_terms(question)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for table_name, tf in postings.items():
+                norm = self._k1 * (1 - self._b + self._b * self._doc_len[table_name] / self._avg_len)
+                scores[table_name] += idf * tf * (self._k1 + 1) / (tf + norm)
+        return dict(scores)
+
+    def select_tables(self, question: str, top_k: int = 8, max_tables: int = 0) -> List[str]:
+        """
+        选出与问题最相关的 top_k 张表，并补充与它们有外键关联的表以便生成 JOIN
+
+        Args:
+            question: 用户问题
+            top_k: 按得分选取的表数量
+            max_tables: 补充外键关联表后的表数量上限，<=0 时为 2 * top_k
+
+        Returns:
+            选中的表名，问题与所有表都不相关时返回空列表
+        """
+        scores = self.score(question)
+        ranked = sorted(scores.keys(), key=lambda t: (-scores[t], t))[:top_k]
+        max_tables = max_tables if max_tables > 0 else 2 * top_k
+
+        selected = list(ranked)
+        for table_name in ranked:
+            for neighbour in sorted(self._neighbours[table_name]):
+                if len(selected) >= max_tables:
+                    break
+                if neighbour not in selected:
+                    selected.append(neighbour)
+        return selected
@@ -0,0 +1,42 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from .db_mschema import MSchema
+from .file_util import read_json_file, write_json_to_file
+
+SNAPSHOT_VERSION = 1
+
+
+def table_fingerprint(table_meta: Dict[str, Any]) -> str:
+    """
+    表结构指纹：对表注释、字段定义(名称/类型/可空/默认值/注释/主键)和外键做哈希，
+    任意一项变化都会导致指纹变化
+    """
+    content = json.dumps(table_meta, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def save_snapshot(path: str, mschema: MSchema, fingerprints: Dict[str, str]):
+    """把 M-Schema 以及每张表的指纹写入快照文件"""
+    write_json_to_file(path, {
+        "version": SNAPSHOT_VERSION,
+        "fingerprints": fingerprints,
+        "mschema": mschema.dump(),
+    }, is_json_line=False)
+
+
+def load_snapshot(path: str) -> Tuple[Optional[MSchema], Dict[str, str]]:
+    """
+    读取快照文件，文件不存在、格式不对或版本不一致时返回 (None, {})
+    """
+    try:
+        data = read_json_file(path)
+    except Exception:
+        return None, {}
+    if not isinstance(data, dict) or data.get("version") != SNAPSHOT_VERSION:
+        return None, {}
+
+    mschema = MSchema()
+    mschema.load_dict(data.get("mschema", {}))
+    return mschema, data.get("fingerprints", {})
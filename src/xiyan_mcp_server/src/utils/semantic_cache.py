@@ -0,0 +1,173 @@
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .sql_cache import normalize_question
+
+_NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+_WORD_PATTERN = re.compile(r'[a-z0-9]+|[\u4e00-\u9fff]+')
+# 不影响问题含义的词，计算向量前去掉
+STOP_WORDS = ['查询', '请问', '请', '列出', '显示', '给出', '一下', '分别', '多少', '哪些', '什么',
+              '是', '的', '了', '在', '有', '和', '与', '及', '吗', '呢']
+# 改变SQL逻辑但字面上差别很小的词，两个问题包含的这些词不同时不能复用SQL
+OPERATOR_WORDS = ['最高', '最低', '最多', '最少', '最大', '最小', '最早', '最晚', '最近', '平均', '总数', '总和', '合计',
+                  '比例', '占比', '同比', '环比', '增长', '排名', '升序', '降序', '不', '没有', '未', '非',
+                  '以上', '以下', '超过', '低于', '大于', '小于', '之前', '之后', 'top', 'not']
+
+
+def literal_signature(question: str, values: Iterable[str] = ()) -> Tuple:
+    """
+    问题中的字面量签名：数字、取值索引匹配到的取值和运算词。签名不同的问题即使字面相似也不能复用SQL，
+    例如“2023年销量”和“2024年销量”
+    """
+    question = normalize_question(question)
+    return (tuple(sorted(set(_NUMBER_PATTERN.findall(question)))),
+            tuple(sorted(set(str(v).lower() for v in values))),
+            tuple(w for w in OPERATOR_WORDS if w in question))
+
+
+def question_terms(question: str) -> List[str]:
+    """问题的检索词：英文/数字按单词切分，中文取单字和字符 2-gram；换一种说法时 3-gram 几乎都会变化，所以不用"""
+    question = normalize_question(question)
+    for word in STOP_WORDS:
+        question = question.replace(word, ' ')
+    terms = []
+    for word in _WORD_PATTERN.findall(question):
+        if word.isascii():
+            terms.append(word)
+        else:
+            terms.extend(word)
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+class _Index:
+    """
+    一个 schema 版本下的问题向量矩阵
+
+    预先分配 max_entries 行，按环形缓冲区写入，满了之后覆盖最早写入的槽位，淘汰不需要移动矩阵；
+    问题和字面量签名到槽位的映射用字典维护，查找和删除不需要遍历。
+    """
+
+    def __init__(self, dim: int, max_entries: int):
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self.questions: List[Optional[str]] = [None] * max_entries
+        self.signatures: List[Optional[Tuple]] = [None] * max_entries
+        self.sqls: List[Optional[str]] = [None] * max_entries
+        self.slots: Dict[str, int] = {}
+        self.by_signature: Dict[Tuple, Set[int]] = {}
+        # 下一个写入的槽位
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def put(self, question: str, signature: Tuple, sql_query: str, vector: np.ndarray):
+        if question in self.slots:
+            self.remove(question)
+        slot = self.cursor
+        if self.questions[slot] is not None:
+            self.remove(self.questions[slot])
+        self.cursor = (slot + 1) % len(self.questions)
+        self.vectors[slot] = vector
+        self.questions[slot], self.signatures[slot], self.sqls[slot] = question, signature, sql_query
+        self.slots[question] = slot
+        self.by_signature.setdefault(signature, set()).add(slot)
+
+    def remove(self, question: str):
+        slot = self.slots.pop(question, None)
+        if slot is None:
+            return
+        signature = self.signatures[slot]
+        slots = self.by_signature[signature]
+        slots.discard(slot)
+        if len(slots) == 0:
+            del self.by_signature[signature]
+        self.questions[slot] = self.signatures[slot] = self.sqls[slot] = None
+
+
+class SemanticCache:
+    """
+    语义问题缓存：用哈希字符 n-gram 向量表示问题(不依赖模型)，为措辞不同但意思相同的问题复用已验证的SQL
+
+    每个 (schema 版本, 模型) 一个 NumPy 矩阵，检索时只与字面量签名相同的问题向量做矩阵乘法求余弦相似度，
+    相似度不低于阈值时才命中，命中的SQL仍然在数据库上执行，返回的是最新数据。
+    lookup/add 包含矩阵运算，在异步代码中应放到线程池中调用。
+    """
+
+    def __init__(self, threshold: float = 0.85, dim: int = 4096, max_entries: int = 10000):
+        """
+        Args:
+            threshold: 余弦相似度阈值
+            dim: 哈希向量的维数
+            max_entries: 每个 schema 版本最多保存的问题数，超过后淘汰最早加入的问题
+        """
+        self.threshold = threshold
+        self.dim = dim
+        self.max_entries = max(1, max_entries)
+        self._indexes: Dict[str, _Index] = {}
+        self._lock = threading.Lock()
+
+    def embed(self, question: str) -> np.ndarray:
+        """问题的哈希 n-gram 向量，词频取对数，L2 归一化"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term, tf in Counter(question_terms(question)).items():
+            # crc32 在不同进程间稳定，内置 hash 每次启动都不同
+            vector[zlib.crc32(term.encode('utf-8')) % self.dim] += 1 + np.log(tf)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, namespace: str, question: str, signature: Tuple) -> Optional[Tuple[str, float, str]]:
+        """
+        查找相似的问题
+
+        Args:
+            namespace: schema 版本和模型组成的命名空间
+            question: 用户问题
+            signature: literal_signature 计算的字面量签名
+
+        Returns:
+            (SQL, 相似度, 缓存中的问题)，未命中时返回 None
+        """
+        vector = self.embed(question)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None or signature not in index.by_signature:
+                return None
+            candidates = np.fromiter(index.by_signature[signature], dtype=np.intp)
+            similarities = index.vectors[candidates] @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            slot = candidates[best]
+            return index.sqls[slot], float(similarities[best]), index.questions[slot]
+
+    def add(self, namespace: str, question: str, signature: Tuple, sql_query: str):
+        """加入执行成功的问题和SQL，相同的问题会覆盖旧的SQL"""
+        vector = self.embed(question)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = _Index(self.dim, self.max_entries)
+            index.put(normalize_question(question), signature, sql_query, vector)
+
+    def remove(self, namespace: str, question: str):
+        """删除缓存的问题，命中的SQL执行失败时调用"""
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is not None:
+                index.remove(normalize_question(question))
+
+    def retain(self, namespace: str):
+        """只保留当前命名空间，表结构变化后旧版本的问题不会再被命中"""
+        with self._lock:
+            for key in [k for k in self._indexes if k != namespace]:
+                del self._indexes[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {namespace: len(index) for namespace, index in self._indexes.items()}
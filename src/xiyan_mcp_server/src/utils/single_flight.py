@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    请求合并(single-flight)：同一个 key 同时只执行一次，执行期间到达的相同请求等待并共享同一个结果或异常
+
+    用于线程中的阻塞调用，例如构建 M-Schema。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        # 共享了其他请求结果的次数
+        self.shared = 0
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的协程版本，例如合并并发的相同问题
+
+    共享的计算在独立的 Task 中执行，某个等待者被取消(客户端断开)不会取消其他等待者的计算。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        # 共享了其他请求结果的次数
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._calls.pop(key) if self._calls.get(key) is f else None)
+        else:
+            self.shared += 1
+        return await asyncio.shield(future)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,122 @@
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Tuple
+
+from .file_util import valid_path
+
+_TRAILING_PUNCTUATION = '?？。.!！;；'
+
+
+def normalize_question(question: str) -> str:
+    """
+    规范化问题，用作缓存的键：全角转半角(NFKC)、转小写、合并空白、去掉末尾的标点
+    """
+    question = unicodedata.normalize('NFKC', question).lower()
+    question = re.sub(r'\s+', ' ', question).strip()
+    return question.rstrip(_TRAILING_PUNCTUATION).strip()
+
+
+class SQLCache:
+    """
+    问题 -> SQL 的持久化缓存
+
+    以 (规范化后的问题, 表结构版本, 模型名) 为键保存执行成功的最终SQL，保存在本地 SQLite 文件中，重启后仍然有效。
+    命中时直接执行缓存的SQL，跳过模型生成和修复。
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        """
+        Args:
+            path: 缓存文件路径
+            max_entries: 最多保存的条数，超过后删除最久未使用的条目
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        valid_path(path)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS sql_cache (
+                                question TEXT, schema_version TEXT, model TEXT, raw_question TEXT, sql TEXT,
+                                hits INTEGER DEFAULT 0, created_at REAL, last_used REAL,
+                                PRIMARY KEY (question, schema_version, model))""")
+            conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, question: str, schema_version: str, model: str) -> Optional[str]:
+        """查找缓存的SQL，未命中时返回 None"""
+        key = (normalize_question(question), schema_version, model)
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute("SELECT sql FROM sql_cache WHERE question = ? AND schema_version = ? AND model = ?",
+                                   key).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE sql_cache SET hits = hits + 1, last_used = ? "
+                                 "WHERE question = ? AND schema_version = ? AND model = ?", (time.time(),) + key)
+                    conn.commit()
+        except sqlite3.Error:
+            # 缓存文件损坏或被锁住时当作未命中，不影响问答
+            row = None
+        with self._lock:
+            if row is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return None if row is None else row[0]
+
+    def put(self, question: str, schema_version: str, model: str, sql_query: str):
+        """保存执行成功的SQL"""
+        now = time.time()
+        try:
+            with self._lock, closing(self._connect()) as conn:
+                conn.execute("INSERT OR REPLACE INTO sql_cache "
+                             "(question, schema_version, model, raw_question, sql, hits, created_at, last_used) "
+                             "VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+                             (normalize_question(question), schema_version, model, question, sql_query, now, now))
+                conn.execute("DELETE FROM sql_cache WHERE rowid IN (SELECT rowid FROM sql_cache "
+                             "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+                conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def evict(self, question: str, schema_version: str, model: str):
+        """删除缓存的SQL，缓存的SQL执行失败(例如数据被迁移)时调用"""
+        try:
+            with self._lock, closing(self._connect()) as conn:
+                conn.execute("DELETE FROM sql_cache WHERE question = ? AND schema_version = ? AND model = ?",
+                             (normalize_question(question), schema_version, model))
+                conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def entries(self, schema_version: str, model: str) -> List[Tuple[str, str]]:
+        """某个表结构版本和模型下缓存的 (原始问题, SQL)，用于预热语义缓存"""
+        try:
+            with closing(self._connect()) as conn:
+                return conn.execute("SELECT raw_question, sql FROM sql_cache WHERE schema_version = ? AND model = ? "
+                                    "ORDER BY last_used", (schema_version, model)).fetchall()
+        except sqlite3.Error:
+            return []
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            with closing(self._connect()) as conn:
+                entries = conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total > 0 else None,
+            }
@@ -0,0 +1,129 @@
+from typing import Dict, List, Optional, Set
+
+from .db_mschema import MSchema
+from .db_util import normalize_sql
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+except ImportError:  # 未安装 sqlglot 时不做本地校验
+    sqlglot = None
+
+# 数据库方言名 -> sqlglot 方言名
+SQLGLOT_DIALECTS = {'mysql': 'mysql', 'postgresql': 'postgres', 'sqlite': 'sqlite'}
+# 不出现在 M-Schema 中但数据库可以直接使用的隐藏字段
+PSEUDO_COLUMNS = {'rowid', '_rowid_', 'oid', 'ctid'}
+
+_schema_indexes: Dict[str, Dict[str, Dict[str, str]]] = {}
+
+
+def is_available() -> bool:
+    return sqlglot is not None
+
+
+def _schema_index(mschema: MSchema) -> Dict[str, Dict[str, str]]:
+    """{小写表名: {小写字段名: 字段名}}，按 M-Schema 版本缓存"""
+    version = mschema.version
+    index = _schema_indexes.get(version)
+    if index is None:
+        index = {table_name.lower(): {field.lower(): field for field in table_info['fields']}
+                 for table_name, table_info in mschema.tables.items()}
+        if len(_schema_indexes) >= 4:
+            _schema_indexes.clear()
+        _schema_indexes[version] = index
+    return index
+
+
+def _parse_error_info(e: 'ParseError') -> str:
+    # 不使用 str(e)，其中带有终端下划线控制字符
+    messages = []
+    for error in e.errors[:3]:
+        messages.append(f"{error.get('description')} (第 {error.get('line')} 行第 {error.get('col')} 列，"
+                        f"附近: {error.get('start_context', '')}{error.get('highlight', '')})")
+    return "SQL语法错误: " + "; ".join(messages) if messages else f"SQL语法错误: {e}"
+
+
+def _names_hint(names: List[str]) -> str:
+    return ", ".join(names[:50]) + (" ..." if len(names) > 50 else "")
+
+
+def validate_sql(sql_query: str, mschema: MSchema, dialect: str) -> Optional[str]:
+    """
+    不访问数据库，在本地校验SQL：按方言解析语法，并检查表名、字段名是否存在于 M-Schema 中
+
+    只报告能确定的错误：带子查询、CTE 的语句不检查不带表名前缀的字段，无法判断时视为通过，
+    最终仍以数据库的执行结果为准
+
+    Args:
+        sql_query: SQL
+        mschema: M-Schema
+        dialect: 数据库方言名，例如 mysql、postgresql、sqlite
+
+    Returns:
+        错误信息，校验通过或无法校验时返回 None
+    """
+    read = SQLGLOT_DIALECTS.get(dialect.lower())
+    if sqlglot is None or read is None:
+        return None
+    try:
+        statements = [s for s in sqlglot.parse(sql_query, read=read) if s is not None]
+    except ParseError as e:
+        return _parse_error_info(e)
+    except Exception:
+        # sqlglot 不支持的写法(例如某些方言函数)，交给数据库判断
+        return None
+
+    index = _schema_index(mschema)
+    for statement in statements:
+        cte_names = {cte.alias.lower() for cte in statement.find_all(exp.CTE)}
+        # 别名(或表名) -> 小写表名，只包含 M-Schema 中的表
+        aliases: Dict[str, str] = {}
+        for table in statement.find_all(exp.Table):
+            if not isinstance(table.this, exp.Identifier):
+                continue  # 表函数，例如 generate_series(...)
+            name = table.name.lower()
+            if name in cte_names:
+                continue
+            if name not in index:
+                if table.db and (not mschema.schema or table.db.lower() != mschema.schema.lower()):
+                    continue  # 其他 schema/库中的表，M-Schema 中没有记录
+                return f"表 {table.name} 不存在，可用的表有: {_names_hint(list(mschema.tables.keys()))}"
+            aliases[table.alias_or_name.lower()] = name
+
+        has_derived_tables = len(cte_names) > 0 or any(True for _ in statement.find_all(exp.Subquery))
+        select_aliases: Set[str] = {alias.alias.lower() for alias in statement.find_all(exp.Alias)}
+        for column in statement.find_all(exp.Column):
+            if not isinstance(column.this, exp.Identifier):
+                continue  # 例如 t.*
+            column_name = column.name.lower()
+            if column_name in PSEUDO_COLUMNS:
+                continue
+            if read == 'sqlite' and column.this.quoted:
+                continue  # SQLite 把找不到字段的双引号标识符当作字符串
+            qualifier = column.table.lower()
+            if qualifier:
+                table_name = aliases.get(qualifier)
+                if table_name is not None and column_name not in index[table_name]:
+                    return (f"字段 {column.table}.{column.name} 不存在，表 {table_name} 的字段有: "
+                            f"{_names_hint(list(index[table_name].values()))}")
+            elif not has_derived_tables and len(aliases) > 0 and column_name not in select_aliases \
+                    and not any(column_name in index[t] for t in aliases.values()):
+                return (f"字段 {column.name} 不存在于查询的表 {', '.join(sorted(set(aliases.values())))} 中，"
+                        f"请检查字段名")
+    return None
+
+
+def canonical_sql(sql_query: str, dialect: str) -> str:
+    """
+    SQL 的规范形式，用于比较两条SQL是否相同：能解析时使用 sqlglot 重新生成的SQL，
+    空白、大小写和运算符两侧的空格都不影响比较；否则使用 normalize_sql
+    """
+    read = SQLGLOT_DIALECTS.get(dialect.lower())
+    if sqlglot is not None and read is not None:
+        try:
+            return ';'.join(s.sql(dialect=read, normalize=True) for s in sqlglot.parse(sql_query, read=read)
+                            if s is not None)
+        except Exception:
+            pass
+    return normalize_sql(sql_query)
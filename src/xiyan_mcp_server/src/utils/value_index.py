@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .file_util import valid_path
+
+TEXT_TYPES = ['CHAR', 'TEXT', 'STRING', 'CLOB']
+
+
+def value_to_grams(value: str) -> List[str]:
+    """取值的字符 2-gram，作为倒排索引的检索词"""
+    value = value.lower()
+    return sorted(set(value[i:i + 2] for i in range(len(value) - 1)))
+
+
+def text_columns(tables: Dict[str, Dict]) -> List[str]:
+    """M-Schema 中所有文本类型的字段，格式 ['table_name.column_name']"""
+    columns = []
+    for table_name, table_info in tables.items():
+        for field_name, field_info in table_info['fields'].items():
+            field_type = field_info.get('type', '').upper()
+            if any(t in field_type for t in TEXT_TYPES):
+                columns.append(f"{table_name}.{field_name}")
+    return columns
+
+
+class ValueIndex:
+    """
+    字段取值索引，用于把问题中的字面量（人名、地名、状态等）链接到包含它的 table.column
+
+    索引保存在本地 SQLite 文件中：value_entries 保存 (表, 字段, 取值)，grams 是取值的字符 2-gram 倒排表。
+    构建时分批读取每个字段的不同取值，内存占用只与批大小有关；构建写入临时文件，完成后原子替换，
+    查询不会读到构建了一半的索引。
+    """
+
+    def __init__(self, path: str, max_values_per_column: int = 100000, max_value_length: int = 64,
+                 chunk_size: int = 5000):
+        """
+        Args:
+            path: 索引文件路径
+            max_values_per_column: 每个字段最多索引的取值个数
+            max_value_length: 超过该长度的取值（长文本）不做索引
+            chunk_size: 从数据库分批读取取值的批大小
+        """
+        self.path = path
+        self.max_values_per_column = max_values_per_column
+        self.max_value_length = max_value_length
+        self.chunk_size = chunk_size
+        self._build_lock = threading.Lock()
+
+    def is_ready(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _meta(self) -> Dict[str, str]:
+        if not self.is_ready():
+            return {}
+        with closing(sqlite3.connect(self.path)) as conn:
+            try:
+                return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            except sqlite3.Error:
+                return {}
+
+    def needs_build(self, columns: List[str], max_age: Optional[float] = None) -> bool:
+        """索引不存在、字段集合变化或超过 max_age 秒时需要重新构建"""
+        meta = self._meta()
+        if len(meta) == 0 or json.loads(meta.get('columns', '[]')) != sorted(columns):
+            return True
+        return max_age is not None and max_age > 0 and time.time() - float(meta.get('built_at', 0)) > max_age
+
+    def build(self, columns: List[str], iter_values):
+        """
+        构建索引
+
+        Args:
+            columns: 需要索引的字段，格式 ['table_name.column_name']
+            iter_values: 函数 (table_name, column_name, chunk_size, max_values) -> 迭代器，每次产出一批取值
+        """
+        with self._build_lock:
+            valid_path(self.path)
+            tmp_path = f"{self.path}.building"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+            conn = sqlite3.connect(tmp_path)
+            try:
+                conn.execute("PRAGMA journal_mode = OFF")
+                conn.execute("PRAGMA synchronous = OFF")
+                conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute("CREATE TABLE value_entries (id INTEGER PRIMARY KEY, table_name TEXT, "
+                             "column_name TEXT, value TEXT, gram_count INTEGER)")
+                conn.execute("CREATE TABLE grams (gram TEXT, value_id INTEGER)")
+
+                next_id = 1
+                for column in sorted(columns):
+                    table_name, column_name = column.split('.', 1)
+                    for chunk in iter_values(table_name, column_name, self.chunk_size, self.max_values_per_column):
+                        entries, grams = [], []
+                        for value in chunk:
+                            value = str(value).strip()
+                            if len(value) < 2 or len(value) > self.max_value_length:
+                                continue
+                            value_grams = value_to_grams(value)
+                            entries.append((next_id, table_name, column_name, value, len(value_grams)))
+                            grams.extend((gram, next_id) for gram in value_grams)
+                            next_id += 1
+                        conn.executemany("INSERT INTO value_entries VALUES (?, ?, ?, ?, ?)", entries)
+                        conn.executemany("INSERT INTO grams VALUES (?, ?)", grams)
+                        conn.commit()
+
+                # 数据写完后再建索引，比边写边维护索引快
+                conn.execute("CREATE INDEX idx_grams_gram ON grams (gram)")
+                conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                    ('columns', json.dumps(sorted(columns), ensure_ascii=False)),
+                    ('built_at', str(time.time())),
+                    ('value_count', str(next_id - 1)),
+                ])
+                conn.commit()
+            finally:
+                conn.close()
+            os.replace(tmp_path, self.path)
+
+    def lookup(self, question: str, limit: int = 10) -> List[Tuple[str, str, str]]:
+        """
+        查找问题中出现的字段取值
+
+        Returns:
+            [(value, table_name, column_name)]，按取值长度从长到短排列
+        """
+        if not self.is_ready():
+            return []
+        question_grams = value_to_grams(question)
+        if len(question_grams) == 0:
+            return []
+
+        placeholders = ','.join('?' * len(question_grams))
+        lowered_question = question.lower()
+        try:
+            with closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)) as conn:
+                rows = conn.execute(f"""
+                    SELECT v.value, v.table_name, v.column_name
+                    FROM (SELECT value_id, COUNT(*) AS hit FROM grams WHERE gram IN ({placeholders}) GROUP BY value_id) g
+                    JOIN value_entries v ON v.id = g.value_id
+                    WHERE g.hit = v.gram_count
+                """, question_grams).fetchall()
+        except sqlite3.Error:
+            # 索引损坏或正在被替换时不影响问答，只是没有取值提示
+            return []
+
+        # 所有 2-gram 都命中还不够，取值必须完整出现在问题中
+        rows = [row for row in rows if row[0].lower() in lowered_question]
+        rows.sort(key=lambda row: (-len(row[0]), row[1], row[2]))
+        # 已匹配到更长的取值时，忽略它的子串，例如匹配到“大学10”后不再提示“大学1”
+        matches = []
+        for row in rows:
+            value = row[0].lower()
+            if any(value != m[0].lower() and value in m[0].lower() for m in matches):
+                continue
+            matches.append(row)
+        return matches[:limit]
+
+
+def value_hints(matches: Iterable[Tuple[str, str, str]]) -> str:
+    """把取值匹配结果转换为 prompt 中的提示"""
+    return '\n'.join(f"{value} 是 {table_name}.{column_name} 的取值" for value, table_name, column_name in matches)
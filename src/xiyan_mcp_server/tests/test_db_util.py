@@ -0,0 +1,74 @@
+import pytest
+
+from utils.db_util import paginate_sql, push_down_limit, split_row_limit
+
+
+@pytest.mark.parametrize("sql_query, expected", [
+    ("SELECT * FROM t", ("SELECT * FROM t", None, 0, "")),
+    ("SELECT * FROM t LIMIT 10", ("SELECT * FROM t", 10, 0, "")),
+    ("select * from t limit 10", ("select * from t", 10, 0, "")),
+    ("SELECT * FROM t LIMIT 10 OFFSET 5", ("SELECT * FROM t", 10, 5, "")),
+    ("SELECT * FROM t LIMIT 5, 10", ("SELECT * FROM t", 10, 5, "")),
+    ("SELECT * FROM t OFFSET 5 LIMIT 10", ("SELECT * FROM t", 10, 5, "")),
+    ("SELECT * FROM t FETCH FIRST 10 ROWS ONLY", ("SELECT * FROM t", 10, 0, "")),
+    ("SELECT * FROM t OFFSET 5 ROWS FETCH NEXT 10 ROWS ONLY", ("SELECT * FROM t", 10, 5, "")),
+    ("SELECT * FROM t FETCH FIRST ROW ONLY", ("SELECT * FROM t", 1, 0, "")),
+    ("SELECT * FROM t LIMIT 10 FOR UPDATE", ("SELECT * FROM t", 10, 0, " FOR UPDATE")),
+    ("SELECT * FROM t FOR SHARE NOWAIT", ("SELECT * FROM t", None, 0, " FOR SHARE NOWAIT")),
+    ("SELECT * FROM t LIMIT ALL", ("SELECT * FROM t", None, 0, "")),
+    ("SELECT * FROM t LIMIT ALL OFFSET 5", ("SELECT * FROM t", None, 5, "")),
+    ("SELECT * FROM t OFFSET 5 LIMIT ALL", ("SELECT * FROM t", None, 5, "")),
+    # 子查询中的 LIMIT 不是语句的行数限制
+    ("SELECT * FROM (SELECT * FROM t LIMIT 3) s", ("SELECT * FROM (SELECT * FROM t LIMIT 3) s", None, 0, "")),
+])
+def test_split_row_limit(sql_query, expected):
+    assert split_row_limit(sql_query) == expected
+
+
+@pytest.mark.parametrize("sql_query, dialect, expected", [
+    ("SELECT * FROM t", "mysql", "SELECT * FROM t LIMIT 100;"),
+    ("SELECT * FROM t;", "mysql", "SELECT * FROM t LIMIT 100;"),
+    ("SELECT * FROM t -- all rows", "mysql", "SELECT * FROM t LIMIT 100;"),
+    ("SELECT * FROM t LIMIT 10;", "mysql", "SELECT * FROM t LIMIT 10;"),
+    ("SELECT * FROM t LIMIT 500", "mysql", "SELECT * FROM t LIMIT 100;"),
+    ("SELECT * FROM t LIMIT 5, 500", "mysql", "SELECT * FROM t LIMIT 100 OFFSET 5;"),
+    ("SELECT * FROM t OFFSET 5 LIMIT 10", "postgresql", "SELECT * FROM t LIMIT 10 OFFSET 5;"),
+    ("SELECT * FROM t FETCH FIRST 500 ROWS ONLY", "postgresql", "SELECT * FROM t LIMIT 100;"),
+    ("SELECT * FROM t FOR UPDATE", "mysql", "SELECT * FROM t LIMIT 100 FOR UPDATE;"),
+    ("SELECT * FROM t LIMIT ALL", "postgresql", "SELECT * FROM t LIMIT 100;"),
+    ("SELECT * FROM t LIMIT ALL OFFSET 5;", "postgresql", "SELECT * FROM t LIMIT 100 OFFSET 5;"),
+    ("WITH s AS (SELECT 1) SELECT * FROM s", "sqlite", "WITH s AS (SELECT 1) SELECT * FROM s LIMIT 100;"),
+    ("UPDATE t SET a = 1", "mysql", "UPDATE t SET a = 1;"),
+    ("SELECT * FROM t", "oracle", "SELECT * FROM t;"),
+])
+def test_push_down_limit(sql_query, dialect, expected):
+    assert push_down_limit(sql_query, 100, dialect) == expected
+
+
+@pytest.mark.parametrize("sql_query, limit, offset, dialect, expected", [
+    ("SELECT * FROM t", 50, 100, "mysql", "SELECT * FROM t LIMIT 50 OFFSET 100;"),
+    ("SELECT * FROM t;", 50, 0, "mysql", "SELECT * FROM t LIMIT 50;"),
+    ("SELECT * FROM t LIMIT 120;", 50, 100, "mysql", "SELECT * FROM t LIMIT 20 OFFSET 100;"),
+    ("SELECT * FROM t LIMIT 120", 50, 150, "mysql", "SELECT * FROM t LIMIT 0 OFFSET 150;"),
+    ("SELECT * FROM t LIMIT 10, 120", 50, 0, "mysql", "SELECT * FROM t LIMIT 50 OFFSET 10;"),
+    ("SELECT * FROM t OFFSET 10 LIMIT 120", 50, 100, "postgresql", "SELECT * FROM t LIMIT 20 OFFSET 110;"),
+    ("SELECT * FROM t OFFSET 10 ROWS FETCH FIRST 120 ROWS ONLY", 50, 100, "postgresql",
+     "SELECT * FROM t LIMIT 20 OFFSET 110;"),
+    ("SELECT * FROM t FOR UPDATE", 50, 0, "mysql", "SELECT * FROM t LIMIT 50 FOR UPDATE;"),
+    ("SELECT * FROM t LIMIT ALL", 50, 100, "postgresql", "SELECT * FROM t LIMIT 50 OFFSET 100;"),
+    ("SELECT * FROM t LIMIT ALL OFFSET 10;", 50, 100, "postgresql", "SELECT * FROM t LIMIT 50 OFFSET 110;"),
+    # 连接查询中的重名字段：不包子查询，直接改写末尾的 LIMIT/OFFSET
+    ("SELECT a.id, b.id FROM a JOIN b ON a.id = b.a_id ORDER BY a.id", 10, 20, "sqlite",
+     "SELECT a.id, b.id FROM a JOIN b ON a.id = b.a_id ORDER BY a.id LIMIT 10 OFFSET 20;"),
+])
+def test_paginate_sql(sql_query, limit, offset, dialect, expected):
+    assert paginate_sql(sql_query, limit, offset, dialect) == expected
+
+
+@pytest.mark.parametrize("sql_query, dialect", [
+    ("UPDATE t SET a = 1", "mysql"),
+    ("SELECT * FROM t", "oracle"),
+])
+def test_paginate_sql_unsupported(sql_query, dialect):
+    with pytest.raises(ValueError):
+        paginate_sql(sql_query, 10, 0, dialect)